@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoint import RunJournal
+from config import BATCH_WORKERS, LLM_BATCH_COST_BUDGET, LLM_BATCH_TOKEN_BUDGET
+from instrumentation import metrics
+from model_routing import llm_budget
+from pipeline import generate_book_playlists
+from playlist_config import get_config_store, load_config_source, resolve_config_sources, validate_config
+
+
+def job_status(playlist_urls):
+    """Outcome of a book run from its playlist URLs, one per chapter (None where creation failed)."""
+    if not playlist_urls:
+        return "failed"
+    return "succeeded" if all(playlist_urls) else "partial"
+
+
+def run_job(sp, source, available_genres, resume=False):
+    """
+    Generate the playlists for one configuration file or saved configuration and describe the outcome.
+
+    Progress is checkpointed; with `resume`, an unfinished checkpoint of the same configuration is continued.
+    """
+    try:
+        config, config_name = load_config_source(source)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.error(f"Job for {source} failed: {e}")
+        return {"config": source, "status": "failed", "playlist_urls": [], "errors": [str(e)], "duration_seconds": 0.0}
+    return run_config_job(sp, config, available_genres, resume, source=source, config_name=config_name)
+
+
+def run_config_job(sp, config, available_genres, resume=False, source=None, config_name=None):
+    """
+    Like run_job for a configuration that is already loaded; `source` names it in the result and the log.
+
+    When `config_name` is given, the run is recorded against that saved configuration.
+    """
+    source = source or (config.get('book_title') if isinstance(config, dict) else None)
+    job = {"config": source, "status": "failed", "playlist_urls": [], "errors": []}
+    started = time.perf_counter()
+    try:
+        job["book_title"] = config.get('book_title') if isinstance(config, dict) else None
+        problems = validate_config(config)
+        if problems:
+            job["errors"] = problems
+            logging.error(f"Skipping invalid configuration {source}: {'; '.join(problems)}")
+            return job
+
+        journal = RunJournal.open(config) if resume else None
+        if journal and journal.finished:
+            logging.info(f"'{config['book_title']}' already finished in run {journal.run_id}.")
+            playlist_urls = journal.playlist_urls()
+        else:
+            if journal:
+                logging.info(f"Resuming run {journal.run_id} for '{config['book_title']}' ({source}).")
+            else:
+                journal = RunJournal.start(config)
+                logging.info(f"Starting job for '{config['book_title']}' ({source}).")
+            playlist_urls = generate_book_playlists(sp, config, available_genres, journal)
+        job["run_id"] = journal.run_id
+        job["playlist_urls"] = [url for url in playlist_urls if url]
+        job["chapters"] = len(playlist_urls)
+        job["status"] = job_status(playlist_urls)
+        if not playlist_urls:
+            job["errors"].append("No chapters were extracted.")
+        if config_name:
+            get_config_store().record_run(config_name, len(playlist_urls), job["status"])
+    except Exception as e:
+        logging.error(f"Job for {source} failed: {e}")
+        job["errors"].append(str(e))
+    finally:
+        job["duration_seconds"] = time.perf_counter() - started
+        logging.info(f"Finished job {source}: {job['status']} ({len(job['playlist_urls'])} playlists).")
+    return job
+
+
+def run_batch(sp, targets, available_genres, workers=BATCH_WORKERS, resume=False):
+    """
+    Run every configuration found in `targets` (every saved configuration if empty) as a job on a pool of `workers` threads.
+
+    All jobs share the Spotify client, the genre list, the caches and the Spotify rate limiter.
+    With `resume`, jobs continue their unfinished checkpoints. All jobs share one LLM budget of
+    LLM_BATCH_TOKEN_BUDGET tokens and LLM_BATCH_COST_BUDGET dollars, on top of each run's own budget.
+    Returns a summary report with one entry per job.
+    """
+    sources = resolve_config_sources(targets)
+    logging.info(f"Running {len(sources)} jobs with {workers} workers.")
+    started = time.perf_counter()
+    with llm_budget("batch", LLM_BATCH_TOKEN_BUDGET, LLM_BATCH_COST_BUDGET) as budget, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, run_job, sp, source, available_genres, resume)
+                   for source in sources]
+        jobs = [future.result() for future in futures]
+
+    statuses = [job["status"] for job in jobs]
+    return {
+        "jobs": jobs,
+        "total": len(jobs),
+        "succeeded": statuses.count("succeeded"),
+        "partial": statuses.count("partial"),
+        "failed": statuses.count("failed"),
+        # A single book playlist is listed once per chapter
+        "playlists_created": sum(len(set(job["playlist_urls"])) for job in jobs),
+        "duration_seconds": time.perf_counter() - started,
+        "llm_usage": budget.summary(),
+        "metrics": metrics.report(),
+    }
+
+
+def write_batch_report(report, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Batch report written to {path}")
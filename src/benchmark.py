@@ -0,0 +1,162 @@
+"""
+Offline end-to-end benchmark of the chapter pipeline.
+
+Runs the same streaming extraction and chapter pipeline as main.py against the stand-ins in
+fake_apis for books of several sizes, then reports per-stage latency percentiles, API call
+counts and throughput. No credentials or network access are needed. Exits with status 1 when
+a chapter gets no playlist or Spotify call counts exceed their expected bounds (see check_result).
+
+Usage:
+    python src/benchmark.py --chapters 5 50 500 --output bench_report.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Benchmarks start cold and must not touch the user's caches, so configure them before the project modules load
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="playlist-benchmark-")
+os.environ["LLM_CACHE_MODE"] = "off"
+
+import fake_apis
+import langchain_utils
+import pipeline
+import spotify_utils
+from instrumentation import metrics
+from rate_limiter import TokenBucket
+
+class FirstPlaylistTimer:
+    """Records how long after the start of a run the first playlist was created."""
+
+    def __init__(self, func):
+        self.func = func
+        self.started = time.perf_counter()
+        self.first_playlist = None
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        result = self.func(*args, **kwargs)
+        with self._lock:
+            if self.first_playlist is None:
+                self.first_playlist = time.perf_counter() - self.started
+        return result
+
+
+def run_book(num_chapters, spotify, verbose=False):
+    fake_apis.llm_settings["num_chapters"] = num_chapters
+    fake_apis.llm_stats.reset()
+    spotify.stats.reset()
+    spotify_utils.get_seed_cache().clear()
+    spotify_utils.get_recommendation_cache().clear()
+    spotify_utils.get_track_index().clear()
+    metrics.reset()
+
+    create_playlist = pipeline.create_playlist_with_description
+    timer = FirstPlaylistTimer(create_playlist)
+    pipeline.create_playlist_with_description = timer
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            chapters = langchain_utils.stream_chapter_info(f"Benchmark Book {num_chapters}", "Offline benchmark run.")
+            available_genres = spotify_utils.get_available_genre_seeds(spotify)
+            playlist_urls = pipeline.process_chapter_stream(spotify, f"Benchmark Book {num_chapters}", chapters,
+                                                            "Instrumental, cinematic", available_genres, "b", "")
+            wall_seconds = time.perf_counter() - timer.started
+    finally:
+        pipeline.create_playlist_with_description = create_playlist
+
+    report = metrics.report()
+    return {
+        "chapters": num_chapters,
+        "playlists_created": sum(1 for url in playlist_urls if url),
+        "wall_seconds": wall_seconds,
+        "time_to_first_playlist": timer.first_playlist,
+        "throughput_chapters_per_second": num_chapters / wall_seconds if wall_seconds else None,
+        "stages": report["spans"],
+        "counters": report["counters"],
+        "spotify": spotify.stats.summary(),
+        "openai": fake_apis.llm_stats.summary(),
+    }
+
+
+def print_report(result):
+    print(f"\n=== {result['chapters']} chapters ===")
+    print(f"Wall time: {result['wall_seconds']:.2f}s, playlists: {result['playlists_created']}, "
+          f"throughput: {result['throughput_chapters_per_second']:.2f} chapters/s, "
+          f"first playlist after {result['time_to_first_playlist'] or 0:.2f}s")
+    print(f"{'stage':<22}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<22}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p90']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+    for api in ("spotify", "openai"):
+        print(f"{api} calls: {result[api]['calls']}")
+        if result[api]["rate_limited"]:
+            print(f"{api} 429s: {result[api]['rate_limited']}")
+    if result["openai"]["tokens"]:
+        print(f"openai tokens: {result['openai']['tokens']}")
+
+
+def check_result(result):
+    """
+    Problems with a run: chapters left without a playlist, or Spotify call counts above what the
+    pipeline should need. Call counts are not checked when rate limiting made calls repeat.
+    """
+    chapters = result["chapters"]
+    problems = []
+    if result["playlists_created"] < chapters:
+        problems.append(f"{chapters - result['playlists_created']} of {chapters} chapters got no playlist")
+    if result["spotify"]["rate_limited"]:
+        return problems
+    limits = {"recommendations": 2 * chapters, "audio_features": 2 * chapters, "user_playlist_create": chapters,
+              "playlist_add_items": chapters, "me": 1, "recommendation_genre_seeds": 1}
+    for name, limit in limits.items():
+        calls = result["spotify"]["calls"].get(name, 0)
+        if calls > limit:
+            problems.append(f"{calls} {name} calls for {chapters} chapters (at most {limit} expected)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chapter pipeline against offline API stand-ins.")
+    parser.add_argument("--chapters", type=int, nargs="+", default=[5, 50, 500], help="Book sizes to run")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the first token of each completion")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0005, help="Seconds per completion token")
+    parser.add_argument("--spotify-latency", type=float, default=0.05, help="Mean seconds per Spotify call")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="Chance that a Spotify call returns 429")
+    parser.add_argument("--spotify-rate", type=float, default=None, help="Override SPOTIFY_RATE_LIMIT (requests per second)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output and logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR,
+                        format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    fake_apis.llm_settings.update(latency=args.llm_latency, token_latency=args.llm_token_latency)
+    langchain_utils.chat_model_factory = fake_apis.FakeChatModel
+    if args.spotify_rate:
+        spotify_utils.spotify_rate_limiter = TokenBucket(args.spotify_rate, max(1, int(args.spotify_rate * 2)))
+    spotify = fake_apis.FakeSpotify(latency=args.spotify_latency, rate_limit_probability=args.rate_limit_probability)
+
+    results, problems = [], []
+    for num_chapters in args.chapters:
+        result = run_book(num_chapters, spotify, args.verbose)
+        print_report(result)
+        results.append(result)
+        problems.extend(f"{num_chapters} chapters: {problem}" for problem in check_result(result))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results, "problems": problems}, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    if problems:
+        print("\nFAILED:\n" + "\n".join(problems), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
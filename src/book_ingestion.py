@@ -0,0 +1,284 @@
+import contextvars
+import hashlib
+import logging
+import mmap
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from html.parser import HTMLParser
+
+from config import (INGEST_CHAPTER_PATTERN, INGEST_CHUNK_TOKENS, INGEST_MIN_CHAPTER_WORDS, INGEST_SUMMARY_TOKENS,
+                    LLM_CONCURRENCY)
+from instrumentation import timed
+from langchain_utils import merge_chapter_summaries, summarize_chunk
+
+# Lines longer than this are never taken for chapter headings
+MAX_HEADING_BYTES = 100
+# Size of the sections a book without recognizable chapter headings is cut into (about 5,000 words)
+FALLBACK_SECTION_BYTES = 30000
+# Chunk summaries combined per merge request; chapters with more are merged in rounds
+MERGE_FAN_IN = 8
+# Project Gutenberg texts wrap the book in a licence header and footer
+GUTENBERG_START = re.compile(rb"^\*\*\* ?START OF (THE|THIS) PROJECT GUTENBERG", re.IGNORECASE)
+GUTENBERG_END = re.compile(rb"^\*\*\* ?END OF (THE|THIS) PROJECT GUTENBERG", re.IGNORECASE)
+# Marks the start of each EPUB document in the text extracted from an EPUB
+EPUB_SECTION_MARK = "\x0c"
+
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "blockquote", "section", "h1", "h2", "h3", "h4", "h5", "h6"}
+HEADING_TAGS = {"h1", "h2", "h3"}
+
+
+def iter_lines(mm, start, end):
+    """(offset, line) for each line of mm[start:end], without the newline, reading one line at a time."""
+    position = start
+    while position < end:
+        newline = mm.find(b"\n", position, end)
+        if newline < 0:
+            newline = end
+        yield position, mm[position:newline]
+        position = newline + 1
+
+
+def _body_range(mm):
+    """Byte range of the book text, without a Project Gutenberg header and footer."""
+    start, end = 0, len(mm)
+    for offset, line in iter_lines(mm, 0, len(mm)):
+        if not line.startswith(b"***"):
+            continue
+        if GUTENBERG_START.match(line):
+            start = mm.find(b"\n", offset) + 1 or len(mm)
+        elif GUTENBERG_END.match(line):
+            end = offset
+            break
+    return start, end
+
+
+def find_sections(mm, heading_pattern=INGEST_CHAPTER_PATTERN):
+    """
+    Split a book's text into (title, start, end) byte ranges at the lines matching `heading_pattern`.
+
+    The text is scanned line by line through the memory map, so only the current line is held in
+    memory. Text before the first heading is dropped. A book without any heading is cut into
+    sections of about FALLBACK_SECTION_BYTES at paragraph breaks.
+    """
+    pattern = re.compile(heading_pattern, re.IGNORECASE)
+    start, end = _body_range(mm)
+    headings = []
+    for offset, line in iter_lines(mm, start, end):
+        if not line.strip() or len(line) > MAX_HEADING_BYTES:
+            continue
+        text = line.decode("utf-8", "replace").rstrip()
+        if pattern.match(text):
+            # strip() also removes the EPUB section mark, which counts as whitespace
+            headings.append((text.strip(), offset, mm.find(b"\n", offset, end) + 1 or end))
+
+    if not headings:
+        logging.warning("No chapter headings found; splitting the book into equal parts.")
+        return [(f"Part {number}", section_start, section_end) for number, (section_start, section_end)
+                in enumerate(chunk_ranges(mm, start, end, FALLBACK_SECTION_BYTES), 1)]
+    sections = []
+    for i, (title, _, text_start) in enumerate(headings):
+        text_end = headings[i + 1][1] if i + 1 < len(headings) else end
+        sections.append((title, text_start, text_end))
+    return sections
+
+
+def word_count(mm, start, end, at_least=None):
+    """Words in mm[start:end]; with `at_least`, counting stops once that many are found."""
+    count = 0
+    for _, line in iter_lines(mm, start, end):
+        count += len(line.split())
+        if at_least is not None and count >= at_least:
+            break
+    return count
+
+
+def chunk_ranges(mm, start, end, max_bytes):
+    """Split mm[start:end] into ranges of at most `max_bytes`, at paragraph breaks where possible, else at spaces."""
+    position = start
+    while end - position > max_bytes:
+        limit = position + max_bytes
+        cut = mm.rfind(b"\n\n", position, limit)
+        if cut <= position:
+            cut = mm.rfind(b" ", position, limit)
+        if cut <= position:
+            cut = limit
+            # Do not cut inside a UTF-8 sequence
+            while cut > position + 1 and mm[cut] & 0xC0 == 0x80:
+                cut -= 1
+        yield position, cut
+        position = cut
+    if end > position:
+        yield position, end
+
+
+class _EpubTextExtractor(HTMLParser):
+    """Plain text of an XHTML document, one line per block element, and the text of its first heading."""
+
+    def __init__(self, out):
+        super().__init__(convert_charrefs=True)
+        self.out = out
+        self.heading = None
+        self._heading_parts = None
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.out.write(b"\n")
+        if tag in HEADING_TAGS and self.heading is None and self._heading_parts is None:
+            self._heading_parts = []
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.out.write(b"\n")
+        if tag in HEADING_TAGS and self._heading_parts is not None:
+            self.heading = " ".join("".join(self._heading_parts).split())
+            self._heading_parts = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self._heading_parts is not None:
+            self._heading_parts.append(data)
+        # Whitespace at either end separates words from neighbouring inline elements
+        words = " ".join(data.split())
+        self.out.write(((" " if data[:1].isspace() else "") + words + (" " if words and data[-1:].isspace() else ""))
+                       .encode("utf-8"))
+
+
+def epub_documents(path):
+    """Names of an EPUB's content documents in reading (spine) order."""
+    with zipfile.ZipFile(path) as book:
+        container = ET.fromstring(book.read("META-INF/container.xml"))
+        package_path = container.find(".//{*}rootfile").get("full-path")
+        package = ET.fromstring(book.read(package_path))
+    directory = posixpath.dirname(package_path)
+    manifest = {item.get("id"): unquote(item.get("href", "").split("#")[0])
+                for item in package.iterfind(".//{*}manifest/{*}item")}
+    return [posixpath.normpath(posixpath.join(directory, manifest[ref.get("idref")]))
+            for ref in package.iterfind(".//{*}spine/{*}itemref") if ref.get("idref") in manifest]
+
+
+def write_epub_text(path, out):
+    """
+    Write the text of an EPUB to the binary file `out`, one content document at a time.
+
+    Each document starts with a line holding EPUB_SECTION_MARK and the document's first heading,
+    so find_sections can split the text at document boundaries.
+    """
+    with zipfile.ZipFile(path) as book:
+        names = set(book.namelist())
+        for name in epub_documents(path):
+            if name not in names:
+                logging.warning(f"Skipping {name}, listed in the EPUB but missing from it.")
+                continue
+            extractor = _EpubTextExtractor(tempfile.SpooledTemporaryFile(max_size=1024 * 1024))
+            extractor.feed(book.read(name).decode("utf-8", "replace"))
+            extractor.close()
+            title = extractor.heading or posixpath.splitext(posixpath.basename(name))[0]
+            out.write(f"\n{EPUB_SECTION_MARK}{title}\n".encode("utf-8"))
+            extractor.out.seek(0)
+            for line in extractor.out:
+                if line.strip():
+                    out.write(line)
+            extractor.out.close()
+
+
+@contextmanager
+def open_book(path):
+    """
+    Memory-map a book file, yielding (mm, heading_pattern).
+
+    Plain text is mapped directly. An EPUB is first converted to plain text in a temporary file,
+    which is then mapped, and its sections are split at document boundaries.
+    """
+    if zipfile.is_zipfile(path):
+        with tempfile.TemporaryFile() as text_file:
+            write_epub_text(path, text_file)
+            text_file.flush()
+            with mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm, "^" + re.escape(EPUB_SECTION_MARK)
+    else:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"{path} is empty.")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm, INGEST_CHAPTER_PATTERN
+
+
+def _summarize_chunk(book_title, title, mm, start, end, part, parts):
+    text = mm[start:end].decode("utf-8", "replace").strip()
+    try:
+        return summarize_chunk(book_title, title, text, part, parts, INGEST_SUMMARY_TOKENS)
+    except Exception as e:
+        logging.error(f"Could not summarize part {part} of '{title}': {e}")
+        return None
+
+
+def _merge(book_title, title, summaries):
+    """Merge chunk summaries in rounds of MERGE_FAN_IN until one remains."""
+    while len(summaries) > 1:
+        groups = [summaries[i:i + MERGE_FAN_IN] for i in range(0, len(summaries), MERGE_FAN_IN)]
+        try:
+            summaries = [group[0] if len(group) == 1
+                         else merge_chapter_summaries(book_title, title, group, INGEST_SUMMARY_TOKENS)
+                         for group in groups]
+        except Exception as e:
+            logging.error(f"Could not merge the summaries of '{title}': {e}")
+            return None
+    return summaries[0] if summaries else None
+
+
+@timed("book_ingestion")
+def ingest_book(path, book_title, max_workers=LLM_CONCURRENCY, chunk_tokens=INGEST_CHUNK_TOKENS):
+    """
+    Read a plain-text or EPUB book and summarize each of its chapters, returning {"num_chapters", "chapters"}.
+
+    Chapters are found by scanning the memory-mapped text, so memory use does not grow with the
+    size of the book. Each chapter is cut into chunks of about `chunk_tokens`; all chunks are
+    summarized in parallel (map) and each chapter's chunk summaries are then merged into its
+    summary (reduce). Sections shorter than INGEST_MIN_CHAPTER_WORDS are skipped. Returns None if
+    no chapter could be summarized.
+    """
+    with open_book(path) as (mm, heading_pattern):
+        sections = [(title, start, end) for title, start, end in find_sections(mm, heading_pattern)
+                    if word_count(mm, start, end, INGEST_MIN_CHAPTER_WORDS) >= INGEST_MIN_CHAPTER_WORDS]
+        if not sections:
+            logging.error(f"No chapters found in {path}.")
+            return None
+        chunks = [list(chunk_ranges(mm, start, end, chunk_tokens * 4)) for _, start, end in sections]
+        logging.info(f"Found {len(sections)} chapters in {path}; summarizing {sum(map(len, chunks))} chunks.")
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # Worker calls run in a copy of the caller's context, so LLM budgets apply to them
+            futures = [[executor.submit(contextvars.copy_context().run, _summarize_chunk, book_title, title, mm,
+                                        start, end, part, len(ranges))
+                        for part, (start, end) in enumerate(ranges, 1)]
+                       for (title, _, _), ranges in zip(sections, chunks)]
+            summaries = [[future.result() for future in chapter_futures] for chapter_futures in futures]
+            merged = [executor.submit(contextvars.copy_context().run, _merge, book_title, title,
+                                      [summary for summary in chapter_summaries if summary])
+                      for (title, _, _), chapter_summaries in zip(sections, summaries)]
+            # The text's hash identifies an unchanged chapter across runs, whatever its new summary says
+            chapters = [{"number": number, "summary": future.result(),
+                         "source_hash": hashlib.sha256(mm[start:end]).hexdigest()}
+                        for number, (future, (_, start, end)) in enumerate(zip(merged, sections), 1)]
+
+    missing = [chapter["number"] for chapter in chapters if not chapter["summary"]]
+    if missing:
+        logging.error(f"Chapters without a summary: {', '.join(map(str, missing))}")
+    chapters = [chapter for chapter in chapters if chapter["summary"]]
+    if not chapters:
+        return None
+    logging.info(f"Summarized {len(chapters)} of {len(sections)} chapters from {path}.")
+    return {"num_chapters": len(sections), "chapters": chapters}
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import CACHE_DIR
+from instrumentation import increment
+
+CACHE_DB = os.path.join(CACHE_DIR, "cache.sqlite3")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a free-text query so trivially different spellings share a cache entry."""
+    return " ".join(query.lower().split())
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a table of a local SQLite file.
+
+    Entries expire after `ttl` seconds (`negative_ttl` for cached misses, stored as None) and
+    the least recently used entries are evicted once the table grows past `max_entries`.
+    Values are stored as JSON. Instances are safe to share between threads.
+    """
+
+    def __init__(self, table, path=CACHE_DB, ttl=None, negative_ttl=None, max_entries=None):
+        self.table = table
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)")
+        self._conn.commit()
+
+    def _expired(self, value, created, now):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        return ttl is not None and now - created > ttl
+
+    def get(self, key):
+        """Return a (hit, value) tuple; value is None for a cached negative result."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[0], row[1], now):
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                increment("cache_misses_total", cache=self.table)
+                return False, None
+            self._conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        increment("cache_hits_total", cache=self.table)
+        return True, json.loads(row[0]) if row[0] is not None else None
+
+    def get_many(self, keys):
+        """Look up several keys at once; returns a dict of key to value for the hits only."""
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        found, expired = {}, []
+        with self._lock:
+            # Stay under SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM {self.table} WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, value, created in rows:
+                    if self._expired(value, created, now):
+                        expired.append(key)
+                    else:
+                        found[key] = json.loads(value) if value is not None else None
+            self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in expired])
+            self._conn.executemany(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", [(now, key) for key in found])
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        if found:
+            increment("cache_hits_total", len(found), cache=self.table)
+        if len(keys) > len(found):
+            increment("cache_misses_total", len(keys) - len(found), cache=self.table)
+        return found
+
+    def set(self, key, value):
+        """Store a value; pass None to cache a negative result."""
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        """Store several key/value pairs in one transaction."""
+        now = time.time()
+        rows = [(key, json.dumps(value) if value is not None else None, now, now) for key, value in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            if self.max_entries is not None:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
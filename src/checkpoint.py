@@ -0,0 +1,276 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from config import CHECKPOINT_DIR, INCREMENTAL_REGENERATION
+from model_routing import routing_for
+
+# Record types written to a run journal, one JSON object per line
+RUN, BASELINE, CHAPTER, CHAPTERS_COMPLETE, PARAMETERS, SEEDS, PLAYLIST, FINISHED = (
+    "run", "baseline", "chapter", "chapters_complete", "parameters", "seeds", "playlist", "finished"
+)
+
+
+def run_id_for(config):
+    """Stable identifier for the run of a configuration: a slug of the title and a hash of the inputs."""
+    inputs = {key: config.get(key) for key in
+              ("book_title", "user_input", "music_preferences", "vocal_preference", "min_instrumentalness")}
+    if config.get("book_file"):
+        inputs["book_file"] = config["book_file"]
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    slug = re.sub(r"[^a-z0-9]+", "-", str(config.get("book_title", "")).lower()).strip("-")[:40]
+    return f"{slug}-{digest}" if slug else digest
+
+
+def config_identity(config):
+    """
+    Hash of the book a configuration makes playlists for: its title and book file.
+
+    Runs with the same identity update each other's playlists; a configuration that differs in its
+    `user_input`, preferences or book text is the same playlist set regenerated, and the chapter
+    input hashes decide which of its chapters change.
+    """
+    inputs = {"book_title": str(config.get("book_title", "")).strip().lower(), "book_file": config.get("book_file") or None}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def source_digest(config):
+    """Hash of the content a configuration's chapters come from: its user_input and the bytes of its book file, if any."""
+    digest = hashlib.sha256(json.dumps(config.get("user_input")).encode("utf-8"))
+    if config.get("book_file"):
+        try:
+            with open(config["book_file"], "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        except OSError:
+            return None
+    return digest.hexdigest()
+
+
+def chapter_input_hash(chapter, music_preferences, vocal_preference, min_instrumentalness, routing=None):
+    """
+    Hash of everything a chapter's playlist is generated from; a chapter whose hash is unchanged needs no new playlist.
+
+    `routing` is the model routing of parameter generation (parameter_routing() by default).
+    Chapters ingested from a book file are identified by the hash of their text, since their
+    summaries are regenerated by the LLM and differ from run to run. Chapters extracted from
+    `user_input` have no text of their own, so they are identified by their summary.
+    """
+    inputs = {"summary": chapter.get("source_hash") or chapter.get("summary"), "music_preferences": music_preferences,
+              "vocal_preference": vocal_preference, "min_instrumentalness": min_instrumentalness,
+              "routing": routing if routing is not None else parameter_routing()}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def parameter_routing():
+    """Routing settings of the LLM operations that generate a chapter's parameters."""
+    return routing_for("generate_spotify_parameters", "generate_spotify_parameters_batch", "fix_parameter_fields")
+
+
+class RunJournal:
+    """
+    Append-only checkpoint journal for one book run.
+
+    Records the extracted chapters, the generated parameters, the resolved seeds and the
+    created playlists of each chapter as JSON lines, flushed and fsynced as they happen, so a
+    run that dies part way can be resumed without repeating finished work.
+
+    A journal can also hold a baseline: the playlists of an earlier run of the same book
+    with the input hash of each chapter, so a regeneration only redoes the chapters that changed
+    and updates their existing playlists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.splitext(os.path.basename(path))[0]
+        self.config = None
+        self.source_digest = None
+        self.chapters = {}
+        self.chapters_complete = False
+        self.parameters = {}
+        self.resolved = set()
+        self.playlists = {}
+        self.playlist_tracks = {}
+        self.input_hashes = {}
+        self.baseline = {}
+        self.finished = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def start(cls, config, directory=CHECKPOINT_DIR, incremental=INCREMENTAL_REGENERATION):
+        """
+        Begin a new journal for `config`, replacing any earlier journal of the same run.
+
+        With `incremental`, the playlists of the latest earlier run of the same book
+        become the baseline of the new journal. When that run extracted every chapter from the
+        same user_input and book text, its chapters are reused rather than extracted again, so
+        their summaries and input hashes stay the same.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Read before the file of an identical earlier run is removed below
+        previous = find_previous_run(config, directory) if incremental else None
+        path = os.path.join(directory, f"{run_id_for(config)}.jsonl")
+        if os.path.exists(path):
+            os.remove(path)
+        journal = cls(path)
+        journal.config = config
+        journal._append({"type": RUN, "config": config, "source_digest": source_digest(config)})
+        if previous:
+            journal.record_baseline(previous)
+            if previous.chapters_complete and journal.source_digest and previous.source_digest == journal.source_digest:
+                logging.info(f"Reusing the {len(previous.chapters)} chapters of the previous run; the book is unchanged.")
+                for chapter in previous.chapter_list():
+                    journal.record_chapter(chapter)
+                journal.record_chapters_complete()
+        return journal
+
+    @classmethod
+    def open(cls, config, directory=CHECKPOINT_DIR):
+        """Return the existing journal for `config`, or None if it has never been run."""
+        path = os.path.join(directory, f"{run_id_for(config)}.jsonl")
+        return cls(path) if os.path.exists(path) else None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written
+                    logging.warning(f"Ignoring a damaged record in {self.path}")
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        kind = record.get("type")
+        if kind == RUN:
+            self.config = record["config"]
+            self.source_digest = record.get("source_digest")
+        elif kind == BASELINE:
+            self.baseline = {entry["number"]: entry for entry in record["playlists"]}
+        elif kind == CHAPTER:
+            self.chapters[record["chapter"]["number"]] = record["chapter"]
+        elif kind == CHAPTERS_COMPLETE:
+            self.chapters_complete = True
+        elif kind == PARAMETERS:
+            self.parameters[record["number"]] = record["parameters"]
+        elif kind == SEEDS:
+            self.parameters[record["number"]] = record["parameters"]
+            self.resolved.add(record["number"])
+        elif kind == PLAYLIST:
+            self.playlists[record["number"]] = record["playlist_url"]
+            self.playlist_tracks[record["number"]] = record.get("track_keys", [])
+            self.input_hashes[record["number"]] = record.get("input_hash")
+        elif kind == FINISHED:
+            self.finished = True
+
+    def _append(self, record):
+        record["time"] = time.time()
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+    def record_baseline(self, previous):
+        """Record the playlists of `previous`, an earlier journal of the same book, to be updated in place."""
+        # Chapters the earlier run had not reached keep the playlists of its own baseline
+        playlists = dict(previous.baseline)
+        for number, url in previous.playlists.items():
+            playlists[number] = {"number": number, "playlist_url": url, "input_hash": previous.input_hashes.get(number),
+                                 "track_keys": previous.playlist_tracks.get(number, [])}
+        self._append({"type": BASELINE, "run_id": previous.run_id,
+                      "playlists": [playlists[number] for number in sorted(playlists)]})
+
+    def record_chapter(self, chapter):
+        self._append({"type": CHAPTER, "chapter": chapter})
+
+    def record_chapters_complete(self):
+        self._append({"type": CHAPTERS_COMPLETE})
+
+    def record_parameters(self, number, parameters):
+        self._append({"type": PARAMETERS, "number": number, "parameters": parameters})
+
+    def record_seeds(self, number, parameters):
+        """Record parameters whose seed names have been resolved to Spotify IDs."""
+        self._append({"type": SEEDS, "number": number, "parameters": parameters})
+
+    def record_playlist(self, number, playlist_url, track_keys=(), input_hash=None):
+        """Record a created playlist with the deduplication keys of its tracks and the hash of the chapter's inputs."""
+        self._append({"type": PLAYLIST, "number": number, "playlist_url": playlist_url,
+                      "playlist_id": playlist_url.rstrip("/").rsplit("/", 1)[-1], "track_keys": list(track_keys),
+                      "input_hash": input_hash})
+
+    def record_finished(self):
+        self._append({"type": FINISHED})
+
+    def chapter_list(self):
+        return [self.chapters[number] for number in sorted(self.chapters)]
+
+    def playlist_urls(self):
+        """Recorded playlist URLs in chapter order (None for chapters without a playlist)."""
+        return [self.playlists.get(number) for number in sorted(self.chapters)]
+
+    def track_keys(self):
+        """Deduplication keys of the tracks in every recorded playlist."""
+        return [key for keys in self.playlist_tracks.values() for key in keys]
+
+    def track_chapters(self, chapters):
+        """Pass chapters from an iterator through, recording each one and the end of the list."""
+        for chapter in chapters:
+            if chapter.get("number") not in self.chapters:
+                self.record_chapter(chapter)
+            yield chapter
+        self.record_chapters_complete()
+
+
+def list_journals(directory=CHECKPOINT_DIR):
+    """Journals in `directory`, most recently updated first."""
+    if not os.path.exists(directory):
+        return []
+    paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".jsonl")]
+    return [RunJournal(path) for path in sorted(paths, key=os.path.getmtime, reverse=True)]
+
+
+def find_journal(target=None, directory=CHECKPOINT_DIR):
+    """
+    Find the journal to resume: by run ID or journal path, or the most recent unfinished run.
+
+    Returns None when nothing matches.
+    """
+    if target is None:
+        return next((journal for journal in list_journals(directory) if not journal.finished), None)
+    for path in (target, os.path.join(directory, f"{target}.jsonl")):
+        if path.endswith(".jsonl") and os.path.isfile(path):
+            return RunJournal(path)
+    return None
+
+
+def find_previous_run(config, directory=CHECKPOINT_DIR):
+    """The most recently updated journal of a run with the same config_identity that created playlists, or None."""
+    if not os.path.exists(directory):
+        return None
+    identity = config_identity(config)
+    paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".jsonl")]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True):
+        # The run record comes first, so other configurations are skipped without reading their whole journal
+        try:
+            with open(path, "r") as f:
+                record = json.loads(f.readline())
+        except (OSError, json.JSONDecodeError):
+            continue
+        if record.get("type") != RUN or config_identity(record["config"]) != identity:
+            continue
+        journal = RunJournal(path)
+        if journal.playlists or journal.baseline:
+            return journal
+    return None
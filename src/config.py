@@ -7,12 +7,132 @@ load_dotenv()
 # Get OpenAI configuration from environment variables
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+OPENAI_CONTEXT_WINDOW = int(os.getenv("OPENAI_CONTEXT_WINDOW", "128000"))  # tokens
+OPENAI_MAX_OUTPUT_TOKENS = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "16384"))  # tokens
+# Model tiers: per-chapter parameter requests use the fast model, chapter extraction OPENAI_MODEL,
+# and requests whose output fails validation are retried on the next stronger model
+OPENAI_FAST_MODEL = os.getenv("OPENAI_FAST_MODEL", OPENAI_MODEL)
+OPENAI_STRONG_MODEL = os.getenv("OPENAI_STRONG_MODEL", OPENAI_MODEL)
+# Prompts larger than this go to OPENAI_MODEL instead of the fast model (tokens, 0 = never)
+MODEL_ROUTING_LARGE_PROMPT_TOKENS = int(os.getenv("MODEL_ROUTING_LARGE_PROMPT_TOKENS", "8000"))
+# LLM budgets per book run and per batch of runs; requests over budget are refused (0 = unlimited)
+LLM_RUN_TOKEN_BUDGET = int(os.getenv("LLM_RUN_TOKEN_BUDGET", "0"))
+LLM_RUN_COST_BUDGET = float(os.getenv("LLM_RUN_COST_BUDGET", "0"))  # USD
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "0"))
+LLM_BATCH_COST_BUDGET = float(os.getenv("LLM_BATCH_COST_BUDGET", "0"))  # USD
+# Response format requested from OpenAI: "json_schema" (schema-constrained), "json_object" or "off"
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "json_schema")
+# Maximum chapters per parameter-generation request; 1 sends one request per chapter
+PARAMETER_BATCH_SIZE = int(os.getenv("PARAMETER_BATCH_SIZE", "10"))
+# Stream chapter extraction and start processing chapters before the full list has arrived
+STREAM_CHAPTER_EXTRACTION = os.getenv("STREAM_CHAPTER_EXTRACTION", "true").lower() == "true"
+# Book file ingestion: chapter heading pattern for plain text, text per summarization request,
+# longest chunk summary, and sections shorter than this many words (tables of contents, front matter) are skipped
+INGEST_CHAPTER_PATTERN = os.getenv("INGEST_CHAPTER_PATTERN", r"^\s*(chapter|chap\.)\s+([0-9]+|[ivxlcdm]+|[a-z-]+)\b.*$")
+INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "3000"))
+INGEST_SUMMARY_TOKENS = int(os.getenv("INGEST_SUMMARY_TOKENS", "250"))
+INGEST_MIN_CHAPTER_WORDS = int(os.getenv("INGEST_MIN_CHAPTER_WORDS", "150"))
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Optional run report exports: JSON and Prometheus text format
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH", "")
+METRICS_PROMETHEUS_PATH = os.getenv("METRICS_PROMETHEUS_PATH", "")
+
+# Pipeline concurrency: how many chapters may be in the LLM stage and the Spotify stage at once
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+SPOTIFY_CONCURRENCY = int(os.getenv("SPOTIFY_CONCURRENCY", "4"))
+# HTTP connection pool size for the Spotify client, also used as the seed-resolution fan-out
+SPOTIFY_POOL_SIZE = int(os.getenv("SPOTIFY_POOL_SIZE", "10"))
+# Spotify HTTP transport: "httpx" (async client with keep-alive connections) or "requests" (spotipy's own),
+# request and connect timeouts in seconds, and retries after a server or connection error
+SPOTIFY_HTTP_CLIENT = os.getenv("SPOTIFY_HTTP_CLIENT", "requests").lower()
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", "10"))
+SPOTIFY_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", "5"))
+SPOTIFY_HTTP_RETRIES = int(os.getenv("SPOTIFY_HTTP_RETRIES", "5"))
+# Shared Spotify rate limit: sustained requests per second (0 for no limit), burst size, and retries after a 429
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "20"))
+SPOTIFY_RATE_LIMIT_RETRIES = int(os.getenv("SPOTIFY_RATE_LIMIT_RETRIES", "3"))
+
+# Batch mode: books processed at once and where the summary report is written
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+BATCH_REPORT_PATH = os.getenv("BATCH_REPORT_PATH", "batch_report.json")
+
+# Service mode: address of the local HTTP API, books processed at once and jobs allowed to wait
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "2"))
+SERVICE_MAX_QUEUED = int(os.getenv("SERVICE_MAX_QUEUED", "20"))
+
+# Saved configurations, kept in an indexed SQLite store
+CONFIG_DB_PATH = os.getenv("CONFIG_DB_PATH", os.path.join("configs", "configs.sqlite3"))
+
+# Checkpoint journals of book runs, used to resume interrupted runs
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+# Regenerate only chapters whose inputs changed since the book's last run, updating its playlists in place
+INCREMENTAL_REGENERATION = os.getenv("INCREMENTAL_REGENERATION", "true").lower() == "true"
+
+# Local caches
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")  # not ".cache", which spotipy uses for its OAuth token
+SEED_CACHE_TTL = int(os.getenv("SEED_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+SEED_CACHE_NEGATIVE_TTL = int(os.getenv("SEED_CACHE_NEGATIVE_TTL", str(24 * 3600)))  # seconds
+SEED_CACHE_MAX_ENTRIES = int(os.getenv("SEED_CACHE_MAX_ENTRIES", "50000"))
+# Audio features never change, so cached entries only expire through LRU eviction
+AUDIO_FEATURES_CACHE_MAX_ENTRIES = int(os.getenv("AUDIO_FEATURES_CACHE_MAX_ENTRIES", "200000"))
+# Extra share of tracks requested on top of the expected filter losses when min_instrumentalness is set
+RECOMMENDATION_OVERFETCH_MARGIN = float(os.getenv("RECOMMENDATION_OVERFETCH_MARGIN", "1.2"))
+# Put every chapter in one playlist for the book, in chapter order, instead of one playlist per chapter
+SINGLE_BOOK_PLAYLIST = os.getenv("SINGLE_BOOK_PLAYLIST", "false").lower() == "true"
+# Genres offered in each parameter prompt, picked by keyword relevance (0 sends the full list),
+# and how long the genre list fetched from Spotify is cached
+GENRE_PROMPT_TOP_K = int(os.getenv("GENRE_PROMPT_TOP_K", "20"))
+GENRE_CACHE_TTL = int(os.getenv("GENRE_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+# Spare recommendations fetched per chapter to replace tracks already used by earlier chapters,
+# and whether to order each playlist so energy and tempo change smoothly
+DEDUP_SPARE_TRACKS = int(os.getenv("DEDUP_SPARE_TRACKS", "10"))
+SMOOTH_TRACK_ORDER = os.getenv("SMOOTH_TRACK_ORDER", "true").lower() == "true"
+# Local track index: serve recommendations from previously seen tracks within this feature distance
+TRACK_INDEX = os.getenv("TRACK_INDEX", "true").lower() == "true"
+TRACK_INDEX_MAX_DISTANCE = float(os.getenv("TRACK_INDEX_MAX_DISTANCE", "0.15"))
+# Recommendation cache: requests with the same seed IDs and targets in the same buckets share one
+# recommendations call; buckets are this wide for valence, energy and min_instrumentalness, and for tempo (BPM)
+RECOMMENDATION_CACHE = os.getenv("RECOMMENDATION_CACHE", "true").lower() == "true"
+RECOMMENDATION_CACHE_FEATURE_STEP = float(os.getenv("RECOMMENDATION_CACHE_FEATURE_STEP", "0.05"))
+RECOMMENDATION_CACHE_TEMPO_STEP = float(os.getenv("RECOMMENDATION_CACHE_TEMPO_STEP", "5"))
+RECOMMENDATION_CACHE_TTL = int(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "20000"))
+# LLM response cache: "use" reads and writes, "refresh" only writes, "off" bypasses it
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "use")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600)))  # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
 
 def print_configuration():
     print("Configuration:")
     print(f"OPENAI_MODEL: {OPENAI_MODEL}")
     print(f"OPENAI_API_BASE: {OPENAI_API_BASE}")
+    print(f"OPENAI_FAST_MODEL: {OPENAI_FAST_MODEL}")
+    print(f"OPENAI_STRONG_MODEL: {OPENAI_STRONG_MODEL}")
+    print(f"LLM_RUN_TOKEN_BUDGET: {LLM_RUN_TOKEN_BUDGET or 'unlimited'}")
+    print(f"LLM_RUN_COST_BUDGET: {LLM_RUN_COST_BUDGET or 'unlimited'}")
+    print(f"STRUCTURED_OUTPUT: {STRUCTURED_OUTPUT}")
+    print(f"PARAMETER_BATCH_SIZE: {PARAMETER_BATCH_SIZE}")
+    print(f"STREAM_CHAPTER_EXTRACTION: {STREAM_CHAPTER_EXTRACTION}")
+    print(f"INGEST_CHUNK_TOKENS: {INGEST_CHUNK_TOKENS}")
     print(f"LOG_LEVEL: {LOG_LEVEL}")
+    print(f"LLM_CONCURRENCY: {LLM_CONCURRENCY}")
+    print(f"SPOTIFY_CONCURRENCY: {SPOTIFY_CONCURRENCY}")
+    print(f"SPOTIFY_POOL_SIZE: {SPOTIFY_POOL_SIZE}")
+    print(f"SPOTIFY_HTTP_CLIENT: {SPOTIFY_HTTP_CLIENT}")
+    print(f"SPOTIFY_RATE_LIMIT: {f'{SPOTIFY_RATE_LIMIT}/s (burst {SPOTIFY_RATE_BURST})' if SPOTIFY_RATE_LIMIT > 0 else 'unlimited'}")
+    print(f"GENRE_PROMPT_TOP_K: {GENRE_PROMPT_TOP_K}")
+    print(f"SINGLE_BOOK_PLAYLIST: {SINGLE_BOOK_PLAYLIST}")
+    print(f"BATCH_WORKERS: {BATCH_WORKERS}")
+    print(f"SERVICE: {SERVICE_HOST}:{SERVICE_PORT} ({SERVICE_WORKERS} workers)")
+    print(f"CONFIG_DB_PATH: {CONFIG_DB_PATH}")
+    print(f"CHECKPOINT_DIR: {CHECKPOINT_DIR}")
+    print(f"INCREMENTAL_REGENERATION: {INCREMENTAL_REGENERATION}")
+    print(f"CACHE_DIR: {CACHE_DIR}")
+    print(f"TRACK_INDEX: {TRACK_INDEX} (max distance {TRACK_INDEX_MAX_DISTANCE})")
+    print(f"RECOMMENDATION_CACHE: {RECOMMENDATION_CACHE} (buckets {RECOMMENDATION_CACHE_FEATURE_STEP}, {RECOMMENDATION_CACHE_TEMPO_STEP} BPM)")
+    print(f"LLM_CACHE_MODE: {LLM_CACHE_MODE}")
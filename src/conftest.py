@@ -0,0 +1,47 @@
+"""
+Test settings: caches, checkpoints and saved configurations go to a temporary directory and
+LLM responses are never cached, so tests neither read nor change the user's local state.
+
+Set before any project module is imported, since config reads the environment on import.
+"""
+import os
+import tempfile
+
+import pytest
+
+_directory = tempfile.mkdtemp(prefix="playlist-tests-")
+os.environ["CACHE_DIR"] = os.path.join(_directory, "cache")
+os.environ["CHECKPOINT_DIR"] = os.path.join(_directory, "checkpoints")
+os.environ["CONFIG_DB_PATH"] = os.path.join(_directory, "configs", "configs.sqlite3")
+os.environ["LLM_CACHE_MODE"] = "off"
+
+
+@pytest.fixture
+def spotify(monkeypatch, tmp_path):
+    """Offline Spotify client without rate limiting, starting from empty caches and an empty track index."""
+    import fake_apis
+    import spotify_utils
+    from rate_limiter import TokenBucket
+    from track_index import TrackIndex
+
+    monkeypatch.setattr(spotify_utils, "spotify_rate_limiter", TokenBucket(0, 1))
+    monkeypatch.setattr(spotify_utils, "_track_index", TrackIndex(str(tmp_path / "track_index")))
+    for cache in (spotify_utils.get_seed_cache(), spotify_utils.get_recommendation_cache(),
+                  spotify_utils.get_audio_features_cache()):
+        cache.clear()
+    return fake_apis.FakeSpotify(latency=0, miss_probability=0)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Answer prompts with the offline chat model, without latency, starting from an empty response cache."""
+    import fake_apis
+    import langchain_utils
+
+    monkeypatch.setattr(langchain_utils, "chat_model_factory", fake_apis.FakeChatModel)
+    monkeypatch.setitem(fake_apis.llm_settings, "latency", 0)
+    monkeypatch.setitem(fake_apis.llm_settings, "token_latency", 0)
+    monkeypatch.setitem(fake_apis.llm_settings, "num_chapters", 5)
+    fake_apis.llm_stats.reset()
+    langchain_utils.get_llm_cache().clear()
+    return fake_apis.llm_stats
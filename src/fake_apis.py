@@ -0,0 +1,348 @@
+"""
+Offline stand-ins for the Spotify and OpenAI APIs.
+
+FakeSpotify implements the spotipy.Spotify methods used by spotify_utils and FakeChatModel is a
+LangChain chat model that answers the prompts in langchain_utils. Both return realistic,
+deterministic payloads, sleep for a configurable latency, can inject 429 responses and record
+call counts and latencies, so the pipeline can be measured without network access.
+"""
+import hashlib
+import json
+import random
+import re
+import string
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+import spotipy
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+GENRES = [
+    "acoustic", "afrobeat", "alt-rock", "alternative", "ambient", "anime", "black-metal", "bluegrass", "blues",
+    "bossanova", "brazil", "breakbeat", "british", "cantopop", "chicago-house", "children", "chill", "classical",
+    "club", "comedy", "country", "dance", "dancehall", "death-metal", "deep-house", "detroit-techno", "disco",
+    "disney", "drum-and-bass", "dub", "dubstep", "edm", "electro", "electronic", "emo", "folk", "forro", "french",
+    "funk", "garage", "german", "gospel", "goth", "grindcore", "groove", "grunge", "guitar", "happy", "hard-rock",
+    "hardcore", "hardstyle", "heavy-metal", "hip-hop", "holidays", "honky-tonk", "house", "idm", "indian", "indie",
+    "indie-pop", "industrial", "iranian", "j-dance", "j-idol", "j-pop", "j-rock", "jazz", "k-pop", "kids", "latin",
+    "latino", "malay", "mandopop", "metal", "metal-misc", "metalcore", "minimal-techno", "movies", "mpb", "new-age",
+    "new-release", "opera", "pagode", "party", "philippines-opm", "piano", "pop", "pop-film", "post-dubstep",
+    "power-pop", "progressive-house", "psych-rock", "punk", "punk-rock", "r-n-b", "rainy-day", "reggae", "reggaeton",
+    "road-trip", "rock", "rock-n-roll", "rockabilly", "romance", "sad", "salsa", "samba", "sertanejo", "show-tunes",
+    "singer-songwriter", "ska", "sleep", "songwriter", "soul", "soundtracks", "spanish", "study", "summer", "swedish",
+    "synth-pop", "tango", "techno", "trance", "trip-hop", "turkish", "work-out", "world-music",
+]
+
+ARTISTS = [
+    "Ludovico Einaudi", "Max Richter", "Olafur Arnalds", "Nils Frahm", "Hans Zimmer", "Brian Eno", "Johann Johannsson",
+    "Hildur Gudnadottir", "Philip Glass", "Arvo Part", "Yann Tiersen", "Joe Hisaishi", "Explosions in the Sky",
+    "Sigur Ros", "Bonobo", "Tycho", "Nujabes", "Radiohead", "Massive Attack", "Portishead", "Air", "Moby",
+]
+
+TRACKS = [
+    "Nuvole Bianche - Ludovico Einaudi", "On the Nature of Daylight - Max Richter", "Saman - Olafur Arnalds",
+    "Says - Nils Frahm", "Time - Hans Zimmer", "An Ending (Ascent) - Brian Eno", "Experimental - Ludovico Einaudi",
+    "Comptine d'un autre ete - Yann Tiersen", "Merry-Go-Round of Life - Joe Hisaishi", "Your Hand in Mine - Explosions in the Sky",
+    "Hoppipolla - Sigur Ros", "Kiara - Bonobo", "Awake - Tycho", "Aruarian Dance - Nujabes", "Teardrop - Massive Attack",
+]
+
+MOODS = ["hopeful", "tense", "melancholy", "triumphant", "quiet", "ominous", "playful", "bittersweet", "restless", "serene"]
+EVENTS = ["faces a hard choice", "returns home", "meets an old rival", "uncovers a secret", "loses a friend",
+          "sets out on a journey", "prepares for the ceremony", "questions everything", "finds an unlikely ally"]
+
+CATALOG_SIZE = 5000
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def _spotify_id(text):
+    alphabet = string.ascii_letters + string.digits
+    number = int.from_bytes(_digest(text), "big")
+    characters = []
+    for _ in range(22):
+        number, remainder = divmod(number, len(alphabet))
+        characters.append(alphabet[remainder])
+    return "".join(characters)
+
+
+def _fraction(text):
+    return int.from_bytes(_digest(text)[:4], "big") / 2 ** 32
+
+
+def fake_track(index):
+    """Deterministic track payload for catalog position `index`."""
+    track_id = _spotify_id(f"track-{index}")
+    artist_name = ARTISTS[index % len(ARTISTS)]
+    artist_id = _spotify_id(f"artist-{artist_name}")
+    return {
+        "id": track_id,
+        "name": f"Track {index}",
+        "uri": f"spotify:track:{track_id}",
+        "duration_ms": 120000 + int(_fraction(track_id) * 240000),
+        "popularity": int(_fraction(track_id + "p") * 100),
+        "artists": [{"id": artist_id, "name": artist_name, "uri": f"spotify:artist:{artist_id}"}],
+        "album": {"name": f"Album {index // 10}"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def fake_audio_features(track_id):
+    """Deterministic audio features for a catalog track."""
+    return {
+        "id": track_id,
+        "valence": round(_fraction(track_id + "v"), 3),
+        "energy": round(_fraction(track_id + "e"), 3),
+        "tempo": round(60 + _fraction(track_id + "t") * 120, 3),
+        "instrumentalness": round(_fraction(track_id + "i"), 3),
+        "danceability": round(_fraction(track_id + "d"), 3),
+    }
+
+
+def _feature_distance(track_id, targets):
+    features = fake_audio_features(track_id)
+    return sum(((features[name] - target) / (200 if name == "tempo" else 1)) ** 2 for name, target in targets.items())
+
+
+class CallStats:
+    """Thread-safe call counts, latencies and injected rate limits per method."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = defaultdict(int)
+            self.latencies = defaultdict(list)
+            self.rate_limited = defaultdict(int)
+            self.tokens = defaultdict(int)
+
+    def record(self, method, latency, **tokens):
+        with self._lock:
+            self.calls[method] += 1
+            self.latencies[method].append(latency)
+            for kind, count in tokens.items():
+                self.tokens[kind] += count
+
+    def record_rate_limited(self, method):
+        with self._lock:
+            self.rate_limited[method] += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "rate_limited": dict(self.rate_limited),
+                "tokens": dict(self.tokens),
+            }
+
+
+class FakeSpotify:
+    """Offline stand-in for spotipy.Spotify with configurable latency and 429 injection."""
+
+    def __init__(self, latency=0.05, jitter=0.5, rate_limit_probability=0.0, retry_after=1, miss_probability=0.05, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.miss_probability = miss_probability
+        self.stats = CallStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._playlists = {}
+        self._playlists_lock = threading.Lock()
+
+    def _uniform(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def _call(self, method):
+        if self.rate_limit_probability and self._uniform() < self.rate_limit_probability:
+            self.stats.record_rate_limited(method)
+            raise spotipy.exceptions.SpotifyException(429, -1, f"{method}: API rate limit exceeded",
+                                                      headers={"Retry-After": str(self.retry_after)})
+        latency = self.latency * (1 + self.jitter * (2 * self._uniform() - 1))
+        time.sleep(max(0.0, latency))
+        self.stats.record(method, latency)
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        self._call("search")
+        if _fraction(q.lower()) < self.miss_probability:
+            return {f"{type}s": {"items": []}}
+        if type == "artist":
+            items = [{"id": _spotify_id(f"artist-{q.lower()}"), "name": q, "genres": []}]
+        else:
+            items = [fake_track(int(_fraction(q.lower()) * CATALOG_SIZE))]
+        return {f"{type}s": {"items": items[:limit]}}
+
+    def recommendation_genre_seeds(self):
+        self._call("recommendation_genre_seeds")
+        return {"genres": list(GENRES)}
+
+    def recommendations(self, seed_artists=None, seed_genres=None, seed_tracks=None, limit=20, country=None, **kwargs):
+        self._call("recommendations")
+        key = json.dumps([seed_artists, seed_genres, seed_tracks, sorted(kwargs.items())], default=str)
+        rng = random.Random(key)
+        # Pick the tracks closest to the targets from a random sample of the catalog
+        targets = {name[len("target_"):]: value for name, value in kwargs.items() if name.startswith("target_") and value is not None}
+        candidates = [fake_track(index) for index in rng.sample(range(CATALOG_SIZE), min(CATALOG_SIZE, limit * 10))]
+        minimum = kwargs.get("min_instrumentalness")
+        if minimum is not None:
+            candidates = [track for track in candidates if fake_audio_features(track["id"])["instrumentalness"] >= minimum] or candidates
+        candidates.sort(key=lambda track: _feature_distance(track["id"], targets))
+        return {"tracks": candidates[:limit], "seeds": []}
+
+    def audio_features(self, tracks=[]):
+        self._call("audio_features")
+        if len(tracks) > 100:
+            raise spotipy.exceptions.SpotifyException(400, -1, "audio_features: too many ids")
+        return [fake_audio_features(track_id) for track_id in tracks]
+
+    def me(self):
+        self._call("me")
+        return {"id": "benchmark-user", "display_name": "Benchmark User"}
+
+    def user_playlist_create(self, user, name, public=True, collaborative=False, description=""):
+        self._call("user_playlist_create")
+        playlist_id = _spotify_id(f"playlist-{name}-{time.time_ns()}")
+        with self._playlists_lock:
+            self._playlists[playlist_id] = {"name": name, "description": description, "items": []}
+        return {"id": playlist_id, "name": name, "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist_id}"}}
+
+    def playlist_add_items(self, playlist_id, items, position=None):
+        self._call("playlist_add_items")
+        if len(items) > 100:
+            raise spotipy.exceptions.SpotifyException(400, -1, "playlist_add_items: too many items")
+        with self._playlists_lock:
+            self._playlists.setdefault(playlist_id, {"items": []})["items"].extend(items)
+        return {"snapshot_id": _spotify_id(f"{playlist_id}-{len(items)}")}
+
+    def playlist_replace_items(self, playlist_id, items):
+        self._call("playlist_replace_items")
+        if len(items) > 100:
+            raise spotipy.exceptions.SpotifyException(400, -1, "playlist_replace_items: too many items")
+        with self._playlists_lock:
+            self._playlists.setdefault(playlist_id, {"items": []})["items"] = list(items)
+        return {"snapshot_id": _spotify_id(f"{playlist_id}-replaced-{len(items)}")}
+
+    def playlist_change_details(self, playlist_id, name=None, public=None, collaborative=None, description=None):
+        self._call("playlist_change_details")
+        with self._playlists_lock:
+            playlist = self._playlists.setdefault(playlist_id, {"items": []})
+            if name is not None:
+                playlist["name"] = name
+            if description is not None:
+                playlist["description"] = description
+
+
+# Shared settings and statistics for every FakeChatModel instance
+llm_settings = {"latency": 0.5, "token_latency": 0.0005, "num_chapters": 20}
+llm_stats = CallStats()
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def _chapter_summary(number):
+    mood = MOODS[int(_fraction(f"mood-{number}") * len(MOODS))]
+    event = EVENTS[int(_fraction(f"event-{number}") * len(EVENTS))]
+    return f"In chapter {number} the protagonist {event} and the mood turns {mood}."
+
+
+def _parameters(summary, genres):
+    rng = random.Random(summary)
+    genres = genres or GENRES
+    return {
+        "seed_genres": rng.sample(genres, min(2, len(genres))),
+        "seed_tracks": [rng.choice(TRACKS)],
+        "seed_artists": rng.sample(ARTISTS, 2),
+        "target_valence": round(rng.random(), 2),
+        "target_energy": round(rng.random(), 2),
+        "target_tempo": rng.randrange(60, 160),
+        "limit": 20,
+    }
+
+
+def _respond(prompt):
+    """Answer one of the prompts built in langchain_utils."""
+    genres_match = re.search(r"Available genres: (.*)", prompt)
+    genres = [genre.strip() for genre in genres_match.group(1).split(",") if genre.strip()] if genres_match else []
+    num_chapters = llm_settings["num_chapters"]
+
+    if "Combine them into one brief summary" in prompt:
+        parts = re.findall(r"Part \d+: (.*)", prompt)
+        return " ".join(part.split(".")[0] + "." for part in parts)
+    if re.search(r"Summarize part \d+ of \d+", prompt):
+        words = prompt.split("Text:", 1)[1].split()
+        return f"A passage of {len(words)} words beginning '{' '.join(words[:8])}'."
+    if "continue a list of chapter summaries" in prompt:
+        start = int(re.search(r"starting with chapter (\d+)", prompt).group(1))
+        chapters = [{"number": n, "summary": _chapter_summary(n)} for n in range(start, num_chapters + 1)]
+        return json.dumps({"chapters": chapters}, indent=2)
+    if "extract and complete chapter information" in prompt:
+        chapters = [{"number": n, "summary": _chapter_summary(n)} for n in range(1, num_chapters + 1)]
+        return "```json\n" + json.dumps({"num_chapters": num_chapters, "chapters": chapters}, indent=2) + "\n```"
+    if "for each chapter" in prompt:
+        batch = []
+        for number, summary in re.findall(r"Chapter (\d+): (.*)", prompt):
+            batch.append(dict(chapter=int(number), **_parameters(summary, genres)))
+        return json.dumps({"parameters": batch})
+    if "Provide only the following fields" in prompt:
+        summary = re.search(r"Chapter summary: (.*)", prompt).group(1)
+        fields = re.findall(r"- '(\w+)':", prompt)
+        parameters = _parameters(summary, genres)
+        return json.dumps({field: parameters[field] for field in fields if field in parameters})
+    if "Chapter summary:" in prompt:
+        summary = re.search(r"Chapter summary: (.*)", prompt).group(1)
+        return json.dumps(_parameters(summary, genres))
+    return "{}"
+
+
+class FakeChatModel(BaseChatModel):
+    """Offline chat model that answers langchain_utils prompts with latency and max_tokens truncation."""
+
+    model_name: str = "fake-model"
+    openai_api_base: Optional[str] = None
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+    model_kwargs: Dict[str, Any] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _completion(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        text = _respond(prompt)
+        if self.max_tokens and _estimate_tokens(text) > self.max_tokens:
+            text = text[:self.max_tokens * 4]
+        return prompt, text
+
+    def _generate(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt, text = self._completion(messages)
+        prompt_tokens, completion_tokens = _estimate_tokens(prompt), _estimate_tokens(text)
+        latency = llm_settings["latency"] + completion_tokens * llm_settings["token_latency"]
+        time.sleep(latency)
+        llm_stats.record("chat_completion", latency, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        token_usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                       "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))],
+                          llm_output={"token_usage": token_usage, "model_name": self.model_name})
+
+    def _stream(self, messages: List[Any], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt, text = self._completion(messages)
+        started = time.monotonic()
+        time.sleep(llm_settings["latency"])
+        for start in range(0, len(text), 16):
+            piece = text[start:start + 16]
+            time.sleep(len(piece) / 4 * llm_settings["token_latency"])
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+        llm_stats.record("chat_completion_stream", time.monotonic() - started,
+                         prompt_tokens=_estimate_tokens(prompt), completion_tokens=_estimate_tokens(text))
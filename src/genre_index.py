@@ -0,0 +1,139 @@
+import re
+from collections import Counter
+
+# Words in chapter summaries and music preferences that suggest a genre, beyond the genre's own name
+GENRE_KEYWORDS = {
+    "acoustic": ["acoustic", "unplugged", "campfire", "guitar", "intimate", "simple"],
+    "ambient": ["ambient", "atmospheric", "calm", "dream", "drift", "ethereal", "fog", "mist", "quiet", "space", "still", "stillness", "void"],
+    "blues": ["blues", "hardship", "lament", "sorrow", "weary", "whiskey"],
+    "bossanova": ["beach", "brazil", "breeze", "cafe", "lazy"],
+    "chill": ["chill", "easy", "laid", "relax", "relaxed", "unwind"],
+    "classical": ["aristocrat", "ballroom", "cathedral", "classical", "court", "elegant", "manor", "orchestra", "orchestral", "regency", "royal", "symphony", "violin", "victorian"],
+    "country": ["cowboy", "farm", "prairie", "ranch", "rural", "western"],
+    "dance": ["ball", "celebration", "dance", "dancing", "festival", "party"],
+    "electronic": ["ai", "android", "cyber", "cyberpunk", "digital", "electronic", "future", "futuristic", "machine", "robot", "synth", "technology"],
+    "folk": ["folk", "folklore", "legend", "myth", "pastoral", "village", "wander", "wandering"],
+    "funk": ["funk", "funky", "groove", "strut"],
+    "goth": ["crypt", "dark", "gothic", "grave", "macabre", "vampire"],
+    "happy": ["cheer", "cheerful", "delight", "glad", "happy", "joy", "joyful", "laugh", "playful"],
+    "hard-rock": ["anger", "fury", "rage", "rebellion", "riot"],
+    "heavy-metal": ["battle", "brutal", "carnage", "demon", "war", "warrior"],
+    "hip-hop": ["city", "hustle", "rap", "street", "urban"],
+    "indie": ["coming", "indie", "quirky", "teen", "youth"],
+    "industrial": ["dystopia", "dystopian", "factory", "industrial", "mechanical", "smoke", "steel"],
+    "jazz": ["bar", "club", "detective", "jazz", "noir", "nightclub", "saxophone", "smoky", "speakeasy", "twenties"],
+    "latin": ["fiesta", "latin", "mexico", "spain", "tropical"],
+    "metal": ["apocalypse", "chaos", "destruction", "doom", "metal", "slaughter"],
+    "movies": ["adventure", "cinematic", "epic", "film", "heroic", "quest", "saga"],
+    "new-age": ["healing", "meditation", "mystical", "spiritual", "tranquil"],
+    "opera": ["aria", "drama", "dramatic", "opera", "tragedy", "tragic"],
+    "piano": ["piano", "gentle", "reflective", "solitude", "tender"],
+    "pop": ["crush", "fun", "pop", "romance", "summer"],
+    "punk": ["anarchy", "defiance", "defiant", "punk", "rebel"],
+    "r-n-b": ["desire", "love", "lover", "passion", "sensual", "soulful"],
+    "rainy-day": ["gloom", "gloomy", "grey", "rain", "rainy", "storm"],
+    "reggae": ["island", "jamaica", "sunshine"],
+    "rock": ["chase", "rock", "road", "rocker", "wild"],
+    "romance": ["affair", "courtship", "kiss", "love", "romance", "romantic", "wedding"],
+    "sad": ["death", "despair", "funeral", "grief", "heartbreak", "loss", "melancholy", "mourning", "sad", "sorrow", "tears"],
+    "singer-songwriter": ["confession", "diary", "heartfelt", "letter", "memoir", "personal"],
+    "sleep": ["dream", "lullaby", "night", "sleep", "slumber"],
+    "soul": ["church", "faith", "gospel", "redemption", "soul"],
+    "soundtracks": ["cinematic", "epic", "fantasy", "kingdom", "magic", "quest", "score", "soundtrack", "tension", "wizard"],
+    "study": ["concentration", "focus", "library", "school", "scholar", "study", "university"],
+    "summer": ["holiday", "sea", "summer", "sun", "sunny", "vacation"],
+    "techno": ["hacker", "neon", "rave", "techno", "warehouse"],
+    "trip-hop": ["espionage", "moody", "mysterious", "mystery", "spy", "suspense"],
+    "world-music": ["africa", "desert", "exotic", "india", "journey", "voyage", "world"],
+}
+
+# Broad genres that suit most books, used to fill the list when few genres match
+FALLBACK_GENRES = ["soundtracks", "ambient", "classical", "piano", "acoustic", "indie", "folk", "chill",
+                   "singer-songwriter", "new-age", "jazz", "rock", "pop", "electronic", "sad", "happy"]
+
+
+def _tokens(text):
+    # Crude singularization so "storms" matches "storm"
+    return [token[:-1] if len(token) > 4 and token.endswith("s") and not token.endswith("ss") else token
+            for token in re.findall(r"[a-z]+", (text or "").lower())]
+
+
+def _phrase(genre):
+    return " ".join(genre.split("-"))
+
+
+def normalize_genre(genre):
+    """Spotify spelling of a genre name, e.g. "Hip Hop" -> "hip-hop"."""
+    return "-".join(str(genre).lower().replace("_", " ").replace("-", " ").split())
+
+
+def score_genres(text, available_genres, preferences="", preference_weight=2):
+    """
+    Keyword relevance of each available genre to a chapter text and the music preferences.
+
+    A genre scores one point per keyword occurrence (GENRE_KEYWORDS or the words of its name) in
+    the text and `preference_weight` points per occurrence in the preferences, plus a bonus when
+    its full name appears. Returns a Counter of genre to score.
+    """
+    text_counts = Counter(_tokens(text))
+    preference_counts = Counter(_tokens(preferences))
+    text_phrase = " ".join(_tokens(text))
+    preference_phrase = " ".join(_tokens(preferences))
+
+    scores = Counter()
+    for genre in available_genres:
+        keywords = set(GENRE_KEYWORDS.get(genre, [])) | set(_tokens(_phrase(genre)))
+        score = sum(text_counts[keyword] + preference_weight * preference_counts[keyword] for keyword in keywords)
+        phrase = " ".join(_tokens(_phrase(genre)))
+        if phrase and re.search(rf"\b{re.escape(phrase)}\b", preference_phrase):
+            score += 3 * preference_weight
+        elif phrase and re.search(rf"\b{re.escape(phrase)}\b", text_phrase):
+            score += 3
+        if score:
+            scores[genre] = score
+    return scores
+
+
+def relevant_genres(text, available_genres, preferences="", top_k=20):
+    """
+    The `top_k` available genres most relevant to the text and preferences, most relevant first.
+
+    Ties keep the order of `available_genres`; places left when fewer genres match are filled
+    from FALLBACK_GENRES and then the rest of the list. A `top_k` of 0 returns every genre.
+    """
+    if not top_k or top_k >= len(available_genres):
+        return list(available_genres)
+    scores = score_genres(text, available_genres, preferences)
+    ranked = sorted(scores, key=lambda genre: -scores[genre])
+    chosen = list(dict.fromkeys(ranked[:top_k]))
+    available = set(available_genres)
+    for genre in FALLBACK_GENRES + list(available_genres):
+        if len(chosen) >= top_k:
+            break
+        if genre in available and genre not in chosen:
+            chosen.append(genre)
+    return chosen
+
+
+def filter_seed_genres(parameters, available_genres):
+    """
+    Keep only seed genres from the full available list, fixing spelling where possible.
+
+    Returns the genres that were dropped. Removes 'seed_genres' entirely when none are valid.
+    """
+    if not isinstance(parameters, dict) or not isinstance(parameters.get('seed_genres'), list):
+        return []
+    available = set(available_genres)
+    kept, dropped = [], []
+    for genre in parameters['seed_genres']:
+        normalized = normalize_genre(genre)
+        if normalized in available:
+            if normalized not in kept:
+                kept.append(normalized)
+        else:
+            dropped.append(genre)
+    if kept:
+        parameters['seed_genres'] = kept
+    else:
+        del parameters['seed_genres']
+    return dropped
@@ -0,0 +1,159 @@
+import functools
+import json
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Prefix for every exported Prometheus metric name
+METRIC_PREFIX = "book_playlist"
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list of samples."""
+    ordered = sorted(samples)
+    # Rounded first so that float error (0.07 * 100 == 7.000000000000001) cannot push the rank up by one
+    rank = math.ceil(round(fraction * len(ordered), 9))
+    return ordered[min(len(ordered) - 1, max(0, rank - 1))]
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """Thread-safe store of span durations and labelled counters for one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.spans = defaultdict(list)
+            self.counters = defaultdict(lambda: defaultdict(float))
+
+    def record_span(self, name, seconds):
+        with self._lock:
+            self.spans[name].append(seconds)
+
+    def increment(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[name][_label_key(labels)] += value
+
+    def report(self):
+        """Run report as a JSON-serializable dict."""
+        with self._lock:
+            spans = {
+                name: {
+                    "count": len(samples),
+                    "total": sum(samples),
+                    "p50": percentile(samples, 0.5),
+                    "p90": percentile(samples, 0.9),
+                    "p99": percentile(samples, 0.99),
+                    "max": max(samples),
+                }
+                for name, samples in self.spans.items() if samples
+            }
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in sorted(values.items())]
+                for name, values in self.counters.items()
+            }
+            return {
+                "started": self.started,
+                "duration_seconds": time.time() - self.started,
+                "spans": spans,
+                "counters": counters,
+            }
+
+    def prometheus_text(self):
+        """Render spans as summaries and counters in the Prometheus text exposition format."""
+        report = self.report()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_span_seconds Duration of pipeline stages.",
+            f"# TYPE {METRIC_PREFIX}_span_seconds summary",
+        ]
+        for name, stats in report["spans"].items():
+            for key, quantile in (("p50", "0.5"), ("p90", "0.9"), ("p99", "0.99")):
+                lines.append(f'{METRIC_PREFIX}_span_seconds{{span="{name}",quantile="{quantile}"}} {stats[key]}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {stats["total"]}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {stats["count"]}')
+        for name, values in report["counters"].items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for entry in values:
+                labels = ",".join(f'{key}="{value}"' for key, value in entry["labels"].items())
+                lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {entry['value']:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as one sample of the named stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_span(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator that records every call of the function as a sample of the named stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name, value=1, **labels):
+    metrics.increment(name, value, **labels)
+
+
+def record_llm_usage(operation, prompt_tokens, completion_tokens, cost=0.0):
+    increment("llm_prompt_tokens_total", prompt_tokens, operation=operation)
+    increment("llm_completion_tokens_total", completion_tokens, operation=operation)
+    if cost:
+        increment("llm_cost_usd_total", cost, operation=operation)
+
+
+def count_retry(api):
+    """tenacity before_sleep hook that counts a retry for `api`."""
+    def before_sleep(retry_state):
+        increment("retries_total", api=api, operation=retry_state.fn.__name__)
+    return before_sleep
+
+
+def log_run_summary():
+    """Log API calls, cache hit rates and token usage for the run so far."""
+    report = metrics.report()
+    for name in ("api_calls_total", "retries_total", "rate_limited_total", "llm_prompt_tokens_total", "llm_completion_tokens_total"):
+        for entry in report["counters"].get(name, []):
+            labels = ", ".join(f"{key}={value}" for key, value in entry["labels"].items())
+            logging.info(f"{name} [{labels}]: {entry['value']:g}")
+    hits = {entry["labels"]["cache"]: entry["value"] for entry in report["counters"].get("cache_hits_total", [])}
+    misses = {entry["labels"]["cache"]: entry["value"] for entry in report["counters"].get("cache_misses_total", [])}
+    for cache in sorted(set(hits) | set(misses)):
+        lookups = hits.get(cache, 0) + misses.get(cache, 0)
+        logging.info(f"Cache {cache}: {hits.get(cache, 0):g}/{lookups:g} hits ({hits.get(cache, 0) / lookups:.0%})")
+    for name, stats in report["spans"].items():
+        logging.info(f"Stage {name}: {stats['count']} calls, {stats['total']:.2f}s total, p90 {stats['p90']:.2f}s")
+
+
+def export_reports(json_path=None, prometheus_path=None):
+    """Write the run report as JSON and/or Prometheus text to the given paths."""
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(metrics.report(), f, indent=2)
+        logging.info(f"Run report written to {json_path}")
+    if prometheus_path:
+        with open(prometheus_path, 'w') as f:
+            f.write(metrics.prometheus_text())
+        logging.info(f"Prometheus metrics written to {prometheus_path}")
@@ -1,27 +1,123 @@
 import random
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
+import hashlib
 import json
 import logging
+import re
+import threading
+import time
 
-from tenacity import retry, retry_if_exception_type, stop_after_attempt
-from config import LOG_LEVEL, OPENAI_MODEL, OPENAI_API_BASE
+from tenacity import retry, retry_if_exception_type, retry_if_not_exception_type, stop_after_attempt, wait_fixed
+from config import OPENAI_MODEL, OPENAI_API_BASE, OPENAI_CONTEXT_WINDOW, OPENAI_MAX_OUTPUT_TOKENS, PARAMETER_BATCH_SIZE, LLM_CACHE_MODE, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES, GENRE_PROMPT_TOP_K
+from cache_utils import SQLiteCache
+from genre_index import filter_seed_genres, relevant_genres
+from instrumentation import count_retry, increment, metrics, timed
+from model_routing import BudgetExceeded, check_budgets, escalate, model_for, record_usage, route
+from structured_output import (CHAPTER_INFO_SCHEMA, CHAPTER_LIST_SCHEMA, PARAMETER_BATCH_SCHEMA,
+                               SPOTIFY_PARAMETERS_SCHEMA, OutputValidationError, clamp_parameters, fields_to_fix,
+                               parameter_fields_schema, parameter_problems, repair_json, response_format, valid_chapters)
+from langchain_community.callbacks import get_openai_callback
 
-# Set up logging
-logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
+# Approximate completion tokens needed for one chapter's parameter object
+PARAMETER_OUTPUT_TOKENS = 200
 
 def langchain_retry_decorator(retry_count=3, custom_wait=1):
+    # Responses that fail validation are repaired or re-prompted field by field, never resent whole,
+    # and a request refused by a budget would only be refused again
     return retry(
-        retry=retry_if_exception_type(Exception),
+        retry=retry_if_exception_type(Exception) & retry_if_not_exception_type((OutputValidationError, BudgetExceeded)),
         stop=stop_after_attempt(retry_count),
-        wait=custom_wait,
+        wait=wait_fixed(custom_wait),
+        before_sleep=count_retry("openai"),
         reraise=True
     )
 
-def initialize_openai():
-    return ChatOpenAI(model_name=OPENAI_MODEL, openai_api_base=OPENAI_API_BASE, temperature=0.7)
+# Chat model class used for every request; the offline benchmark swaps in fake_apis.FakeChatModel.
+# None means ChatOpenAI, imported on first use because langchain_openai and the openai SDK dominate start-up time
+chat_model_factory = None
+
+# Chat models are reused across requests and threads, so their HTTP connections stay open between calls
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+def initialize_openai(model=None, **kwargs):
+    """Shared chat model for these settings, created on first use; `model` defaults to OPENAI_MODEL."""
+    factory = chat_model_factory
+    if factory is None:
+        from langchain_openai import ChatOpenAI
+        factory = ChatOpenAI
+    model = model or OPENAI_MODEL
+    key = (factory, model, json.dumps(kwargs, sort_keys=True))
+    with _chat_models_lock:
+        if key not in _chat_models:
+            _chat_models[key] = factory(model_name=model, openai_api_base=OPENAI_API_BASE, temperature=0.7, **kwargs)
+        return _chat_models[key]
+
+def structured_llm(name, schema, model=None, **kwargs):
+    """Shared chat model that answers in the JSON format of `schema`, as far as STRUCTURED_OUTPUT allows."""
+    output_format = response_format(name, schema)
+    if output_format:
+        kwargs["model_kwargs"] = {"response_format": output_format}
+    return initialize_openai(model, **kwargs)
+
+def escalate_tier(tier, operation):
+    """The tier to retry `operation` on after its output failed validation: the next stronger one, if configured."""
+    stronger = escalate(tier)
+    if stronger is None:
+        return tier
+    logging.info(f"Retrying {operation} on {model_for(stronger)} ({stronger} tier).")
+    increment("llm_escalations_total", operation=operation, tier=stronger)
+    return stronger
+
+_llm_cache = None
+
+def get_llm_cache():
+    """Persistent cache of raw LLM completions keyed by llm_cache_key."""
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = SQLiteCache("llm_responses", ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+    return _llm_cache
+
+def llm_cache_key(model_name, template, inputs, temperature):
+    payload = json.dumps({
+        "model": model_name,
+        "template": template,
+        "inputs": inputs,
+        "temperature": temperature
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def run_cached_chain(llm, prompt, inputs, cache_mode=None, operation="completion"):
+    """
+    Run the prompt through the LLM unless an identical request is already in the response cache.
+
+    Returns (result, cache_key). Responses are not stored here: call cache_llm_response once the
+    result has been validated, so malformed completions are never replayed.
+    cache_mode is "use", "refresh" or "off" and defaults to LLM_CACHE_MODE. API calls and token
+    usage are recorded under `operation` and charged to the active budgets; BudgetExceeded is
+    raised instead of sending a request that an exhausted budget does not allow.
+    """
+    cache_mode = cache_mode or LLM_CACHE_MODE
+    cache_key = llm_cache_key(llm.model_name, prompt.template, inputs, llm.temperature)
+    if cache_mode == "use":
+        hit, result = get_llm_cache().get(cache_key)
+        if hit:
+            logging.info("Using cached response from OpenAI.")
+            return result, cache_key
+
+    check_budgets(estimate_tokens(prompt.format(**inputs)))
+    chain = LLMChain(llm=llm, prompt=prompt)
+    increment("api_calls_total", api="openai", endpoint=operation)
+    with get_openai_callback() as usage:
+        result = chain.run(**inputs, timeout=30)  # Added timeout
+    record_usage(operation, llm.model_name, usage.prompt_tokens, usage.completion_tokens, usage.total_cost)
+    return result, cache_key
+
+def cache_llm_response(cache_key, result, cache_mode=None):
+    if (cache_mode or LLM_CACHE_MODE) != "off":
+        get_llm_cache().set(cache_key, result)
 
 def is_valid_json(json_string):
     try:
@@ -35,8 +131,16 @@ def clean_json_response(response):
     cleaned_response = response.replace("```json", "").replace("```", "").strip()
     return cleaned_response
 
-def extract_chapter_info(book_title, user_input, max_retries=3, initial_tokens=1000):
-    prompt = PromptTemplate(
+def parse_llm_json(response, operation):
+    """Parse a JSON response with local repair, counting each repair; raises OutputValidationError if it cannot be parsed."""
+    value, repairs = repair_json(response)
+    for repair in repairs:
+        logging.warning(f"Repaired the {operation} response: {repair.replace('_', ' ')}.")
+        increment("llm_output_repairs_total", operation=operation, repair=repair)
+    return value, repairs
+
+def chapter_info_prompt():
+    return PromptTemplate(
         input_variables=["book_title", "user_input"],
         template="""
         Based on the following information about the book "{book_title}", extract and complete chapter information:
@@ -59,29 +163,302 @@ def extract_chapter_info(book_title, user_input, max_retries=3, initial_tokens=1
         """
     )
 
+@timed("chapter_extraction")
+def extract_chapter_info(book_title, user_input, max_retries=3, initial_tokens=1000, cache_mode=None):
+    """
+    Extract the chapter list in one response, returning {"num_chapters", "chapters"} or None.
+
+    A malformed or truncated response is repaired locally. When chapters are missing from it,
+    continuation requests ask only for those chapters. The whole prompt is sent again, with a
+    larger token limit and on a stronger model if one is configured, only when no chapter could be recovered.
+    """
+    prompt = chapter_info_prompt()
+    inputs = {"book_title": book_title, "user_input": user_input}
+    tier = route("extract_chapter_info")
+
     for attempt in range(max_retries):
+        if attempt > 0:
+            tier = escalate_tier(tier, "extract_chapter_info")
         try:
             logging.info(f"Attempt {attempt + 1} to extract chapter information.")
-            custom_llm = ChatOpenAI(model_name=OPENAI_MODEL, openai_api_base=OPENAI_API_BASE, temperature=0.7, max_tokens=initial_tokens * (attempt + 1))
-            chain = LLMChain(llm=custom_llm, prompt=prompt)
-            result = chain.run(book_title=book_title, user_input=user_input, timeout=30)  # Added timeout
-            
+            if attempt > 0:
+                increment("retries_total", api="openai", operation="extract_chapter_info")
+            custom_llm = structured_llm("chapter_info", CHAPTER_INFO_SCHEMA, model_for(tier),
+                                        max_tokens=initial_tokens * (attempt + 1))
+            result, cache_key = run_cached_chain(custom_llm, prompt, inputs, cache_mode, "extract_chapter_info")
             logging.info("Received raw response from OpenAI.")
-            cleaned_result = clean_json_response(result)
-            logging.info("Cleaned the response.")
-            
-            if is_valid_json(cleaned_result):
-                chapter_info = json.loads(cleaned_result)
-                logging.info("Successfully extracted chapter information.")
-                return chapter_info
-            else:
-                logging.warning(f"Attempt {attempt + 1}: Invalid JSON response. Retrying with increased token limit.")
+
+            chapter_info, repairs = parse_llm_json(result, "extract_chapter_info")
+            chapters = valid_chapters(chapter_info.get('chapters') if isinstance(chapter_info, dict) else chapter_info)
+            if not chapters:
+                logging.warning(f"Attempt {attempt + 1}: No usable chapters in the response. Retrying with increased token limit.")
+                continue
+            num_chapters = chapter_info.get('num_chapters') if isinstance(chapter_info, dict) else None
+            if not isinstance(num_chapters, int) or num_chapters < chapters[-1]['number']:
+                num_chapters = chapters[-1]['number'] if repairs else len(chapters)
+            if len(chapters) < num_chapters:
+                chapters = continue_chapter_list(book_title, user_input, chapters, num_chapters, max_retries,
+                                                 initial_tokens * (attempt + 1), model_for(tier))
+
+            chapter_info = {"num_chapters": num_chapters, "chapters": chapters}
+            # The repaired and completed list is cached, so a replay needs no repairs or continuations
+            cache_llm_response(cache_key, result if not repairs and len(chapters) == num_chapters else json.dumps(chapter_info), cache_mode)
+            logging.info("Successfully extracted chapter information.")
+            return chapter_info
+        except OutputValidationError as e:
+            logging.warning(f"Attempt {attempt + 1}: {e} Retrying with increased token limit.")
+        except BudgetExceeded as e:
+            logging.error(f"Not extracting chapter information: {e}")
+            return None
         except Exception as e:
             logging.error(f"Attempt {attempt + 1}: Error extracting chapter information: {e}")
-        
+
     logging.error("Failed to extract valid chapter information after multiple attempts.")
     return None
 
+def continue_chapter_list(book_title, user_input, chapters, num_chapters, max_requests=3, max_tokens=1000, model=None):
+    """Request the chapters after the last one in `chapters` until `num_chapters` are known or a request adds none."""
+    prompt = chapter_continuation_prompt()
+    llm = structured_llm("chapter_list", CHAPTER_LIST_SCHEMA, model or model_for(route("extract_chapter_info_continuation")),
+                         max_tokens=max_tokens)
+    chapters = list(chapters)
+    for _ in range(max_requests):
+        last_chapter = chapters[-1]['number']
+        logging.warning(f"Chapter list was cut off after chapter {last_chapter}. Requesting a continuation.")
+        inputs = {"book_title": book_title, "user_input": user_input, "last_chapter": last_chapter,
+                  "next_chapter": last_chapter + 1, "total_hint": f" (the book has {num_chapters} chapters)"}
+        try:
+            # Continuations are not cached on their own; the completed list is
+            result, _ = run_cached_chain(llm, prompt, inputs, "off", "extract_chapter_info_continuation")
+            continuation, _ = parse_llm_json(result, "extract_chapter_info_continuation")
+        except Exception as e:
+            logging.error(f"Error requesting the chapters after chapter {last_chapter}: {e}")
+            break
+        new_chapters = [chapter for chapter in valid_chapters(
+            continuation.get('chapters') if isinstance(continuation, dict) else continuation)
+            if chapter['number'] > last_chapter]
+        if not new_chapters:
+            break
+        chapters.extend(new_chapters)
+        if chapters[-1]['number'] >= num_chapters:
+            break
+    return chapters
+
+class ChapterStreamParser:
+    """
+    Incremental parser for a streamed chapter-information JSON response.
+
+    feed() accepts response text as it arrives and returns the chapter objects from the "chapters"
+    array whose closing brace has been received. `complete` is set once the array is closed.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.complete = False
+        self.num_chapters = None
+        self._object_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        self.buffer += text
+        if self.num_chapters is None:
+            match = re.search(r'"num_chapters"\s*:\s*(\d+)', self.buffer)
+            if match:
+                self.num_chapters = int(match.group(1))
+        if not self.in_array:
+            match = re.search(r'"chapters"\s*:\s*\[', self.buffer)
+            if not match:
+                return []
+            self.in_array = True
+            self.position = match.end()
+        return self._scan()
+
+    def _scan(self):
+        chapters = []
+        while self.position < len(self.buffer) and not self.complete:
+            char = self.buffer[self.position]
+            if self._object_start is None:
+                if char == '{':
+                    self._object_start = self.position
+                    self._depth = 1
+                elif char == ']':
+                    self.complete = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        chapters.append(repair_json(self.buffer[self._object_start:self.position + 1])[0])
+                    except OutputValidationError:
+                        logging.warning("Skipping malformed chapter object in streamed response.")
+                    self._object_start = None
+            self.position += 1
+        return chapters
+
+def chapter_continuation_prompt():
+    return PromptTemplate(
+        input_variables=["book_title", "user_input", "last_chapter", "next_chapter", "total_hint"],
+        template="""
+        Based on the following information about the book "{book_title}", continue a list of chapter summaries:
+
+        User input: {user_input}
+
+        Chapters 1 to {last_chapter} have already been summarized{total_hint}. Provide a brief summary for each remaining chapter, starting with chapter {next_chapter}.
+
+        Format the output as a JSON object with the following structure:
+        {{
+            "chapters": [
+                {{"number": {next_chapter}, "summary": "<chapter {next_chapter} summary>"}},
+                ...
+            ]
+        }}
+        """
+    )
+
+def stream_chapter_info(book_title, user_input, max_retries=3, max_tokens=2000, cache_mode=None):
+    """
+    Stream chapter information, yielding each chapter as soon as its JSON object is complete.
+
+    If the response is cut off before the chapter list is closed, a continuation request asks for
+    the chapters after the last complete one instead of regenerating the whole list. Continuations
+    go on as long as they make progress; up to `max_retries` requests in a row may return no new chapters.
+    """
+    prompt = chapter_info_prompt()
+    inputs = {"book_title": book_title, "user_input": user_input}
+    llm = structured_llm("chapter_info", CHAPTER_INFO_SCHEMA, model_for(route("stream_chapter_info")), max_tokens=max_tokens)
+
+    cache_mode = cache_mode or LLM_CACHE_MODE
+    cache_key = llm_cache_key(llm.model_name, prompt.template, inputs, llm.temperature)
+    if cache_mode == "use":
+        hit, result = get_llm_cache().get(cache_key)
+        if hit:
+            logging.info("Using cached chapter information.")
+            yield from json.loads(clean_json_response(result))['chapters']
+            return
+
+    started = time.perf_counter()
+    chapters = []
+    num_chapters = None
+    request_text = prompt.format(**inputs)
+    request = 0
+    failures = 0
+    complete = False
+    while True:
+        parser = ChapterStreamParser()
+        received = 0
+        logging.info(f"Request {request + 1}: Streaming chapter information.")
+        try:
+            check_budgets(estimate_tokens(request_text))
+        except BudgetExceeded as e:
+            logging.error(f"Not streaming chapter information: {e}")
+            break
+        increment("api_calls_total", api="openai", endpoint="stream_chapter_info")
+        if request > 0:
+            increment("retries_total", api="openai", operation="stream_chapter_info")
+        try:
+            for chunk in llm.stream(request_text):
+                for chapter in parser.feed(chunk.content):
+                    if not isinstance(chapter.get('number'), int) or 'summary' not in chapter:
+                        continue
+                    if chapters and chapter['number'] <= chapters[-1]['number']:
+                        continue
+                    chapters.append(chapter)
+                    received += 1
+                    yield chapter
+        except Exception as e:
+            logging.error(f"Request {request + 1}: Error streaming chapter information: {e}")
+
+        # Streamed responses carry no usage data, so token counts are estimated from the text
+        record_usage("stream_chapter_info", llm.model_name, estimate_tokens(request_text), estimate_tokens(parser.buffer))
+        num_chapters = num_chapters or parser.num_chapters
+        if parser.complete or (num_chapters and len(chapters) >= num_chapters):
+            complete = True
+            break
+        failures = failures + 1 if received == 0 else 0
+        if failures >= max_retries:
+            logging.error("Chapter list is still incomplete after multiple requests without new chapters.")
+            break
+
+        last_chapter = chapters[-1]['number'] if chapters else 0
+        logging.warning(f"Chapter list was cut off after chapter {last_chapter}. Requesting a continuation.")
+        request_text = chapter_continuation_prompt().format(
+            book_title=book_title,
+            user_input=user_input,
+            last_chapter=last_chapter,
+            next_chapter=last_chapter + 1,
+            total_hint=f" (the book has {num_chapters} chapters)" if num_chapters else ""
+        )
+        request += 1
+
+    # Wall time of the whole stream, including continuation requests
+    metrics.record_span("chapter_extraction", time.perf_counter() - started)
+    if complete and chapters:
+        logging.info(f"Successfully streamed information for {len(chapters)} chapters.")
+        result = json.dumps({"num_chapters": num_chapters or len(chapters), "chapters": chapters})
+        cache_llm_response(cache_key, result, cache_mode)
+
+def chunk_summary_prompt():
+    return PromptTemplate(
+        input_variables=["book_title", "chapter_title", "part", "parts", "text"],
+        template="""
+        Summarize part {part} of {parts} of the chapter "{chapter_title}" from the book "{book_title}".
+        Describe the events, the setting and above all the mood and atmosphere, in at most four sentences.
+
+        Text:
+        {text}
+        """
+    )
+
+def merge_summaries_prompt():
+    return PromptTemplate(
+        input_variables=["book_title", "chapter_title", "summaries"],
+        template="""
+        The following are summaries of consecutive parts of the chapter "{chapter_title}" from the book "{book_title}":
+
+        {summaries}
+
+        Combine them into one brief summary of the whole chapter, in at most five sentences, keeping the events in order and describing the chapter's mood and atmosphere.
+        """
+    )
+
+def _summarize(prompt, inputs, operation, max_tokens, cache_mode=None):
+    llm = initialize_openai(model_for(route(operation)), max_tokens=max_tokens)
+    result, cache_key = run_cached_chain(llm, prompt, inputs, cache_mode, operation)
+    summary = result.strip()
+    if not summary:
+        raise OutputValidationError("Empty summary.")
+    cache_llm_response(cache_key, summary, cache_mode)
+    return summary
+
+@timed("chunk_summarization")
+@langchain_retry_decorator()
+def summarize_chunk(book_title, chapter_title, text, part=1, parts=1, max_tokens=250, cache_mode=None):
+    """Summarize one chunk of a chapter's text (the map step of book ingestion)."""
+    inputs = {"book_title": book_title, "chapter_title": chapter_title, "part": part, "parts": parts, "text": text}
+    return _summarize(chunk_summary_prompt(), inputs, "summarize_chunk", max_tokens, cache_mode)
+
+@timed("summary_merge")
+@langchain_retry_decorator()
+def merge_chapter_summaries(book_title, chapter_title, summaries, max_tokens=250, cache_mode=None):
+    """Combine the summaries of consecutive parts of a chapter into one (the reduce step of book ingestion)."""
+    inputs = {"book_title": book_title, "chapter_title": chapter_title,
+              "summaries": "\n\n        ".join(f"Part {i}: {summary}" for i, summary in enumerate(summaries, 1))}
+    return _summarize(merge_summaries_prompt(), inputs, "merge_chapter_summaries", max_tokens, cache_mode)
+
 def reduce_seeds(parameters):
     seed_types = ['seed_genres', 'seed_tracks', 'seed_artists']
     total_seeds = sum(len(parameters.get(seed_type, [])) for seed_type in seed_types)
@@ -106,8 +483,109 @@ def reduce_seeds(parameters):
 
     return parameters
 
+def check_seed_genres(parameters, available_genres):
+    """Drop generated seed genres that are not in the full genre list, logging and counting them."""
+    dropped = filter_seed_genres(parameters, available_genres)
+    if dropped:
+        logging.warning(f"Dropped unknown seed genres: {', '.join(map(str, dropped))}")
+        increment("invalid_seed_genres_total", len(dropped))
+    return parameters
+
+def validate_spotify_parameters(parameters):
+    """Check generated parameters against the recommendation API's rules, logging the first problem found."""
+    problems = parameter_problems(parameters)
+    if problems:
+        field, problem = next(iter(problems.items()))
+        logging.error(f"Invalid {field}: {problem}")
+        return False
+    return True
+
+# What each parameter field should hold, as described in the parameter prompts
+PARAMETER_FIELD_DESCRIPTIONS = {
+    "seed_genres": "A list of 1 to 5 genres that match the chapter's mood and theme, chosen precisely from the available genres.",
+    "seed_tracks": "A list of 1 to 5 track names (including artist names) that match the chapter's mood and theme.",
+    "seed_artists": "A list of 1 to 5 artist names that match the chapter's mood and theme.",
+    "target_valence": "A float between 0 and 1 representing the musical positiveness.",
+    "target_energy": "A float between 0 and 1 representing the intensity and activity.",
+    "target_tempo": "An integer representing the estimated tempo in BPM.",
+    "limit": "An integer for the number of tracks to return (max 50).",
+}
+
+def prepare_parameters(parameters, available_genres):
+    """Clamp, check the seed genres of and reduce the seeds of generated parameters; returns (parameters, problems)."""
+    if not isinstance(parameters, dict):
+        return parameters, parameter_problems(parameters)
+    changed = clamp_parameters(parameters)
+    if changed:
+        logging.info(f"Clamped parameter values: {', '.join(changed)}")
+        increment("llm_output_repairs_total", len(changed), operation="parameters", repair="clamped")
+    try:
+        check_seed_genres(parameters, available_genres)
+        parameters = reduce_seeds(parameters)
+    except (TypeError, AttributeError):
+        pass  # Seed fields that are not lists, reported by parameter_problems
+    return parameters, parameter_problems(parameters)
+
+def parameter_fields_prompt():
+    return PromptTemplate(
+        input_variables=["book_title", "chapter_summary", "music_preferences", "available_genres", "parameters", "problems", "fields"],
+        template="""
+        These parameters for Spotify's recommendation API were generated for a book chapter, but some fields are missing or invalid:
+        Book: {book_title}
+        Chapter summary: {chapter_summary}
+        Music preferences: {music_preferences}
+        Available genres: {available_genres}
+        Parameters: {parameters}
+        Problems: {problems}
+
+        Provide only the following fields as a JSON object:
+        {fields}
+
+        The total number of seeds across seed_genres, seed_tracks and seed_artists should not exceed 5.
+        """
+    )
+
+def fix_parameter_fields(book_title, chapter_summary, music_preferences, genre_list, available_genres, parameters,
+                         problems, cache_mode=None, model=None):
+    """
+    Ask again for only the parameter fields that failed validation and merge the answer into `parameters`.
+
+    Returns the merged parameters with the remaining problems, as prepare_parameters does.
+    """
+    fields = fields_to_fix(problems)
+    kept = {key: value for key, value in parameters.items() if key not in fields} if isinstance(parameters, dict) else {}
+    logging.info(f"Requesting corrected values for: {', '.join(fields)}")
+    increment("llm_field_reprompts_total", operation="generate_spotify_parameters")
+    inputs = {
+        "book_title": book_title,
+        "chapter_summary": chapter_summary,
+        "music_preferences": music_preferences,
+        "available_genres": genre_list,
+        "parameters": json.dumps(kept),
+        "problems": "; ".join(f"{field}: {problem}" for field, problem in problems.items()),
+        "fields": "\n        ".join(f"- '{field}': {PARAMETER_FIELD_DESCRIPTIONS[field]}" for field in fields),
+    }
+    llm = structured_llm("parameter_fields", parameter_fields_schema(fields), model or model_for(route("fix_parameter_fields")),
+                         max_tokens=PARAMETER_OUTPUT_TOKENS)
+    try:
+        result, cache_key = run_cached_chain(llm, parameter_fields_prompt(), inputs, cache_mode, "fix_parameter_fields")
+        fixes, _ = parse_llm_json(result, "fix_parameter_fields")
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        logging.error(f"Error requesting corrected parameter fields: {e}")
+        return parameters, problems
+    if not isinstance(fixes, dict):
+        return parameters, problems
+    merged, remaining = prepare_parameters(dict(kept, **{field: fixes[field] for field in fields if field in fixes}),
+                                           available_genres)
+    if not remaining:
+        cache_llm_response(cache_key, result, cache_mode)
+    return merged, remaining
+
+@timed("parameter_generation")
 @langchain_retry_decorator()
-def generate_spotify_parameters(book_title, chapter_summary, music_preferences, available_genres):
+def generate_spotify_parameters(book_title, chapter_summary, music_preferences, available_genres, cache_mode=None):
     prompt = PromptTemplate(
         input_variables=["book_title", "chapter_summary", "music_preferences", "available_genres"],
         template="""
@@ -132,45 +610,190 @@ def generate_spotify_parameters(book_title, chapter_summary, music_preferences,
         """
     )
 
-    llm = initialize_openai()
-    chain = LLMChain(llm=llm, prompt=prompt)
+    genre_list = ", ".join(relevant_genres(chapter_summary, available_genres, music_preferences, GENRE_PROMPT_TOP_K))
+    inputs = {
+        "book_title": book_title,
+        "chapter_summary": chapter_summary,
+        "music_preferences": music_preferences,
+        "available_genres": genre_list
+    }
+    tier = route("generate_spotify_parameters", estimate_tokens(prompt.format(**inputs)))
 
     try:
-        logging.info("Generating Spotify parameters.")
-        result = chain.run(book_title=book_title, chapter_summary=chapter_summary, music_preferences=music_preferences, available_genres=", ".join(available_genres), timeout=30)  # Added timeout
-        logging.info("Received raw parameters response from OpenAI.")
-        parameters = json.loads(clean_json_response(result))
-        parameters = reduce_seeds(parameters)
-        logging.info(f"Reduced parameters: {parameters}")
-        
-
-        # Validate parameters
-        total_seeds = len(parameters.get('seed_genres', [])) + len(parameters.get('seed_tracks', [])) + len(parameters.get('seed_artists', []))
-        if total_seeds == 0 or total_seeds > 5:
-            logging.error(f"Invalid total number of seeds: {total_seeds}. Must be between 1 and 5.")
-            return None
+        while True:
+            llm = structured_llm("spotify_parameters", SPOTIFY_PARAMETERS_SCHEMA, model_for(tier))
+            logging.info("Generating Spotify parameters.")
+            result, cache_key = run_cached_chain(llm, prompt, inputs, cache_mode, "generate_spotify_parameters")
+            logging.info("Received raw parameters response from OpenAI.")
+            try:
+                parameters, repairs = parse_llm_json(result, "generate_spotify_parameters")
+            except OutputValidationError as e:
+                logging.warning(f"Unusable parameters response: {e}")
+                parameters, repairs = None, ["unparseable"]
+            parameters, problems = prepare_parameters(parameters, available_genres)
+            corrected = bool(problems)
+            if problems:
+                # Ask only for the failed fields rather than regenerating the whole object
+                parameters, problems = fix_parameter_fields(book_title, chapter_summary, music_preferences, genre_list,
+                                                            available_genres, parameters, problems, cache_mode,
+                                                            model_for(tier))
+            logging.info(f"Reduced parameters: {parameters}")
 
-        for seed_type in ['seed_genres', 'seed_tracks', 'seed_artists']:
-            if seed_type in parameters and (len(parameters[seed_type]) < 1 or len(parameters[seed_type]) > 5):
-                logging.error(f"Invalid {seed_type}: Must contain between 1 and 5 items.")
+            if validate_spotify_parameters(parameters):
+                break
+            stronger = escalate_tier(tier, "generate_spotify_parameters")
+            if stronger == tier:
                 return None
-        
-        for feature in ['valence', 'energy']:
-            target_key = f'target_{feature}'
-            if not (0 <= parameters[target_key] <= 1):
-                logging.error(f"Invalid {target_key}: Must be between 0 and 1.")
-                return None
-
-        if not isinstance(parameters['target_tempo'], (int, float)) or parameters['target_tempo'] < 0:
-            logging.error("Invalid target_tempo: Must be a non-negative number.")
-            return None
-
-        if not isinstance(parameters['limit'], int) or parameters['limit'] <= 0 or parameters['limit'] > 50:
-            logging.error("Invalid limit: Must be an integer between 1 and 50.")
-            return None
+            tier = stronger
 
+        # Repaired or corrected responses are cached in their final form
+        cache_llm_response(cache_key, result if not repairs and not corrected else json.dumps(parameters), cache_mode)
         logging.info("Successfully generated Spotify parameters.")
         return parameters
     except Exception as e:
         logging.error(f"Error generating Spotify parameters: {e}")
         raise e
+
+
+def estimate_tokens(text):
+    # Rough estimate for English prompts: about four characters per token
+    return len(text) // 4 + 1
+
+def parameter_batch_size(chapters, fixed_prompt_text, max_batch_size=PARAMETER_BATCH_SIZE,
+                         context_window=OPENAI_CONTEXT_WINDOW, max_output_tokens=OPENAI_MAX_OUTPUT_TOKENS):
+    """Number of chapters that fit in one batched parameter request for the model's context window."""
+    if not chapters:
+        return max(1, max_batch_size)
+    per_chapter_input = max(estimate_tokens(f"Chapter {chapter['number']}: {chapter['summary']}") for chapter in chapters)
+    available_input = context_window - estimate_tokens(fixed_prompt_text) - max_output_tokens
+    by_input = available_input // per_chapter_input if available_input > 0 else 1
+    by_output = max_output_tokens // PARAMETER_OUTPUT_TOKENS
+    return max(1, min(max_batch_size, by_input, by_output))
+
+def _chapter_number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_parameter_batch(parsed, chapters):
+    """Map a parsed array of parameter objects (or an object holding one) back onto chapters, by 'chapter' number or by position."""
+    if isinstance(parsed, dict):
+        parsed = next((value for value in parsed.values() if isinstance(value, list)), [])
+
+    # Numbers may come back as strings ("3") or be missing; those without a usable number go by position
+    positions = {_chapter_number(chapter['number']): position for position, chapter in enumerate(chapters)}
+    positions.pop(None, None)
+    results = [None] * len(chapters)
+    for position, item in enumerate(parsed):
+        if not isinstance(item, dict):
+            continue
+        number = _chapter_number(item.pop('chapter', None))
+        index = positions.get(number) if number is not None else position
+        if index is not None and index < len(chapters):
+            results[index] = item
+    return results
+
+@timed("parameter_generation")
+def generate_spotify_parameters_batch(book_title, chapters, music_preferences, available_genres, max_retries=3, cache_mode=None):
+    """
+    Generate Spotify parameters for several chapters with a single chat completion per attempt.
+
+    Each element is clamped and goes through reduce_seeds and validation; an element with invalid
+    fields is completed by fix_parameter_fields, and only the chapters still missing or invalid are
+    sent again, on a stronger model if one is configured. Returns a list aligned with chapters,
+    with None for chapters that never validated. BudgetExceeded is raised when a budget runs out.
+    """
+    prompt = PromptTemplate(
+        input_variables=["book_title", "chapters", "music_preferences", "available_genres"],
+        template="""
+        Based on the following information about several chapters of a book, generate parameters for Spotify's recommendation API for each chapter:
+        Book: {book_title}
+        Music preferences: {music_preferences}
+        Available genres: {available_genres}
+
+        Chapters:
+        {chapters}
+
+        For each chapter, provide the following parameters as a JSON object:
+        1. 'chapter': The chapter number.
+        2. 'seed_genres': A list of 1 to 5 genres that match the chapter's mood and theme, chosen precisely from the available genres.
+        3. 'seed_tracks': A list of 1 to 5 track names (including artist names) that match the chapter's mood and theme. Use your knowledge to suggest appropriate tracks.
+        4. 'seed_artists': A list of 1 to 5 artist names that match the chapter's mood and theme. Use your knowledge to suggest appropriate artists.
+        5. 'target_valence': A float between 0 and 1 representing the musical positiveness.
+        6. 'target_energy': A float between 0 and 1 representing the intensity and activity.
+        7. 'target_tempo': An integer representing the estimated tempo in BPM.
+        8. 'limit': An integer for the number of tracks to return (max 50).
+
+        Important: Provide at least 1 and up to 5 items for each of seed_genres, seed_tracks, and seed_artists. The total number of seeds across all three categories should not exceed 5.
+
+        Format the output as a JSON object whose 'parameters' field is an array with exactly one object per chapter, in the same order as the chapters above.
+        """
+    )
+
+    results = [None] * len(chapters)
+    pending = list(range(len(chapters)))
+    tier = None
+
+    for attempt in range(max_retries):
+        pending_chapters = [chapters[i] for i in pending]
+        genre_list = ", ".join(relevant_genres(
+            " ".join(chapter['summary'] for chapter in pending_chapters), available_genres, music_preferences,
+            GENRE_PROMPT_TOP_K))
+        inputs = {
+            "book_title": book_title,
+            "chapters": "\n        ".join(f"Chapter {chapter['number']}: {chapter['summary']}" for chapter in pending_chapters),
+            "music_preferences": music_preferences,
+            "available_genres": genre_list
+        }
+        if tier is None:
+            tier = route("generate_spotify_parameters_batch", estimate_tokens(prompt.format(**inputs)))
+        else:
+            tier = escalate_tier(tier, "generate_spotify_parameters_batch")
+        llm = structured_llm("spotify_parameters_batch", PARAMETER_BATCH_SCHEMA, model_for(tier))
+
+        try:
+            logging.info(f"Attempt {attempt + 1}: Generating Spotify parameters for {len(pending_chapters)} chapters.")
+            if attempt > 0:
+                increment("retries_total", api="openai", operation="generate_spotify_parameters_batch")
+            result, cache_key = run_cached_chain(llm, prompt, inputs, cache_mode, "generate_spotify_parameters_batch")
+            logging.info("Received raw batch parameters response from OpenAI.")
+            parsed, repairs = parse_llm_json(result, "generate_spotify_parameters_batch")
+            batch = _parse_parameter_batch(parsed, pending_chapters)
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            logging.error(f"Attempt {attempt + 1}: Error generating batch Spotify parameters: {e}")
+            continue
+
+        still_pending = []
+        corrected = bool(repairs)
+        for index, parameters in zip(pending, batch):
+            if parameters is None:
+                # Missing from the response, typically cut off by truncation
+                logging.warning(f"Attempt {attempt + 1}: No parameters for Chapter {chapters[index]['number']}.")
+                still_pending.append(index)
+                continue
+            parameters, problems = prepare_parameters(parameters, available_genres)
+            if problems:
+                corrected = True
+                parameters, problems = fix_parameter_fields(book_title, chapters[index]['summary'], music_preferences,
+                                                            genre_list, available_genres, parameters, problems, cache_mode,
+                                                            model_for(tier))
+            if validate_spotify_parameters(parameters):
+                results[index] = parameters
+            else:
+                logging.warning(f"Attempt {attempt + 1}: Invalid parameters for Chapter {chapters[index]['number']}.")
+                still_pending.append(index)
+
+        if not still_pending:
+            if corrected:
+                result = json.dumps({"parameters": [dict(results[index], chapter=chapters[index]['number'])
+                                                    for index in pending]})
+            cache_llm_response(cache_key, result, cache_mode)
+            logging.info(f"Successfully generated Spotify parameters for {len(pending)} chapters.")
+            return results
+        pending = still_pending
+
+    logging.error(f"Failed to generate valid parameters for {len(pending)} chapters after multiple attempts.")
+    return results
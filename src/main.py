@@ -1,36 +1,232 @@
-from config import LOG_LEVEL, print_configuration
-from langchain_utils import extract_chapter_info, generate_spotify_parameters
-from spotify_utils import create_playlist_with_description, initialize_spotify, get_spotify_recommendations, create_spotify_playlist, get_available_genre_seeds
-from playlist_config import save_config, load_config, select_config_file
+from config import BATCH_REPORT_PATH, BATCH_WORKERS, LOG_LEVEL, SERVICE_HOST, SERVICE_MAX_QUEUED, SERVICE_PORT, SERVICE_WORKERS, METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH, print_configuration
+from instrumentation import export_reports, log_run_summary
+from playlist_config import CONFIG_DIR, format_config_summary, get_config_store, save_config, load_config, load_config_source, resolve_config_sources, select_config_file, validate_config
+from checkpoint import RunJournal, find_journal, list_journals
+import argparse
+import json
 import logging
+import os
+
+# The Spotify client, LangChain and the pipeline modules are imported inside the commands that
+# need them, so listing or validating configurations does not pay for loading them.
 
 # Set up logging
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
 def get_user_input():
     book_title = input("Enter the book title: ")
-    user_input = input("Enter any comments about the book and summaries of some chapters: ")
+    book_file = input("Enter the path of the book as a text or EPUB file, or press Enter to describe it instead: ").strip()
+    user_input = "" if book_file else input("Enter any comments about the book and summaries of some chapters: ")
     music_preferences = input("Enter any music preferences (e.g., genre, instrumental only): ")
     vocal_preference = input("Do you want vocal tracks, instrumental tracks, or both? ((v)ocal/(i)nstrumental/(b)oth): ")
     min_instrumentalness = input("Enter a minimum instrumentalness value (0-1) or press Enter to skip: ")
-    return {
+    config = {
         "book_title": book_title,
         "user_input": user_input,
         "music_preferences": music_preferences,
         "vocal_preference": vocal_preference,
         "min_instrumentalness": min_instrumentalness
     }
+    if book_file:
+        config["book_file"] = book_file
+    return config
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Spotify playlists for the chapters of a book.")
+    subparsers = parser.add_subparsers(dest="command")
+    list_parser = subparsers.add_parser("list", help="List saved configurations.")
+    list_parser.add_argument("prefix", nargs="?", default="", help="Only list configurations whose name or book title starts with this")
+    list_parser.add_argument("--limit", type=int, default=50, help="Configurations per page")
+    list_parser.add_argument("--offset", type=int, default=0, help="Configurations to skip")
+    import_parser = subparsers.add_parser("import", help="Import JSON configuration files into the configuration store.")
+    import_parser.add_argument("paths", nargs="*", default=[CONFIG_DIR],
+                               help=f"JSON files or directories of them, saved under their file names (default: {CONFIG_DIR}/)")
+    export_parser = subparsers.add_parser("export", help="Export saved configurations as JSON files.")
+    export_parser.add_argument("directory", help="Directory to write <name>.json files to")
+    export_parser.add_argument("--prefix", default="", help="Only export configurations whose name or book title starts with this")
+    validate_parser = subparsers.add_parser("validate", help="Check configurations without running them.")
+    validate_parser.add_argument("configs", nargs="*", default=[],
+                                 help="Configuration directories, JSON files or saved configuration names (default: every saved configuration)")
+    batch_parser = subparsers.add_parser("batch", help="Process saved configurations without prompts.")
+    batch_parser.add_argument("configs", nargs="*", default=[],
+                              help="Configuration directories, JSON files or saved configuration names (default: every saved configuration)")
+    batch_parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Number of books processed at once")
+    batch_parser.add_argument("--report", default=BATCH_REPORT_PATH, help="Path of the JSON summary report")
+    batch_parser.add_argument("--resume", action="store_true", help="Continue unfinished runs instead of starting over")
+    resume_parser = subparsers.add_parser("resume", help="Continue an interrupted run from its checkpoint.")
+    resume_parser.add_argument("target", nargs="?",
+                               help="Run ID, saved configuration name or JSON file (default: the most recent unfinished run)")
+    resume_parser.add_argument("--list", action="store_true", help="List checkpointed runs and exit")
+    ingest_parser = subparsers.add_parser("ingest", help="Split a text or EPUB book into chapters and summarize them.")
+    ingest_parser.add_argument("book_file", help="Plain-text or EPUB file of the book")
+    ingest_parser.add_argument("--title", help="Book title used in the prompts (default: the file name)")
+    ingest_parser.add_argument("--output", help="Write the chapter list as JSON to this path instead of printing it")
+    serve_parser = subparsers.add_parser("serve", help="Run a local HTTP service that accepts book jobs.")
+    serve_parser.add_argument("--host", default=SERVICE_HOST, help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Number of books processed at once")
+    serve_parser.add_argument("--max-queued", type=int, default=SERVICE_MAX_QUEUED, help="Jobs allowed to wait for a worker")
+    return parser.parse_args(argv)
+
+def run_list_mode(args):
+    store = get_config_store()
+    total = store.count(args.prefix)
+    if not total:
+        print("No configurations found.")
+        return
+    page = store.search(args.prefix, args.limit, args.offset)
+    for summary in page:
+        print(format_config_summary(summary))
+    if len(page) < total:
+        print(f"Showing {args.offset + 1}-{args.offset + len(page)} of {total}; use --offset to see more.")
+
+def run_import_mode(args):
+    count = get_config_store().import_json(args.paths)
+    print(f"Imported {count} configurations.")
+
+def run_export_mode(args):
+    count = get_config_store().export_json(args.directory, args.prefix)
+    print(f"Exported {count} configurations to {args.directory}")
+
+def run_validate_mode(args):
+    """Validate configuration files; returns False if any is invalid."""
+    all_valid = True
+    for source in resolve_config_sources(args.configs):
+        try:
+            problems = validate_config(load_config_source(source)[0])
+        except (OSError, json.JSONDecodeError) as e:
+            problems = [str(e)]
+        if problems:
+            all_valid = False
+            print(f"{source}: invalid")
+            for problem in problems:
+                print(f"  - {problem}")
+        else:
+            print(f"{source}: ok")
+    return all_valid
+
+def start_spotify():
+    """Initialize the Spotify client (running the OAuth flow if needed) and fetch the genre seeds."""
+    from spotify_utils import initialize_spotify, get_available_genre_seeds
 
-def main():
-    logging.info("Application started.")
-    print_configuration()  # Output the configuration at startup
-    
     sp = initialize_spotify()
     if not sp:
         logging.error("Failed to initialize Spotify. Exiting.")
+        return None, None
+    return sp, get_available_genre_seeds(sp)
+
+def find_resume_journal(target):
+    """Find the checkpoint to resume from a run ID, a saved configuration name or a configuration file."""
+    journal = find_journal(target)
+    if journal is None and target:
+        try:
+            journal = RunJournal.open(load_config_source(target)[0])
+        except (OSError, json.JSONDecodeError):
+            journal = None
+    return journal
+
+def run_resume_mode(args):
+    if args.list:
+        for journal in list_journals():
+            status = "finished" if journal.finished else "unfinished"
+            print(f"{journal.run_id}: {status}, {len(journal.playlists)}/{len(journal.chapters)} playlists")
         return
 
+    journal = find_resume_journal(args.target)
+    if journal is None:
+        logging.error("No checkpointed run found to resume.")
+        return
+    if journal.finished:
+        print(f"Run {journal.run_id} already finished.")
+        for url in journal.playlist_urls():
+            print(url)
+        return
+
+    sp, available_genres = start_spotify()
+    if not sp:
+        return
+
+    from pipeline import generate_book_playlists
+
+    logging.info(f"Resuming run {journal.run_id}: {len(journal.playlists)} of {len(journal.chapters)} playlists already created.")
+    generate_book_playlists(sp, journal.config, available_genres, journal)
+
+def run_batch_mode(args):
+    # Fetched once and shared by every job
+    sp, available_genres = start_spotify()
+    if not sp:
+        return
+
+    from batch import run_batch, write_batch_report
+
+    report = run_batch(sp, args.configs, available_genres, args.workers, args.resume)
+    write_batch_report(report, args.report)
+    print(f"Jobs: {report['total']} (succeeded: {report['succeeded']}, partial: {report['partial']}, failed: {report['failed']})")
+    print(f"Playlists created: {report['playlists_created']} in {report['duration_seconds']:.1f}s")
+
+def run_ingest_mode(args):
+    """Print or save the chapter list summarized from a book file; returns False if none was produced."""
+    from book_ingestion import ingest_book
+
+    title = args.title or os.path.splitext(os.path.basename(args.book_file))[0]
+    chapter_info = ingest_book(args.book_file, title)
+    if not chapter_info:
+        return False
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(chapter_info, f, indent=2)
+        print(f"Chapter list written to {args.output}")
+    else:
+        print(json.dumps(chapter_info, indent=2))
+    return True
+
+def run_serve_mode(args):
+    # Authorized and warmed up once; every job reuses the client, the genre list and the caches
+    sp, _ = start_spotify()
+    if not sp:
+        return
+
+    from service import serve
+
+    serve(sp, args.host, args.port, args.workers, args.max_queued)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "list":
+        run_list_mode(args)
+        return
+    if args.command == "import":
+        run_import_mode(args)
+        return
+    if args.command == "export":
+        run_export_mode(args)
+        return
+    if args.command == "validate":
+        if not run_validate_mode(args):
+            raise SystemExit(1)
+        return
+
+    logging.info("Application started.")
+    print_configuration()  # Output the configuration at startup
+
+    if args.command == "batch":
+        run_batch_mode(args)
+    elif args.command == "resume":
+        run_resume_mode(args)
+    elif args.command == "serve":
+        run_serve_mode(args)
+    elif args.command == "ingest":
+        if not run_ingest_mode(args):
+            raise SystemExit(1)
+    else:
+        run_interactive()
+
+    log_run_summary()
+    export_reports(METRICS_JSON_PATH, METRICS_PROMETHEUS_PATH)
+
+def run_interactive():
     use_existing_config = input("Do you want to use an existing configuration? (y/n): ").lower() == 'y'
+    config_name = None
 
     if use_existing_config:
         config_name = select_config_file()
@@ -43,12 +239,6 @@ def main():
     else:
         config = get_user_input()
 
-    book_title = config['book_title']
-    user_input = config['user_input']
-    music_preferences = config['music_preferences']
-    vocal_preference = config['vocal_preference']
-    min_instrumentalness = config['min_instrumentalness']
-    
     if (not use_existing_config):
         do_save_config = input("Do you want to save this configuration for future use? (y/n): ").lower() == 'y'
         # Save the configuration if it's new
@@ -56,44 +246,25 @@ def main():
             config_name = input("Enter a name for this configuration: ")
             save_config(config, config_name)
 
-    chapter_info = extract_chapter_info(book_title, user_input)
-    
-    if not chapter_info:
-        logging.error("Failed to extract chapter information. Exiting.")
+    journal = RunJournal.open(config)
+    if journal and not journal.finished:
+        resume = input(f"An unfinished run of this book was found ({len(journal.playlists)} of {len(journal.chapters)} playlists created). Resume it? (y/n): ").lower() == 'y'
+        if not resume:
+            journal = None
+    if not journal or journal.finished:
+        journal = RunJournal.start(config)
+
+    # Spotify is only authorized once there is a configuration to run
+    sp, available_genres = start_spotify()
+    if not sp:
         return
 
-    # Get available genres
-    available_genres = get_available_genre_seeds(sp)
-
-    for chapter in chapter_info['chapters']:
-        logging.info(f"Processing chapter {chapter['number']}.")
-        parameters = generate_spotify_parameters(book_title, chapter['summary'], music_preferences, available_genres)
-        
-        if parameters:
-            # Convert min_instrumentalness to float if provided
-            min_instrumentalness_value = float(min_instrumentalness) if min_instrumentalness else None
-            tracks = get_spotify_recommendations(sp, parameters, vocal_preference, min_instrumentalness_value)
-            
-            # Log the number of tracks collected and some sample tracks
-            if tracks:
-                logging.info(f"Collected {len(tracks)} tracks for Chapter {chapter['number']}.")
-                sample_tracks = [track['name'] for track in tracks[:5]]  # Get sample of first 5 track names
-                logging.info(f"Sample tracks: {', '.join(sample_tracks)}")
-            else:
-                logging.warning(f"No tracks found for Chapter {chapter['number']}.")
-
-            # Add vocal_preference and min_instrumentalness to parameters
-            parameters['vocal_preference'] = vocal_preference
-            if min_instrumentalness_value is not None:
-                parameters['min_instrumentalness'] = min_instrumentalness_value
-
-            playlist_url = create_playlist_with_description(sp, book_title, chapter['number'], tracks, parameters)
-            if playlist_url:
-                logging.info(f"Playlist for Chapter {chapter['number']} created: {playlist_url}")
-            else:
-                logging.error(f"Failed to create playlist for Chapter {chapter['number']}")
-        else:
-            logging.error(f"Failed to generate parameters for Chapter {chapter['number']}")
+    from batch import job_status
+    from pipeline import generate_book_playlists
+
+    playlist_urls = generate_book_playlists(sp, config, available_genres, journal)
+    if config_name:
+        get_config_store().record_run(config_name, len(playlist_urls), job_status(playlist_urls))
 
 if __name__ == "__main__":
     main()
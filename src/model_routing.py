@@ -0,0 +1,139 @@
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+
+from config import MODEL_ROUTING_LARGE_PROMPT_TOKENS, OPENAI_FAST_MODEL, OPENAI_MODEL, OPENAI_STRONG_MODEL
+from instrumentation import increment, record_llm_usage
+
+# Model tiers from cheapest to strongest. A tier whose model is the same as the one below it is
+# skipped when escalating.
+TIERS = ("fast", "standard", "strong")
+TIER_MODELS = {"fast": OPENAI_FAST_MODEL, "standard": OPENAI_MODEL, "strong": OPENAI_STRONG_MODEL}
+
+# Starting tier of each LLM operation. Whole-book chapter extraction needs the model's knowledge of
+# the book; the per-chapter parameter objects are small, high-volume and checked locally.
+TASK_TIERS = {
+    "extract_chapter_info": "standard",
+    "extract_chapter_info_continuation": "standard",
+    "stream_chapter_info": "standard",
+    "generate_spotify_parameters": "fast",
+    "generate_spotify_parameters_batch": "fast",
+    "fix_parameter_fields": "fast",
+    "summarize_chunk": "fast",
+    "merge_chapter_summaries": "fast",
+}
+
+
+def route(operation, prompt_tokens=0):
+    """
+    Tier for an LLM operation: its starting tier, moved from fast to standard when the prompt
+    is larger than MODEL_ROUTING_LARGE_PROMPT_TOKENS.
+    """
+    tier = TASK_TIERS.get(operation, "standard")
+    if tier == "fast" and MODEL_ROUTING_LARGE_PROMPT_TOKENS and prompt_tokens > MODEL_ROUTING_LARGE_PROMPT_TOKENS:
+        tier = "standard"
+    return tier
+
+
+def escalate(tier):
+    """The next tier up with a different model, or None when there is no stronger model."""
+    for stronger in TIERS[TIERS.index(tier) + 1:]:
+        if TIER_MODELS[stronger] != TIER_MODELS[tier]:
+            return stronger
+    return None
+
+
+def model_for(tier):
+    return TIER_MODELS[tier]
+
+
+def routing_for(*operations):
+    """
+    The routing settings that decide which models run the given operations: the models each one
+    starts on and escalates through, and the prompt size that moves a fast operation up a tier.
+    """
+    chains = {}
+    for operation in operations:
+        tier, chain = TASK_TIERS.get(operation, "standard"), []
+        while tier:
+            chain.append(model_for(tier))
+            tier = escalate(tier)
+        chains[operation] = chain
+    return {"models": chains, "large_prompt_tokens": MODEL_ROUTING_LARGE_PROMPT_TOKENS}
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making an LLM request once a token or cost budget is used up."""
+
+
+class LLMBudget:
+    """
+    Token and cost limit for the LLM requests made within a run or a batch of runs.
+
+    A limit of 0 means unlimited. Usage is charged from the counts reported for each request,
+    so a request that is already in flight can take the total past its limit; later requests are refused.
+    """
+
+    def __init__(self, name, max_tokens=0, max_cost=0.0):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.tokens = 0
+        self.cost = 0.0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def check(self, prompt_tokens=0):
+        with self._lock:
+            if self.max_tokens and self.tokens + prompt_tokens > self.max_tokens:
+                problem = f"{self.tokens} of {self.max_tokens} tokens used"
+            elif self.max_cost and self.cost >= self.max_cost:
+                problem = f"${self.cost:.4f} of ${self.max_cost:.4f} spent"
+            else:
+                return
+        increment("llm_budget_exceeded_total", budget=self.name)
+        raise BudgetExceeded(f"LLM {self.name} budget exhausted ({problem}).")
+
+    def charge(self, tokens, cost=0.0):
+        with self._lock:
+            self.tokens += tokens
+            self.cost += cost
+            self.requests += 1
+
+    def summary(self):
+        with self._lock:
+            return {"tokens": self.tokens, "cost": self.cost, "requests": self.requests,
+                    "max_tokens": self.max_tokens, "max_cost": self.max_cost}
+
+
+# Budgets that apply to the current context, outermost first. Worker threads get them through
+# contextvars.copy_context(), as the pipeline submits its work.
+_budgets = contextvars.ContextVar("llm_budgets", default=())
+
+
+@contextmanager
+def llm_budget(name, max_tokens=0, max_cost=0.0):
+    """Apply a budget to the LLM requests made inside the block, in addition to any enclosing budgets."""
+    budget = LLMBudget(name, max_tokens, max_cost)
+    token = _budgets.set(_budgets.get() + (budget,))
+    try:
+        yield budget
+    finally:
+        _budgets.reset(token)
+        usage = budget.summary()
+        logging.info(f"LLM usage for this {name}: {usage['requests']} requests, {usage['tokens']} tokens, ${usage['cost']:.4f}.")
+
+
+def check_budgets(prompt_tokens=0):
+    """Raise BudgetExceeded if a request with this many prompt tokens would go over an active budget."""
+    for budget in _budgets.get():
+        budget.check(prompt_tokens)
+
+
+def record_usage(operation, model, prompt_tokens, completion_tokens, cost=0.0):
+    """Record a request's token usage in the run metrics and charge it to the active budgets."""
+    record_llm_usage(operation, prompt_tokens, completion_tokens, cost)
+    increment("llm_requests_total", operation=operation, model=model)
+    for budget in _budgets.get():
+        budget.charge(prompt_tokens + completion_tokens, cost)
@@ -0,0 +1,475 @@
+import contextvars
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from config import DEDUP_SPARE_TRACKS, LLM_CONCURRENCY, LLM_RUN_COST_BUDGET, LLM_RUN_TOKEN_BUDGET, SINGLE_BOOK_PLAYLIST, SMOOTH_TRACK_ORDER, SPOTIFY_CONCURRENCY, PARAMETER_BATCH_SIZE, STREAM_CHAPTER_EXTRACTION
+from book_ingestion import ingest_book
+from checkpoint import chapter_input_hash, parameter_routing
+from langchain_utils import extract_chapter_info, generate_spotify_parameters, generate_spotify_parameters_batch, parameter_batch_size, stream_chapter_info
+from model_routing import llm_budget
+from sequencing import deduplicate_tracks, order_smoothly, track_key
+from spotify_utils import MAX_RECOMMENDATIONS, BookPlaylist, create_playlist_with_description, get_audio_features, get_spotify_recommendations, resolve_seeds, save_track_index, spotify_retry_decorator, update_playlist_with_description
+
+# Per-thread output buffer; set while a worker is processing a chapter
+_output = threading.local()
+
+
+class _BufferedStdout:
+    """Stand-in for sys.stdout that holds a worker's prints until its chapter is flushed."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_output, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(('print', text))
+        return len(text)
+
+    def flush(self):
+        if getattr(_output, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class _BufferedLogFilter(logging.Filter):
+    """Diverts log records emitted by a chapter worker into that worker's buffer."""
+
+    def filter(self, record):
+        buffer = getattr(_output, 'buffer', None)
+        if buffer is None:
+            return True
+        buffer.append(('log', record))
+        return False
+
+
+# The stdout proxy and log filter are shared by every active ordered_output() block
+_install_lock = threading.Lock()
+_installed = {"count": 0, "stdout": None, "filter": None}
+
+
+@contextmanager
+def ordered_output():
+    """Buffer worker prints and log records so they can be replayed in chapter order."""
+    root_logger = logging.getLogger()
+    with _install_lock:
+        if _installed["count"] == 0:
+            _installed["stdout"] = _BufferedStdout(sys.stdout)
+            _installed["filter"] = _BufferedLogFilter()
+            sys.stdout = _installed["stdout"]
+            root_logger.addFilter(_installed["filter"])
+        _installed["count"] += 1
+        stdout = _installed["stdout"]
+    try:
+        yield stdout
+    finally:
+        with _install_lock:
+            _installed["count"] -= 1
+            if _installed["count"] == 0:
+                root_logger.removeFilter(_installed["filter"])
+                sys.stdout = _installed["stdout"].stream
+
+
+def _run_buffered(func, *args):
+    _output.buffer = []
+    try:
+        try:
+            result = func(*args)
+        except Exception as e:
+            logging.error(f"Unhandled error in pipeline worker: {e}")
+            result = None
+        return result, _output.buffer
+    finally:
+        _output.buffer = None
+
+
+def _replay(stdout, buffer):
+    root_logger = logging.getLogger()
+    for kind, item in buffer:
+        if kind == 'print':
+            stdout.stream.write(item)
+        else:
+            root_logger.handle(item)
+    stdout.stream.flush()
+
+
+@spotify_retry_decorator()
+def recommend_chapter_tracks(sp, chapter, parameters, vocal_preference, min_instrumentalness_value, used_tracks=None):
+    """
+    Recommended tracks for a chapter, with spare candidates; returns (playlist parameters, tracks).
+
+    Tracks whose keys are in `used_tracks` (used by earlier chapters of the book) are left out.
+    """
+    if not parameters:
+        return None, []
+    # Work on a copy so a rate-limited retry starts again from the same parameters
+    parameters = dict(parameters)
+    tracks = get_spotify_recommendations(sp, parameters, vocal_preference, min_instrumentalness_value,
+                                         seeds_resolved=True, spare=DEDUP_SPARE_TRACKS, exclude=used_tracks)
+
+    # Add vocal_preference and min_instrumentalness to parameters
+    parameters['vocal_preference'] = vocal_preference
+    if min_instrumentalness_value is not None:
+        parameters['min_instrumentalness'] = min_instrumentalness_value
+    return parameters, tracks
+
+
+def fetch_more_tracks(sp, chapter, parameters, seen_tracks):
+    """A full-size batch of recommendations for a chapter, leaving out every track in `seen_tracks`."""
+    try:
+        return get_spotify_recommendations(sp, dict(parameters), parameters.get('vocal_preference', 'b'),
+                                           parameters.get('min_instrumentalness'), seeds_resolved=True,
+                                           spare=MAX_RECOMMENDATIONS - parameters['limit'], exclude=frozenset(seen_tracks))
+    except Exception as e:
+        logging.warning(f"Could not fetch more tracks for Chapter {chapter['number']}: {e}")
+        return []
+
+
+def curate_tracks(sp, chapter, parameters, tracks, seen_tracks):
+    """
+    Drop tracks already used by earlier chapters, backfilling from spare candidates, and order the rest smoothly.
+
+    When removing duplicates leaves fewer than `limit` tracks, the places left are filled from a
+    new recommendations request that excludes every used track.
+    """
+    if not parameters:
+        return []
+    chosen = deduplicate_tracks(tracks, seen_tracks, parameters['limit'])
+    if len(chosen) < parameters['limit'] and len(chosen) < len(tracks):
+        missing = parameters['limit'] - len(chosen)
+        logging.info(f"Chapter {chapter['number']}: {missing} places left after removing duplicates; fetching more tracks.")
+        chosen.extend(deduplicate_tracks(fetch_more_tracks(sp, chapter, parameters, seen_tracks), seen_tracks, missing))
+    if SMOOTH_TRACK_ORDER and chosen:
+        try:
+            chosen = order_smoothly(chosen, get_audio_features(sp, [track['id'] for track in chosen]))
+        except Exception as e:
+            logging.warning(f"Could not order tracks for Chapter {chapter['number']}: {e}")
+
+    # Log the number of tracks collected and some sample tracks
+    if chosen:
+        logging.info(f"Collected {len(chosen)} tracks for Chapter {chapter['number']}.")
+        sample_tracks = [track['name'] for track in chosen[:5]]  # Get sample of first 5 track names
+        logging.info(f"Sample tracks: {', '.join(sample_tracks)}")
+    else:
+        logging.error(f"No tracks found for Chapter {chapter['number']}; it gets no playlist.")
+    return chosen
+
+
+def generate_chapter_parameters(book_title, chapter, music_preferences, available_genres):
+    logging.info(f"Processing chapter {chapter['number']}.")
+    try:
+        parameters = generate_spotify_parameters(book_title, chapter['summary'], music_preferences, available_genres)
+    except Exception as e:
+        logging.error(f"Error generating parameters for Chapter {chapter['number']}: {e}")
+        parameters = None
+
+    if not parameters:
+        logging.error(f"Failed to generate parameters for Chapter {chapter['number']}")
+    return parameters
+
+
+def generate_batch_parameters(book_title, chapters, music_preferences, available_genres):
+    logging.info(f"Processing chapters {chapters[0]['number']}-{chapters[-1]['number']}.")
+    try:
+        parameters_list = generate_spotify_parameters_batch(book_title, chapters, music_preferences, available_genres)
+    except Exception as e:
+        logging.error(f"Error generating parameters for Chapters {chapters[0]['number']}-{chapters[-1]['number']}: {e}")
+        parameters_list = [None] * len(chapters)
+
+    for chapter, parameters in zip(chapters, parameters_list):
+        if not parameters:
+            logging.error(f"Failed to generate parameters for Chapter {chapter['number']}")
+    return parameters_list
+
+
+def generate_parameters(book_title, chapters, music_preferences, available_genres,
+                        llm_concurrency=LLM_CONCURRENCY, max_batch_size=PARAMETER_BATCH_SIZE):
+    """Generate parameters for all chapters, batching chapters into shared requests when max_batch_size > 1."""
+    if max_batch_size <= 1:
+        return run_ordered(
+            generate_chapter_parameters,
+            [(book_title, chapter, music_preferences, available_genres) for chapter in chapters],
+            llm_concurrency
+        )
+
+    batch_size = parameter_batch_size(chapters, book_title + music_preferences + ", ".join(available_genres), max_batch_size)
+    batches = [chapters[i:i + batch_size] for i in range(0, len(chapters), batch_size)]
+    batch_results = run_ordered(
+        generate_batch_parameters,
+        [(book_title, batch, music_preferences, available_genres) for batch in batches],
+        llm_concurrency
+    )
+    return [
+        parameters
+        for batch, batch_parameters in zip(batches, batch_results)
+        for parameters in (batch_parameters or [None] * len(batch))
+    ]
+
+
+def create_chapter_playlist(sp, book_title, chapter, parameters, tracks, journal=None, input_hash=None,
+                            existing_url=None):
+    """Create the chapter's playlist, or with `existing_url` replace the contents of that playlist from an earlier run."""
+    if not parameters:
+        return None
+
+    if existing_url:
+        playlist_url = update_playlist_with_description(sp, existing_url, book_title, chapter['number'], tracks, parameters)
+    else:
+        playlist_url = create_playlist_with_description(sp, book_title, chapter['number'], tracks, parameters)
+    if playlist_url:
+        logging.info(f"Playlist for Chapter {chapter['number']} {'updated' if existing_url else 'created'}: {playlist_url}")
+        if journal:
+            journal.record_playlist(chapter['number'], playlist_url, [track_key(track) for track in tracks], input_hash)
+    else:
+        logging.error(f"Failed to {'update' if existing_url else 'create'} playlist for Chapter {chapter['number']}")
+    return playlist_url
+
+
+def add_chapter_to_book_playlist(book_playlist, chapter, parameters, tracks, journal=None, input_hash=None):
+    if not parameters:
+        return None
+
+    try:
+        playlist_url = book_playlist.add_chapter(chapter['number'], tracks)
+    except Exception as e:
+        logging.error(f"Failed to add Chapter {chapter['number']} to the book playlist: {e}")
+        return None
+    if playlist_url:
+        logging.info(f"Chapter {chapter['number']} added to the book playlist: {playlist_url}")
+        if journal:
+            journal.record_playlist(chapter['number'], playlist_url, [track_key(track) for track in tracks], input_hash)
+    return playlist_url
+
+
+def run_ordered(func, argument_lists, max_workers):
+    """Run func over argument_lists concurrently, replaying each call's output and returning results in order."""
+    results = []
+    with ordered_output() as stdout, ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Each call runs in a copy of the caller's context, so the run's LLM budget applies in the workers
+        futures = [executor.submit(contextvars.copy_context().run, _run_buffered, func, *arguments)
+                   for arguments in argument_lists]
+        for future in futures:
+            result, buffer = future.result()
+            _replay(stdout, buffer)
+            results.append(result)
+    return results
+
+
+def process_chapters(sp, book_title, chapters, music_preferences, available_genres, vocal_preference,
+                     min_instrumentalness, llm_concurrency=LLM_CONCURRENCY, spotify_concurrency=SPOTIFY_CONCURRENCY,
+                     journal=None, seen_tracks=None, book_playlist=None):
+    """
+    Generate parameters and playlists for all chapters, returning playlist URLs in chapter order.
+
+    Parameter generation runs with up to `llm_concurrency` requests in flight, each covering up to
+    PARAMETER_BATCH_SIZE chapters. Seed names from all
+    chapters are then resolved together, so each unique name is searched once, and the Spotify stage
+    runs with up to `spotify_concurrency` chapters in flight. Output is printed in chapter order.
+
+    Between fetching recommendations and creating playlists, chapters are curated one at a time
+    in chapter order: tracks already in `seen_tracks` (the keys of tracks used by earlier
+    chapters of the book) are replaced by spare candidates and each playlist is ordered smoothly.
+
+    With a `book_playlist`, tracks are appended to that single playlist one chapter at a time
+    instead of creating a playlist per chapter.
+
+    With a `journal`, each step is checkpointed as it completes and work already recorded there
+    (parameters, resolved seeds, playlists) is reused instead of repeated. Chapters whose input
+    hash matches the journal's baseline keep their playlist from the earlier run; other chapters
+    with a baseline playlist have that playlist updated in place rather than a new one created.
+    """
+    # Convert min_instrumentalness to float if provided
+    min_instrumentalness_value = float(min_instrumentalness) if min_instrumentalness else None
+    if seen_tracks is None:
+        seen_tracks = set()
+
+    done = journal.playlists if journal else {}
+    stored = journal.parameters if journal else {}
+    routing = parameter_routing()
+    input_hashes = {chapter['number']: chapter_input_hash(chapter, music_preferences, vocal_preference, min_instrumentalness,
+                                                          routing)
+                    for chapter in chapters}
+    # A single book playlist is rebuilt as a whole, so there are no chapter playlists to reuse
+    baseline = journal.baseline if journal and not book_playlist else {}
+
+    unchanged = [chapter for chapter in chapters if chapter['number'] not in done
+                 and baseline.get(chapter['number'], {}).get("input_hash") == input_hashes[chapter['number']]]
+    for chapter in unchanged:
+        previous = baseline[chapter['number']]
+        journal.record_playlist(chapter['number'], previous["playlist_url"], previous["track_keys"], previous["input_hash"])
+    if unchanged:
+        logging.info(f"Keeping the playlists of {len(unchanged)} unchanged chapters from the previous run.")
+
+    pending = [chapter for chapter in chapters if chapter['number'] not in done]
+    if len(pending) + len(unchanged) < len(chapters):
+        logging.info(f"Skipping {len(chapters) - len(pending) - len(unchanged)} chapters with playlists from the checkpoint.")
+    for chapter in pending:
+        # The tracks a regenerated chapter used before are free for its new playlist
+        seen_tracks.difference_update(baseline.get(chapter['number'], {}).get("track_keys", []))
+
+    parameters_by_number = {chapter['number']: stored.get(chapter['number']) for chapter in pending}
+    missing = [chapter for chapter in pending if parameters_by_number[chapter['number']] is None]
+    if missing:
+        generated = generate_parameters(book_title, missing, music_preferences, available_genres, llm_concurrency)
+        for chapter, parameters in zip(missing, generated):
+            parameters_by_number[chapter['number']] = parameters
+            if journal and parameters:
+                journal.record_parameters(chapter['number'], parameters)
+
+    unresolved = [number for number, parameters in parameters_by_number.items()
+                  if parameters and not (journal and number in journal.resolved)]
+    resolve_seeds(sp, [parameters_by_number[number] for number in unresolved])
+    if journal:
+        for number in unresolved:
+            journal.record_seeds(number, parameters_by_number[number])
+
+    # Chapters of this wave are recommended concurrently, so they only exclude the tracks of earlier waves;
+    # duplicates between them are replaced when they are curated
+    used_tracks = frozenset(seen_tracks)
+    recommended = run_ordered(
+        recommend_chapter_tracks,
+        [(sp, chapter, parameters_by_number[chapter['number']], vocal_preference, min_instrumentalness_value, used_tracks)
+         for chapter in pending],
+        spotify_concurrency
+    )
+
+    curated = run_ordered(
+        curate_tracks,
+        [(sp, chapter, parameters, tracks, seen_tracks)
+         for chapter, (parameters, tracks) in zip(pending, [result or (None, []) for result in recommended])],
+        1
+    )
+
+    if book_playlist:
+        # Sections must follow chapter order, so chapters are appended one at a time
+        created = run_ordered(
+            add_chapter_to_book_playlist,
+            [(book_playlist, chapter, (result or (None, []))[0], tracks, journal, input_hashes[chapter['number']])
+             for chapter, result, tracks in zip(pending, recommended, curated)],
+            1
+        )
+    else:
+        created = run_ordered(
+            create_chapter_playlist,
+            [(sp, book_title, chapter, (result or (None, []))[0], tracks, journal, input_hashes[chapter['number']],
+              baseline.get(chapter['number'], {}).get("playlist_url"))
+             for chapter, result, tracks in zip(pending, recommended, curated)],
+            spotify_concurrency
+        )
+    created_by_number = {chapter['number']: url for chapter, url in zip(pending, created)}
+    return [done.get(chapter['number']) or created_by_number.get(chapter['number']) for chapter in chapters]
+
+
+def process_chapter_stream(sp, book_title, chapters, music_preferences, available_genres, vocal_preference,
+                           min_instrumentalness, wave_size=PARAMETER_BATCH_SIZE, journal=None, seen_tracks=None,
+                           book_playlist=None):
+    """
+    Process chapters from an iterator (such as stream_chapter_info) in waves of `wave_size`.
+
+    Each wave goes through process_chapters as soon as its chapters have arrived, while later
+    chapters are still being received. Waves run one after another, so output stays in chapter order
+    and every wave shares the book's `seen_tracks`.
+    """
+    wave_size = max(1, wave_size)
+    if seen_tracks is None:
+        seen_tracks = set()
+    waves = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        wave = []
+        for chapter in chapters:
+            wave.append(chapter)
+            if len(wave) >= wave_size:
+                waves.append(executor.submit(contextvars.copy_context().run, process_chapters, sp, book_title, wave,
+                                             music_preferences, available_genres, vocal_preference, min_instrumentalness,
+                                             journal=journal, seen_tracks=seen_tracks,
+                                             book_playlist=book_playlist))
+                wave = []
+        if wave:
+            waves.append(executor.submit(contextvars.copy_context().run, process_chapters, sp, book_title, wave,
+                                         music_preferences, available_genres, vocal_preference, min_instrumentalness,
+                                         journal=journal, seen_tracks=seen_tracks,
+                                         book_playlist=book_playlist))
+        return [playlist_url for future in waves for playlist_url in future.result()]
+
+
+def generate_book_playlists(sp, config, available_genres, journal=None):
+    """
+    Extract the chapters of a configured book and create their playlists, returning the playlist URLs.
+
+    Chapters come from the configuration's `book_file` when it has one, otherwise from the LLM.
+    Progress is checkpointed to `journal` when one is given. A journal that already holds the full
+    chapter list (a resumed run) skips chapter extraction. The run's LLM requests share one
+    budget of LLM_RUN_TOKEN_BUDGET tokens and LLM_RUN_COST_BUDGET dollars; chapters whose
+    requests are refused by it get no playlist.
+    """
+    with llm_budget("run", LLM_RUN_TOKEN_BUDGET, LLM_RUN_COST_BUDGET):
+        return _generate_book_playlists(sp, config, available_genres, journal)
+
+
+def _generate_book_playlists(sp, config, available_genres, journal):
+    book_title = config['book_title']
+    user_input = config['user_input']
+    music_preferences = config['music_preferences']
+    vocal_preference = config['vocal_preference']
+    min_instrumentalness = config['min_instrumentalness']
+
+    # Keys of the tracks used so far, shared by every chapter so no track appears twice in the book.
+    # Tracks of the baseline playlists count as used until their chapter is regenerated.
+    seen_tracks = set(journal.track_keys()) if journal else set()
+    if journal and not SINGLE_BOOK_PLAYLIST:
+        for number, previous in journal.baseline.items():
+            if number not in journal.playlists:
+                seen_tracks.update(previous["track_keys"])
+
+    book_playlist = None
+    if SINGLE_BOOK_PLAYLIST:
+        # A resumed run keeps appending to the playlist recorded in the journal
+        recorded = sorted(journal.playlists) if journal else []
+        book_playlist = BookPlaylist(sp, book_title, journal.playlists[recorded[0]] if recorded else None,
+                                     [(number, len(journal.playlist_tracks[number])) for number in recorded])
+
+    if journal and journal.chapters_complete:
+        logging.info(f"Resuming with {len(journal.chapters)} chapters from the checkpoint.")
+        playlist_urls = process_chapters(sp, book_title, journal.chapter_list(), music_preferences, available_genres,
+                                         vocal_preference, min_instrumentalness, journal=journal, seen_tracks=seen_tracks,
+                                         book_playlist=book_playlist)
+    elif STREAM_CHAPTER_EXTRACTION and not config.get('book_file'):
+        # Chapters are handed to the pipeline as soon as they are streamed in
+        chapters = stream_chapter_info(book_title, user_input)
+        if journal:
+            chapters = journal.track_chapters(chapters)
+        playlist_urls = process_chapter_stream(sp, book_title, chapters, music_preferences, available_genres,
+                                               vocal_preference, min_instrumentalness, journal=journal, seen_tracks=seen_tracks,
+                                               book_playlist=book_playlist)
+        if not playlist_urls:
+            logging.error("Failed to extract chapter information.")
+    else:
+        if config.get('book_file'):
+            # Summarized from the book's own text rather than the model's knowledge of it
+            chapter_info = ingest_book(config['book_file'], book_title)
+        else:
+            chapter_info = extract_chapter_info(book_title, user_input)
+
+        if not chapter_info:
+            logging.error("Failed to extract chapter information.")
+            return []
+
+        chapters = chapter_info['chapters']
+        if journal:
+            chapters = list(journal.track_chapters(chapters))
+        playlist_urls = process_chapters(sp, book_title, chapters, music_preferences, available_genres,
+                                         vocal_preference, min_instrumentalness, journal=journal, seen_tracks=seen_tracks,
+                                         book_playlist=book_playlist)
+
+    save_track_index()
+    if book_playlist:
+        book_playlist.finish()
+    if journal and playlist_urls and all(playlist_urls):
+        journal.record_finished()
+    return playlist_urls
@@ -1,48 +1,279 @@
 import os
 import json
-from typing import Dict, List
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import CONFIG_DB_PATH
 
 CONFIG_DIR = "configs"
+REQUIRED_KEYS = ["book_title", "user_input", "music_preferences", "vocal_preference", "min_instrumentalness"]
+# Saved configurations shown per page when choosing one interactively
+SELECT_PAGE_SIZE = 20
+
+class ConfigStore:
+    """
+    Saved configurations in an indexed SQLite table.
+
+    Configurations are looked up by name or book title (case-insensitive) and searched by
+    prefix of either, a page at a time. Each row also records when the configuration was last
+    run, its chapter count and the status of that run. JSON files can be imported and exported.
+    Instances are safe to share between threads.
+    """
+
+    def __init__(self, path: str = CONFIG_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        created = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS configs ("
+            "name TEXT PRIMARY KEY, name_key TEXT NOT NULL, book_title TEXT, title_key TEXT, config TEXT NOT NULL, "
+            "created REAL NOT NULL, updated REAL NOT NULL, last_run REAL, chapter_count INTEGER, last_status TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS configs_name_key ON configs (name_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS configs_title_key ON configs (title_key)")
+        self._conn.commit()
+        if created and os.path.isdir(CONFIG_DIR):
+            # Configurations saved as JSON files before the store existed
+            imported = self.import_json([CONFIG_DIR])
+            if imported:
+                print(f"Imported {imported} configuration files from {CONFIG_DIR}/ into {path}")
+
+    @staticmethod
+    def _summary(row) -> Dict:
+        return {key: row[key] for key in ("name", "book_title", "updated", "last_run", "chapter_count", "last_status")}
+
+    def save(self, name: str, config: Dict) -> None:
+        """Add or replace a configuration; run metadata of an existing one is kept."""
+        self.save_many({name: config})
+
+    def save_many(self, configs: Dict[str, Dict]) -> None:
+        """Add or replace several configurations in one transaction."""
+        now = time.time()
+        rows = []
+        for name, config in configs.items():
+            title = config.get('book_title') if isinstance(config, dict) else None
+            rows.append((name, name.lower(), title, str(title or "").lower(), json.dumps(config), now, now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO configs (name, name_key, book_title, title_key, config, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET "
+                "book_title = excluded.book_title, title_key = excluded.title_key, "
+                "config = excluded.config, updated = excluded.updated",
+                rows,
+            )
+            self._conn.commit()
+
+    def get(self, name: str) -> Optional[Dict]:
+        """The configuration saved under `name`, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT config FROM configs WHERE name = ?", (name,)).fetchone()
+        return json.loads(row["config"]) if row else None
+
+    def find(self, name_or_title: str) -> Optional[Tuple[str, Dict]]:
+        """(name, configuration) by exact name, else by case-insensitive name or book title; None if nothing matches."""
+        key = name_or_title.lower()
+        with self._lock:
+            row = self._conn.execute("SELECT name, config FROM configs WHERE name = ?", (name_or_title,)).fetchone()
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT name, config FROM configs WHERE name_key = ? OR title_key = ? ORDER BY updated DESC LIMIT 1",
+                    (key, key),
+                ).fetchone()
+        return (row["name"], json.loads(row["config"])) if row else None
+
+    def _prefix_clause(self, prefix: str) -> Tuple[str, tuple]:
+        if not prefix:
+            return "", ()
+        # Range conditions rather than LIKE, so the lookups use the indexes
+        low = prefix.lower()
+        high = low + "\uffff"
+        return ("WHERE (name_key >= ? AND name_key < ?) OR (title_key >= ? AND title_key < ?)",
+                (low, high, low, high))
+
+    def search(self, prefix: str = "", limit: int = SELECT_PAGE_SIZE, offset: int = 0) -> List[Dict]:
+        """Summaries of the configurations whose name or book title starts with `prefix`, ordered by name."""
+        where, arguments = self._prefix_clause(prefix)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT name, book_title, updated, last_run, chapter_count, last_status FROM configs {where} "
+                "ORDER BY name LIMIT ? OFFSET ?",
+                arguments + (limit, offset),
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def count(self, prefix: str = "") -> int:
+        where, arguments = self._prefix_clause(prefix)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM configs {where}", arguments).fetchone()[0]
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return [row["name"] for row in self._conn.execute("SELECT name FROM configs ORDER BY name")]
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM configs WHERE name = ?", (name,)).rowcount
+            self._conn.commit()
+        return bool(deleted)
+
+    def record_run(self, name: str, chapter_count: int, status: str) -> None:
+        """Note that the configuration was just run, with its chapter count and outcome."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE configs SET last_run = ?, chapter_count = ?, last_status = ? WHERE name = ?",
+                (time.time(), chapter_count, status, name),
+            )
+            self._conn.commit()
+
+    def import_json(self, targets: List[str]) -> int:
+        """Import JSON configuration files and directories of them, named after the files. Returns the count imported."""
+        configs = {}
+        for target in targets:
+            paths = ([os.path.join(target, f) for f in sorted(os.listdir(target)) if f.endswith('.json')]
+                     if os.path.isdir(target) else [target])
+            for path in paths:
+                try:
+                    configs[os.path.splitext(os.path.basename(path))[0]] = load_config_file(path)
+                except (OSError, json.JSONDecodeError) as e:
+                    print(f"Skipping {path}: {e}")
+        self.save_many(configs)
+        return len(configs)
+
+    def export_json(self, directory: str, prefix: str = "") -> int:
+        """Write each configuration matching `prefix` to `directory` as <name>.json. Returns the count written."""
+        os.makedirs(directory, exist_ok=True)
+        where, arguments = self._prefix_clause(prefix)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT name, config FROM configs {where} ORDER BY name", arguments).fetchall()
+        for row in rows:
+            with open(os.path.join(directory, f"{row['name']}.json"), 'w') as f:
+                json.dump(json.loads(row["config"]), f, indent=2)
+        return len(rows)
+
+_config_store = None
+_config_store_lock = threading.Lock()
+
+def get_config_store() -> ConfigStore:
+    """Process-wide configuration store, opened on first use."""
+    global _config_store
+    with _config_store_lock:
+        if _config_store is None:
+            _config_store = ConfigStore()
+        return _config_store
 
 def save_config(config: Dict, filename: str) -> None:
-    """Save configuration to a JSON file."""
-    if not os.path.exists(CONFIG_DIR):
-        os.makedirs(CONFIG_DIR)
-    
-    filepath = os.path.join(CONFIG_DIR, f"{filename}.json")
-    with open(filepath, 'w') as f:
-        json.dump(config, f, indent=2)
-    print(f"Configuration saved to {filepath}")
+    """Save a configuration under a name."""
+    get_config_store().save(filename, config)
+    print(f"Configuration saved as '{filename}'")
 
 def load_config(filename: str) -> Dict:
-    """Load configuration from a JSON file."""
-    filepath = os.path.join(CONFIG_DIR, f"{filename}.json")
+    """Load a saved configuration by name."""
+    config = get_config_store().get(filename)
+    if config is None:
+        raise FileNotFoundError(f"No saved configuration named '{filename}'")
+    return config
+
+def load_config_file(filepath: str) -> Dict:
+    """Load configuration from a JSON file path."""
     with open(filepath, 'r') as f:
         return json.load(f)
 
+def validate_config(config: Dict) -> List[str]:
+    """Return a list of problems with a configuration (empty if it is usable)."""
+    if not isinstance(config, dict):
+        return ["Configuration must be a JSON object."]
+    problems = [f"Missing key: {key}" for key in REQUIRED_KEYS if key not in config]
+    if config.get('vocal_preference') not in (None, 'v', 'i', 'b'):
+        problems.append("vocal_preference must be 'v', 'i' or 'b'.")
+    min_instrumentalness = config.get('min_instrumentalness')
+    if min_instrumentalness:
+        try:
+            if not 0 <= float(min_instrumentalness) <= 1:
+                problems.append("min_instrumentalness must be between 0 and 1.")
+        except (TypeError, ValueError):
+            problems.append("min_instrumentalness must be a number.")
+    book_file = config.get('book_file')
+    if book_file and not os.path.isfile(book_file):
+        problems.append(f"book_file not found: {book_file}")
+    return problems
+
+def resolve_config_sources(targets: List[str]) -> List[str]:
+    """
+    Expand targets into configuration sources: JSON file paths and saved configuration names.
+
+    Directories expand to their JSON files and an empty list to every saved configuration.
+    Other targets are taken as saved configuration names (or book titles).
+    """
+    if not targets:
+        return get_config_store().names()
+    sources = []
+    for target in targets:
+        if os.path.isdir(target):
+            sources.extend(sorted(os.path.join(target, f) for f in os.listdir(target) if f.endswith('.json')))
+        else:
+            sources.append(target)
+    return sources
+
+def load_config_source(source: str) -> Tuple[Dict, Optional[str]]:
+    """
+    Load a configuration from a JSON file path or the store.
+
+    Returns (config, name), where name is the saved configuration name, or None for a file.
+    Raises FileNotFoundError if the source is neither a file nor a saved configuration.
+    """
+    if os.path.isfile(source):
+        return load_config_file(source), None
+    found = get_config_store().find(source)
+    if found is None:
+        raise FileNotFoundError(f"No configuration file or saved configuration named '{source}'")
+    name, config = found
+    return config, name
+
 def list_config_files() -> List[str]:
-    """List available configuration files."""
-    if not os.path.exists(CONFIG_DIR):
-        return []
-    return [f[:-5] for f in os.listdir(CONFIG_DIR) if f.endswith('.json')]
+    """List saved configuration names."""
+    return get_config_store().names()
+
+def format_config_summary(summary: Dict) -> str:
+    """One line describing a saved configuration and its last run."""
+    line = f"{summary['name']} - {summary['book_title']}"
+    if summary['last_run']:
+        last_run = time.strftime("%Y-%m-%d %H:%M", time.localtime(summary['last_run']))
+        line += f" (last run {last_run}: {summary['chapter_count']} chapters, {summary['last_status']})"
+    return line
 
 def select_config_file() -> str:
-    """Prompt user to select a configuration file."""
-    config_files = list_config_files()
-    if not config_files:
-        print("No configuration files found.")
-        return None
-    
-    print("Available configuration files:")
-    for i, filename in enumerate(config_files, 1):
-        print(f"{i}. {filename}")
-    
+    """Prompt user to select a saved configuration, a page at a time, optionally narrowed by a search."""
+    store = get_config_store()
+    prefix, offset = "", 0
     while True:
-        try:
-            choice = int(input("Enter the number of the configuration file to use: "))
-            if 1 <= choice <= len(config_files):
-                return config_files[choice - 1]
-            else:
-                print("Invalid choice. Please try again.")
-        except ValueError:
-            print("Invalid input. Please enter a number.")
+        total = store.count(prefix)
+        if not total:
+            print(f"No configurations found{f' starting with {prefix!r}' if prefix else ''}.")
+            if not prefix:
+                return None
+            prefix, offset = "", 0
+            continue
+        page = store.search(prefix, SELECT_PAGE_SIZE, offset)
+        print(f"Configurations {offset + 1}-{offset + len(page)} of {total}:")
+        for i, summary in enumerate(page, 1):
+            print(f"{i}. {format_config_summary(summary)}")
+
+        choice = input("Enter a number to select, n/p for the next/previous page, or text to search by name or title: ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(page):
+            return page[int(choice) - 1]["name"]
+        elif choice.lower() == "n" and offset + SELECT_PAGE_SIZE < total:
+            offset += SELECT_PAGE_SIZE
+        elif choice.lower() == "p" and offset:
+            offset -= SELECT_PAGE_SIZE
+        elif choice and not choice.isdigit() and choice.lower() not in ("n", "p"):
+            prefix, offset = choice, 0
+        else:
+            print("Invalid choice. Please try again.")
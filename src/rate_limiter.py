@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+from config import SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every caller of an API.
+
+    Tokens refill at `rate` per second up to `capacity`, which allows short bursts. A rate-limit
+    response pauses all callers for the server's Retry-After and halves the rate; successful calls
+    then raise it back toward the configured rate. A `rate` of 0 means no limit: calls only wait out
+    a rate-limit pause. Calls, waits and rate-limit hits are counted per endpoint.
+    """
+
+    def __init__(self, rate, capacity, min_rate=0.5):
+        self.target_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.min_rate = min(float(min_rate), self.target_rate)
+        self.unlimited = self.target_rate <= 0
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _endpoint_stats(self, endpoint):
+        if endpoint not in self._endpoints:
+            self._endpoints[endpoint] = {"calls": 0, "rate_limited": 0, "wait_seconds": 0.0}
+        return self._endpoints[endpoint]
+
+    def acquire(self, endpoint="default"):
+        """Block until a call to `endpoint` may be made. Returns the number of seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                pause = self._paused_until - now
+                if pause <= 0 and (self.unlimited or self._tokens >= 1):
+                    if not self.unlimited:
+                        self._tokens -= 1
+                    stats = self._endpoint_stats(endpoint)
+                    stats["calls"] += 1
+                    stats["wait_seconds"] += waited
+                    return waited
+                wait = pause if pause > 0 else (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, retry_after, endpoint="default"):
+        """Pause every caller for `retry_after` seconds and halve the rate after a rate-limit response."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + retry_after)
+            self._tokens = 0.0
+            self._updated = now
+            if not self.unlimited:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._endpoint_stats(endpoint)["rate_limited"] += 1
+        if self.unlimited:
+            logging.warning(f"Rate limited on {endpoint}. Pausing for {retry_after} seconds.")
+        else:
+            logging.warning(f"Rate limited on {endpoint}. Pausing for {retry_after} seconds; rate lowered to {self.rate:.2f}/s.")
+
+    def record_success(self):
+        """Additively restore the rate toward its configured value after a successful call."""
+        with self._lock:
+            if self.rate < self.target_rate:
+                self.rate = min(self.target_rate, self.rate + self.target_rate / 20)
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._endpoints.items()}
+
+
+# Shared by every Spotify API call in the process
+spotify_rate_limiter = TokenBucket(SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from track_index import TEMPO_SCALE, track_key
+
+
+def deduplicate_tracks(tracks, seen, limit):
+    """
+    Take up to `limit` tracks whose keys are not in `seen`, in order, and add their keys to `seen`.
+
+    Candidates after the first `limit` backfill the places of dropped duplicates.
+    """
+    chosen = []
+    for track in tracks:
+        if len(chosen) == limit:
+            break
+        key = track_key(track)
+        if key in seen:
+            continue
+        seen.add(key)
+        chosen.append(track)
+    return chosen
+
+
+def order_smoothly(tracks, audio_features):
+    """
+    Order tracks so that energy and tempo change gradually from one track to the next.
+
+    Builds a greedy nearest-neighbour path in (energy, tempo / TEMPO_SCALE) space, starting
+    from the calmest track. Each step is one vectorized distance computation, so a playlist of
+    n tracks costs O(n^2) and a book's cost grows linearly with its number of chapters. Tracks
+    without audio features keep their relative order at the end.
+    """
+    known = [track for track in tracks if track['id'] in audio_features]
+    unknown = [track for track in tracks if track['id'] not in audio_features]
+    if len(known) < 3:
+        return known + unknown
+
+    points = np.array([[audio_features[track['id']]['energy'], audio_features[track['id']]['tempo'] / TEMPO_SCALE]
+                       for track in known], dtype=np.float32)
+    visited = np.zeros(len(known), dtype=bool)
+    current = int(np.argmin(points.sum(axis=1)))
+    order = [current]
+    visited[current] = True
+    for _ in range(len(known) - 1):
+        distances = np.sqrt(((points - points[current]) ** 2).sum(axis=1))
+        distances[visited] = np.inf
+        current = int(np.argmin(distances))
+        visited[current] = True
+        order.append(current)
+    return [known[row] for row in order] + unknown
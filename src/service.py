@@ -0,0 +1,254 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import run_config_job
+from checkpoint import run_id_for
+from config import SERVICE_HOST, SERVICE_MAX_QUEUED, SERVICE_PORT, SERVICE_WORKERS
+from instrumentation import metrics
+from playlist_config import get_config_store, validate_config
+from spotify_utils import get_available_genre_seeds, refresh_spotify_token
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1024 * 1024
+# How often the background thread checks whether the Spotify token is about to expire
+TOKEN_CHECK_INTERVAL = 60
+# Finished jobs kept for status queries; the oldest are forgotten first
+MAX_FINISHED_JOBS = 1000
+
+QUEUED, RUNNING = "queued", "running"
+
+
+class ServiceBusy(Exception):
+    """Raised when the job queue is full."""
+
+
+class JobConflict(Exception):
+    """Raised when a job for the same run is already queued or running."""
+
+
+class JobManager:
+    """
+    Runs book jobs on a bounded pool of worker threads and keeps their status.
+
+    Every job shares one Spotify client, the cached genre list, the chat models, the caches and
+    the Spotify rate limiter, so a job only pays for its own remote API calls. At most
+    `max_queued` jobs wait for a worker; further submissions raise ServiceBusy. A second job for
+    a run that is already queued or running raises JobConflict, as both would write the same checkpoint.
+    """
+
+    def __init__(self, sp, workers=SERVICE_WORKERS, max_queued=SERVICE_MAX_QUEUED):
+        self.sp = sp
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+
+    def submit(self, config, resume=False, config_name=None):
+        run_id = run_id_for(config)
+        with self._lock:
+            active = [job for job in self.jobs.values() if job["status"] in (QUEUED, RUNNING)]
+            if sum(job["status"] == QUEUED for job in active) >= self.max_queued:
+                raise ServiceBusy(f"{self.max_queued} jobs are already waiting.")
+            if any(job["run_id"] == run_id for job in active):
+                raise JobConflict(f"A job for run {run_id} is already queued or running.")
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "status": QUEUED,
+                "config": config_name,
+                "book_title": config.get('book_title'),
+                "run_id": run_id,
+                "resume": resume,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+            }
+            self.jobs[job["id"]] = job
+            self._forget_finished()
+            queued = dict(job)
+        self._executor.submit(self._run, job, config)
+        logging.info(f"Queued job {job['id']} for '{job['book_title']}'.")
+        return queued
+
+    def _run(self, job, config):
+        with self._lock:
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+        try:
+            # Served from the genre cache unless it has expired
+            available_genres = get_available_genre_seeds(self.sp)
+            result = run_config_job(self.sp, config, available_genres, job["resume"], source=job["config"],
+                                    config_name=job["config"])
+        except Exception as e:
+            logging.error(f"Job {job['id']} failed: {e}")
+            result = {"status": "failed", "playlist_urls": [], "errors": [str(e)]}
+        with self._lock:
+            job["result"] = result
+            job["status"] = result["status"]
+            job["finished_at"] = time.time()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] not in (QUEUED, RUNNING)]
+        # Jobs are kept in submission order
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._lock:
+            return [dict(job) for job in self.jobs.values()]
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def parse_job_request(body):
+    """
+    Turn a POST /jobs body into (config, resume, config_name); config_name is None for an inline configuration.
+
+    The body is {"config": <saved configuration name or book title, or a configuration object>, "resume": bool}.
+    Raises ValueError describing what is wrong with it.
+    """
+    if not isinstance(body, dict) or "config" not in body:
+        raise ValueError('Expected a JSON object with a "config" field.')
+    config = body["config"]
+    config_name = None
+    if isinstance(config, str):
+        # Looked up in the configuration store only, so requests cannot read files
+        found = get_config_store().find(config)
+        if found is None:
+            raise ValueError(f"No saved configuration named '{config}'.")
+        config_name, config = found
+    elif isinstance(config, dict) and config.get('book_file'):
+        raise ValueError("book_file can only be set in saved configurations.")
+    problems = validate_config(config)
+    if problems:
+        raise ValueError("; ".join(problems))
+    return config, bool(body.get("resume", False)), config_name
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the service:
+
+        POST /jobs        submit a job, returns 202 with the job
+        GET  /jobs        list jobs
+        GET  /jobs/<id>   status and, once finished, the result of a job
+        GET  /health      liveness and job counts
+        GET  /metrics     run metrics in the Prometheus text format
+    """
+
+    server_version = "BookPlaylistService/1.0"
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status, payload, content_type="application/json", headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"error": message})
+
+    def do_GET(self):
+        manager = self.server.manager
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/health":
+            self._send(200, {"status": "ok", "workers": manager.workers, "jobs": manager.counts()})
+        elif path == "/metrics":
+            self._send(200, metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+        elif path == "/jobs":
+            self._send(200, {"jobs": manager.list()})
+        elif path.startswith("/jobs/"):
+            job = manager.get(path[len("/jobs/"):])
+            if job:
+                self._send(200, job)
+            else:
+                self._error(404, "No such job.")
+        else:
+            self._error(404, "Not found.")
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/jobs":
+            self._error(404, "Not found.")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._error(400, "Invalid Content-Length header.")
+            return
+        if length > MAX_BODY_BYTES:
+            self._error(413, f"Request body larger than {MAX_BODY_BYTES} bytes.")
+            return
+        try:
+            config, resume, config_name = parse_job_request(json.loads(self.rfile.read(length) or b"null"))
+        except (ValueError, UnicodeDecodeError) as e:
+            self._error(400, str(e))
+            return
+        try:
+            job = self.server.manager.submit(config, resume, config_name)
+        except JobConflict as e:
+            self._error(409, str(e))
+            return
+        except ServiceBusy as e:
+            self._error(503, str(e))
+            return
+        self._send(202, job, headers={"Location": f"/jobs/{job['id']}"})
+
+
+def keep_token_fresh(sp, stop):
+    """Refresh the Spotify token ahead of expiry until `stop` is set."""
+    while not stop.wait(TOKEN_CHECK_INTERVAL):
+        try:
+            refresh_spotify_token(sp)
+        except Exception as e:
+            logging.warning(f"Could not refresh the Spotify token: {e}")
+
+
+def create_server(sp, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, max_queued=SERVICE_MAX_QUEUED):
+    server = ThreadingHTTPServer((host, port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.manager = JobManager(sp, workers, max_queued)
+    return server
+
+
+def serve(sp, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, max_queued=SERVICE_MAX_QUEUED):
+    """Serve the job API until interrupted, then wait for running jobs to finish."""
+    refresh_spotify_token(sp)
+    server = create_server(sp, host, port, workers, max_queued)
+    stop = threading.Event()
+    threading.Thread(target=keep_token_fresh, args=(sp, stop), daemon=True).start()
+    logging.info(f"Serving on http://{host}:{server.server_address[1]} with {server.manager.workers} workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down; waiting for running jobs to finish.")
+    finally:
+        stop.set()
+        server.server_close()
+        server.manager.shutdown()
@@ -0,0 +1,255 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+import httpx
+from spotipy.exceptions import SpotifyException
+
+from config import SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_HTTP_RETRIES, SPOTIFY_POOL_SIZE, SPOTIFY_TIMEOUT
+
+API_BASE = "https://api.spotify.com/v1/"
+# Refresh the access token in the background once it expires within this many seconds;
+# requests keep using the current token meanwhile
+TOKEN_REFRESH_MARGIN = 300
+# Server errors retried inside the client, as spotipy's session does; 429s are left to spotify_call
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def _get_id(kind, value):
+    """
+    Spotify ID from an ID, a spotify:<kind>:<id> URI or an open.spotify.com URL.
+
+    Like spotipy, raises SpotifyException when a URI or URL is for another kind of object.
+    """
+    if value.startswith("spotify:"):
+        fields = value.split(":")
+        found, spotify_id = fields[-2], fields[-1]
+    elif "open.spotify.com" in value:
+        fields = value.split("?", 1)[0].rstrip("/").split("/")
+        found, spotify_id = fields[-2], fields[-1]
+    else:
+        return value
+    if found != kind:
+        raise SpotifyException(400, -1, f"Unexpected Spotify URL type: expected a {kind}, got a {found}.")
+    return spotify_id
+
+
+def _get_uri(kind, value):
+    return value if value.startswith("spotify:") else f"spotify:{kind}:{_get_id(kind, value)}"
+
+
+class AsyncSpotify:
+    """
+    Asynchronous client for the Spotify Web API endpoints the application uses.
+
+    Requests share one httpx.AsyncClient, so up to `pool_size` keep-alive connections are reused
+    across calls and many calls can be in flight at once. Tokens come from a spotipy
+    SpotifyOAuth manager. A token close to expiry is refreshed in the background while requests
+    go on with the current one; only an expired token makes requests wait, and concurrent
+    requests then share a single refresh. Errors are raised as spotipy's SpotifyException, so
+    callers handle them as they would spotipy's.
+    """
+
+    def __init__(self, auth_manager, pool_size=SPOTIFY_POOL_SIZE, timeout=SPOTIFY_TIMEOUT,
+                 connect_timeout=SPOTIFY_CONNECT_TIMEOUT, retries=SPOTIFY_HTTP_RETRIES, base_url=API_BASE,
+                 transport=None):
+        self.auth_manager = auth_manager
+        self.retries = retries
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            transport=transport,
+        )
+        self._token_info = None
+        self._refresh_task = None
+
+    # Tokens
+
+    def _load_token(self, force_refresh=False):
+        """Current token from spotipy's cache, refreshed or obtained through the authorization flow as needed (blocking)."""
+        token_info = self.auth_manager.cache_handler.get_cached_token()
+        if token_info and token_info.get("refresh_token") and (
+                force_refresh or token_info["expires_at"] - time.time() <= TOKEN_REFRESH_MARGIN):
+            return self.auth_manager.refresh_access_token(token_info["refresh_token"])
+        if token_info:
+            return token_info
+        # No cached token: runs the authorization flow, which caches the token it obtains
+        self.auth_manager.get_access_token(check_cache=False)
+        return self.auth_manager.cache_handler.get_cached_token()
+
+    def _start_refresh(self, force=False):
+        if self._refresh_task is None or self._refresh_task.done():
+            # spotipy's token requests are blocking, so they run on a worker thread
+            self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self._load_token, force))
+            self._refresh_task.add_done_callback(self._refreshed)
+        return self._refresh_task
+
+    def _refreshed(self, task):
+        if task.cancelled() or task.exception() is not None:
+            logging.warning(f"Could not refresh the Spotify access token: {task.exception() if not task.cancelled() else 'cancelled'}")
+            return
+        self._token_info = task.result()
+        logging.debug("Spotify access token loaded.")
+
+    async def access_token(self):
+        """A valid access token, waiting only when there is none or it has expired."""
+        token_info = self._token_info
+        remaining = token_info["expires_at"] - time.time() if token_info else 0
+        if remaining > 30:
+            if remaining <= TOKEN_REFRESH_MARGIN:
+                self._start_refresh()
+            return token_info["access_token"]
+        await self._start_refresh()
+        return self._token_info["access_token"]
+
+    async def refresh_token(self, margin=TOKEN_REFRESH_MARGIN):
+        """Refresh the token now if it expires within `margin` seconds; returns True if it was refreshed."""
+        token_info = self._token_info
+        if token_info and token_info["expires_at"] - time.time() > margin:
+            return False
+        await self._start_refresh(force=token_info is not None)
+        return True
+
+    # Requests
+
+    async def _request(self, method, path, params=None, payload=None):
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+        attempt, refreshed = 0, False
+        while True:
+            token = await self.access_token()
+            try:
+                response = await self._client.request(method, path, params=params, json=payload,
+                                                      headers={"Authorization": f"Bearer {token}"})
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise ConnectionError(f"{method} {path}: {e}") from e
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                continue
+            if response.status_code == 401 and not refreshed:
+                # Revoked or expired early: refresh once and retry, without using up a retry
+                refreshed = True
+                await self._start_refresh(force=True)
+                continue
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                try:
+                    message = response.json().get("error", {}).get("message", response.text)
+                except ValueError:
+                    message = response.text
+                raise SpotifyException(response.status_code, -1, f"{response.request.url}:\n {message}",
+                                       headers=response.headers)
+            if not response.content:
+                return None
+            return response.json()
+
+    async def search(self, q, limit=10, offset=0, type="track", market=None):
+        return await self._request("GET", "search", {"q": q, "limit": limit, "offset": offset, "type": type, "market": market})
+
+    async def recommendations(self, seed_artists=None, seed_genres=None, seed_tracks=None, limit=20, country=None, **kwargs):
+        params = {"limit": limit, "market": country}
+        if seed_artists:
+            params["seed_artists"] = ",".join(_get_id("artist", artist) for artist in seed_artists)
+        if seed_genres:
+            params["seed_genres"] = ",".join(seed_genres)
+        if seed_tracks:
+            params["seed_tracks"] = ",".join(_get_id("track", track) for track in seed_tracks)
+        for key, value in kwargs.items():
+            if key.startswith(("min_", "max_", "target_")):
+                params[key] = value
+        return await self._request("GET", "recommendations", params)
+
+    async def recommendation_genre_seeds(self):
+        return await self._request("GET", "recommendations/available-genre-seeds")
+
+    async def audio_features(self, tracks=()):
+        ids = [_get_id("track", track) for track in ([tracks] if isinstance(tracks, str) else tracks)]
+        results = await self._request("GET", "audio-features", {"ids": ",".join(ids)})
+        return results["audio_features"] if results and "audio_features" in results else results
+
+    async def me(self):
+        return await self._request("GET", "me")
+
+    async def user_playlist_create(self, user, name, public=True, collaborative=False, description=""):
+        return await self._request("POST", f"users/{user}/playlists", payload={
+            "name": name, "public": public, "collaborative": collaborative, "description": description})
+
+    async def playlist_add_items(self, playlist_id, items, position=None):
+        payload = {"uris": [_get_uri("track", item) for item in items]}
+        if position is not None:
+            payload["position"] = position
+        return await self._request("POST", f"playlists/{_get_id('playlist', playlist_id)}/tracks", payload=payload)
+
+    async def playlist_replace_items(self, playlist_id, items):
+        return await self._request("PUT", f"playlists/{_get_id('playlist', playlist_id)}/tracks",
+                                   payload={"uris": [_get_uri("track", item) for item in items]})
+
+    async def playlist_change_details(self, playlist_id, name=None, public=None, collaborative=None, description=None):
+        payload = {key: value for key, value in (("name", name), ("public", public), ("collaborative", collaborative),
+                                                 ("description", description)) if value is not None}
+        return await self._request("PUT", f"playlists/{_get_id('playlist', playlist_id)}", payload=payload)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def _blocking(name):
+    """Sync method of SpotifyClient that runs the AsyncSpotify method of the same name on the client's event loop."""
+    method = getattr(AsyncSpotify, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.run(method(self.async_client, *args, **kwargs))
+    return wrapper
+
+
+class SpotifyClient:
+    """
+    Blocking facade over AsyncSpotify with the spotipy.Spotify methods the application calls.
+
+    The async client runs on an event loop in a background thread. Each call blocks only its
+    calling thread, so calls from the pipeline's worker threads are all in flight together over
+    the shared connection pool. Coroutine code can use `async_client` directly on `loop`.
+    """
+
+    def __init__(self, auth_manager, **kwargs):
+        self.auth_manager = auth_manager
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="spotify-client", daemon=True)
+        self._thread.start()
+        self.async_client = self.run(self._create(auth_manager, kwargs))
+
+    @staticmethod
+    async def _create(auth_manager, kwargs):
+        # Created on the loop that will use it
+        return AsyncSpotify(auth_manager, **kwargs)
+
+    def run(self, coroutine):
+        """Run a coroutine on the client's event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    search = _blocking("search")
+    recommendations = _blocking("recommendations")
+    recommendation_genre_seeds = _blocking("recommendation_genre_seeds")
+    audio_features = _blocking("audio_features")
+    me = _blocking("me")
+    user_playlist_create = _blocking("user_playlist_create")
+    playlist_add_items = _blocking("playlist_add_items")
+    playlist_replace_items = _blocking("playlist_replace_items")
+    playlist_change_details = _blocking("playlist_change_details")
+    refresh_token = _blocking("refresh_token")
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.run(self.async_client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
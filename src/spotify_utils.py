@@ -1,11 +1,21 @@
 import logging
+import math
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
-from config import LOG_LEVEL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+from urllib3.util.retry import Retry
+from config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_HTTP_CLIENT, SPOTIFY_HTTP_RETRIES, SPOTIFY_POOL_SIZE, SPOTIFY_TIMEOUT, SPOTIFY_RATE_LIMIT_RETRIES, SEED_CACHE_TTL, SEED_CACHE_NEGATIVE_TTL, SEED_CACHE_MAX_ENTRIES, TRACK_INDEX, TRACK_INDEX_MAX_DISTANCE, AUDIO_FEATURES_CACHE_MAX_ENTRIES, RECOMMENDATION_OVERFETCH_MARGIN, GENRE_CACHE_TTL, RECOMMENDATION_CACHE, RECOMMENDATION_CACHE_FEATURE_STEP, RECOMMENDATION_CACHE_TEMPO_STEP, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_MAX_ENTRIES
+from cache_utils import SQLiteCache, normalize_query
+from rate_limiter import spotify_rate_limiter
+from track_index import FEATURES, TrackIndex, compact_track, feature_distances, track_key
+from instrumentation import increment, count_retry, timed
 from tenacity import retry, stop_after_attempt, retry_if_exception_type
 
-logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-
 
 def spotify_retry_decorator(retry_count=3):
     def custom_wait(retry_state):
@@ -22,20 +32,233 @@ def spotify_retry_decorator(retry_count=3):
         retry=retry_if_exception_type((spotipy.exceptions.SpotifyException, ConnectionError)),
         stop=stop_after_attempt(retry_count),
         wait=custom_wait,  # custom_wait returns the actual wait time
+        before_sleep=count_retry("spotify"),
         reraise=True
     )
 
+def _retry_after(exception, default=10):
+    try:
+        return int((exception.headers or {}).get('Retry-After', default))
+    except (TypeError, ValueError):
+        return default
+
+def spotify_call(endpoint, func, *args, **kwargs):
+    """
+    Call a spotipy method through the process-wide rate limiter.
+
+    On a 429 response every caller is paused for the server's Retry-After and the call is
+    retried up to SPOTIFY_RATE_LIMIT_RETRIES times before the exception is re-raised.
+    """
+    for attempt in range(SPOTIFY_RATE_LIMIT_RETRIES + 1):
+        spotify_rate_limiter.acquire(endpoint)
+        increment("api_calls_total", api="spotify", endpoint=endpoint)
+        try:
+            result = func(*args, **kwargs)
+        except spotipy.exceptions.SpotifyException as e:
+            if e.http_status == 429:
+                increment("rate_limited_total", api="spotify", endpoint=endpoint)
+            if e.http_status != 429 or attempt == SPOTIFY_RATE_LIMIT_RETRIES:
+                raise
+            spotify_rate_limiter.backoff(_retry_after(e), endpoint)
+            increment("retries_total", api="spotify", operation=endpoint)
+            continue
+        spotify_rate_limiter.record_success()
+        return result
+
+_seed_cache = None
+
+def get_seed_cache():
+    """Persistent cache mapping normalized seed searches to Spotify IDs (None for no match)."""
+    global _seed_cache
+    if _seed_cache is None:
+        _seed_cache = SQLiteCache("seed_ids", ttl=SEED_CACHE_TTL, negative_ttl=SEED_CACHE_NEGATIVE_TTL,
+                                  max_entries=SEED_CACHE_MAX_ENTRIES)
+    return _seed_cache
+
+_recommendation_cache = None
+
+def get_recommendation_cache():
+    """Persistent cache of recommendation candidates by recommendation_cache_key."""
+    global _recommendation_cache
+    if _recommendation_cache is None:
+        _recommendation_cache = SQLiteCache("recommendations", ttl=RECOMMENDATION_CACHE_TTL,
+                                            max_entries=RECOMMENDATION_CACHE_MAX_ENTRIES)
+    return _recommendation_cache
+
+def _bucket(value, step):
+    if value is None:
+        return "-"
+    return str(round(value / step)) if step > 0 else repr(value)
+
+def recommendation_cache_key(parameters, feature_step=RECOMMENDATION_CACHE_FEATURE_STEP, tempo_step=RECOMMENDATION_CACHE_TEMPO_STEP):
+    """
+    Cache key of a recommendations request: its seed IDs and its targets rounded to buckets.
+
+    Requests with the same seeds whose targets round to the same multiples of the steps share a
+    key, and so the candidates of a single request. A step of 0 keys on the exact value.
+    """
+    seeds = [",".join(sorted(parameters.get(seed_type) or [])) for seed_type in ('seed_genres', 'seed_tracks', 'seed_artists')]
+    buckets = [
+        _bucket(parameters['target_valence'], feature_step),
+        _bucket(parameters['target_energy'], feature_step),
+        _bucket(parameters['target_tempo'], tempo_step),
+        _bucket(parameters.get('min_instrumentalness'), feature_step),
+    ]
+    return "|".join(seeds + buckets)
+
+def fetch_recommendations(sp: spotipy.Spotify, parameters, fetch_limit, exclude=None):
+    """
+    At least `fetch_limit` candidate tracks for the parameters that are not in `exclude`, or all
+    the endpoint has. Served from the recommendation cache when a close-enough request fetched
+    enough unused candidates, else from the recommendations endpoint.
+
+    Chapters of one book often share a cache key, so the cached candidates are filtered against
+    the tracks the book already uses before deciding whether they are enough.
+    """
+    key = recommendation_cache_key(parameters) if RECOMMENDATION_CACHE else None
+    excluded = 0
+    if key:
+        hit, cached = get_recommendation_cache().get(key)
+        if hit:
+            candidates = unused_tracks(cached["tracks"], exclude)
+            # Enough unused candidates, or every candidate the endpoint had for these seeds
+            if len(candidates) >= fetch_limit or len(cached["tracks"]) < cached["limit"]:
+                increment("recommendations_total", source="cache")
+                logging.info("Serving recommendations from the recommendation cache.")
+                return candidates
+            excluded = len(cached["tracks"]) - len(candidates)
+
+    # Ask for enough that excluded tracks returned again still leave `fetch_limit` unused ones
+    request_limit = min(MAX_RECOMMENDATIONS, fetch_limit + excluded)
+    while True:
+        recommendations = spotify_call(
+            'recommendations', sp.recommendations,
+            seed_genres=parameters.get('seed_genres', None),
+            seed_tracks=parameters.get('seed_tracks', None),
+            seed_artists=parameters.get('seed_artists', None),
+            target_valence=parameters['target_valence'],
+            target_energy=parameters['target_energy'],
+            target_tempo=parameters['target_tempo'],
+            min_instrumentalness=parameters.get('min_instrumentalness'),
+            limit=request_limit
+        )
+        increment("recommendations_total", source="remote")
+        tracks = recommendations['tracks']
+        candidates = unused_tracks(tracks, exclude)
+        if len(candidates) >= fetch_limit or len(tracks) < request_limit or request_limit == MAX_RECOMMENDATIONS:
+            break
+        logging.info(f"Only {len(candidates)} of {len(tracks)} recommendations are unused; fetching {MAX_RECOMMENDATIONS}.")
+        request_limit = MAX_RECOMMENDATIONS
+    if key:
+        get_recommendation_cache().set(key, {"limit": request_limit, "tracks": [compact_track(track) for track in tracks]})
+    return candidates
+
+def unused_tracks(tracks, exclude):
+    """The tracks whose track_key is not in `exclude`, in order."""
+    if not exclude:
+        return list(tracks)
+    return [track for track in tracks if track_key(track) not in exclude]
+
+# Largest batch accepted by the audio-features and recommendations endpoints
+AUDIO_FEATURES_BATCH_SIZE = 100
+MAX_RECOMMENDATIONS = 100
+
+_audio_features_cache = None
+
+def get_audio_features_cache():
+    """Persistent cache of audio features by track ID (None for tracks without features)."""
+    global _audio_features_cache
+    if _audio_features_cache is None:
+        _audio_features_cache = SQLiteCache("audio_features", negative_ttl=SEED_CACHE_NEGATIVE_TTL,
+                                            max_entries=AUDIO_FEATURES_CACHE_MAX_ENTRIES)
+    return _audio_features_cache
+
+class FilterPassRate:
+    """
+    Running estimate of the share of recommended tracks that pass the local instrumentalness filter.
+
+    Used to size recommendation requests so that, after filtering, about `limit` tracks remain.
+    Estimates are kept per threshold (rounded to one decimal).
+    """
+
+    def __init__(self, initial=0.5, weight=0.3):
+        self.initial = initial
+        self.weight = weight
+        self.rates = {}
+        self._lock = threading.Lock()
+
+    def update(self, threshold, passed, total):
+        if not total:
+            return
+        key = round(threshold, 1)
+        with self._lock:
+            rate = self.rates.get(key, self.initial)
+            self.rates[key] = (1 - self.weight) * rate + self.weight * passed / total
+
+    def fetch_limit(self, limit, threshold=None, margin=RECOMMENDATION_OVERFETCH_MARGIN):
+        """Number of tracks to request so that about `limit` pass a filter at `threshold`."""
+        if threshold is None:
+            return min(MAX_RECOMMENDATIONS, limit)
+        with self._lock:
+            rate = self.rates.get(round(threshold, 1), self.initial)
+        return min(MAX_RECOMMENDATIONS, max(limit, math.ceil(limit * margin / max(rate, 0.05))))
+
+filter_pass_rate = FilterPassRate()
+
+_track_index = None
+
+def get_track_index():
+    """Process-wide local track index, loaded from disk on first use."""
+    global _track_index
+    if _track_index is None:
+        _track_index = TrackIndex()
+    return _track_index
+
+def save_track_index():
+    if _track_index is not None:
+        _track_index.save()
+
+def build_pooled_session(retries=5, status_retries=3, backoff_factor=1):
+    """Build a requests session with spotipy's retry policy and a connection pool sized for parallel calls."""
+    session = requests.Session()
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=status_retries,
+        backoff_factor=backoff_factor,
+        # 429s are left to spotify_call so the shared rate limiter can react to them
+        status_forcelist=(500, 502, 503, 504)
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=SPOTIFY_POOL_SIZE, pool_maxsize=SPOTIFY_POOL_SIZE, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 # @spotify_retry_decorator()
 def initialize_spotify():
+    """
+    Spotify client for the configured transport.
+
+    With SPOTIFY_HTTP_CLIENT=httpx, requests go through the async client in spotify_client, which keeps
+    up to SPOTIFY_POOL_SIZE connections alive and refreshes the token without holding up requests;
+    with "requests", through spotipy's own client. Both raise spotipy's exceptions.
+    """
     try:
-        sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+        auth_manager = SpotifyOAuth(
             client_id=SPOTIFY_CLIENT_ID,
             client_secret=SPOTIFY_CLIENT_SECRET,
             redirect_uri="http://localhost:8888/callback",
             scope="playlist-modify-private"
-        ),
-        requests_timeout=10,
-        retries=5,
+        )
+        if SPOTIFY_HTTP_CLIENT == "httpx":
+            from spotify_client import SpotifyClient
+            return SpotifyClient(auth_manager)
+        sp = spotipy.Spotify(auth_manager=auth_manager,
+        requests_session=build_pooled_session(retries=SPOTIFY_HTTP_RETRIES, backoff_factor=1),
+        requests_timeout=SPOTIFY_TIMEOUT,
+        retries=SPOTIFY_HTTP_RETRIES,
         backoff_factor=1
         )
         return sp
@@ -51,11 +274,52 @@ def print_parameters(parameters):
     for key, value in parameters.items():
         print(f"{key}: {value}")
 
+def refresh_spotify_token(sp, margin=300):
+    """
+    Refresh the client's OAuth token if it expires within `margin` seconds.
+
+    spotipy only refreshes a token once a request finds it expired; a long-running process calls
+    this ahead of time so no request waits for the refresh. Returns True if a token was refreshed.
+    """
+    if hasattr(sp, 'refresh_token'):
+        # The httpx client refreshes its own copy of the token
+        refreshed = sp.refresh_token(margin)
+        if refreshed:
+            logging.info("Refreshed the Spotify access token.")
+        return refreshed
+    auth_manager = getattr(sp, 'auth_manager', None)
+    if not isinstance(auth_manager, SpotifyOAuth):
+        return False
+    token_info = auth_manager.cache_handler.get_cached_token()
+    if not token_info or not token_info.get('refresh_token'):
+        return False
+    if token_info['expires_at'] - time.time() > margin:
+        return False
+    auth_manager.refresh_access_token(token_info['refresh_token'])
+    logging.info("Refreshed the Spotify access token.")
+    return True
+
+_genre_cache = None
+
+def get_genre_cache():
+    global _genre_cache
+    if _genre_cache is None:
+        _genre_cache = SQLiteCache("genre_seeds", ttl=GENRE_CACHE_TTL)
+    return _genre_cache
+
 # @spotify_retry_decorator()
 def get_available_genre_seeds(sp: spotipy.Spotify):
+    """Genres accepted as recommendation seeds, cached on disk for GENRE_CACHE_TTL seconds."""
+    cache = get_genre_cache()
+    hit, genres = cache.get("genres")
+    if hit and genres:
+        logging.info(f"Using {len(genres)} cached genre seeds.")
+        return genres
     try:
         logging.info("Getting available genre seeds...")
-        genres = sp.recommendation_genre_seeds()
+        genres = spotify_call('recommendation_genre_seeds', sp.recommendation_genre_seeds)
+        if genres['genres']:
+            cache.set("genres", genres['genres'])
         return genres['genres']
     except spotipy.exceptions.SpotifyException as e:
         print(f"Spotify error when getting genre seeds: {e}")
@@ -66,12 +330,20 @@ def get_available_genre_seeds(sp: spotipy.Spotify):
 
 # @spotify_retry_decorator()
 def search_track(sp: spotipy.Spotify, track_name):
+    cache_key = f"track:{normalize_query(track_name)}"
+    hit, track_id = get_seed_cache().get(cache_key)
+    if hit:
+        return track_id
+
     try:
-        results = sp.search(q=track_name, type='track', limit=1)
+        results = spotify_call('search', sp.search, q=track_name, type='track', limit=1)
         if results['tracks']['items']:
-            return results['tracks']['items'][0]['id']
+            track_id = results['tracks']['items'][0]['id']
+            get_seed_cache().set(cache_key, track_id)
+            return track_id
         else:
             print(f"No track found for: {track_name}")
+            get_seed_cache().set(cache_key, None)
             return None
     except spotipy.exceptions.SpotifyException as e:
         print(f"Spotify error when searching for track: {e}")
@@ -82,12 +354,20 @@ def search_track(sp: spotipy.Spotify, track_name):
 
 # @spotify_retry_decorator()
 def search_artist(sp: spotipy.Spotify, artist_name):
+    cache_key = f"artist:{normalize_query(artist_name)}"
+    hit, artist_id = get_seed_cache().get(cache_key)
+    if hit:
+        return artist_id
+
     try:
-        results = sp.search(q=artist_name, type='artist', limit=1)
+        results = spotify_call('search', sp.search, q=artist_name, type='artist', limit=1)
         if results['artists']['items']:
-            return results['artists']['items'][0]['id']
+            artist_id = results['artists']['items'][0]['id']
+            get_seed_cache().set(cache_key, artist_id)
+            return artist_id
         else:
             print(f"No artist found for: {artist_name}")
+            get_seed_cache().set(cache_key, None)
             return None
     except spotipy.exceptions.SpotifyException as e:
         print(f"Spotify error when searching for artist: {e}")
@@ -96,17 +376,63 @@ def search_artist(sp: spotipy.Spotify, artist_name):
         print(f"Error searching for artist: {e}")
         return None  # Non-retryable errors
 
+def _resolve_seed_name(search, sp, name):
+    try:
+        return search(sp, name)
+    except spotipy.exceptions.SpotifyException:
+        return None  # Already reported by the search function
+
+@timed("seed_resolution")
+def resolve_seeds(sp: spotipy.Spotify, parameters_list, max_workers=SPOTIFY_POOL_SIZE):
+    """
+    Resolve seed track and artist names to Spotify IDs for many chapters at once.
+
+    Names are deduplicated across all chapters, each unique name is searched once in parallel,
+    and the IDs are written back into every chapter's parameters (unresolved names are dropped).
+    """
+    searches = {'seed_tracks': search_track, 'seed_artists': search_artist}
+    unique_names = {}
+    for parameters in parameters_list:
+        if not parameters:
+            continue
+        for seed_type in searches:
+            for name in parameters.get(seed_type, []):
+                unique_names.setdefault((seed_type, normalize_query(name)), name)
+
+    logging.info(f"Resolving {len(unique_names)} unique seeds for {len(parameters_list)} chapters...")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {key: executor.submit(_resolve_seed_name, searches[key[0]], sp, name) for key, name in unique_names.items()}
+        resolved = {key: future.result() for key, future in futures.items()}
+
+    for parameters in parameters_list:
+        if not parameters:
+            continue
+        for seed_type in searches:
+            if seed_type in parameters:
+                seed_ids = [resolved[(seed_type, normalize_query(name))] for name in parameters[seed_type]]
+                parameters[seed_type] = list(dict.fromkeys(id for id in seed_ids if id is not None))
+    return parameters_list
+
 # @spotify_retry_decorator()
-def get_spotify_recommendations(sp: spotipy.Spotify, parameters, vocal_preference='b', min_instrumentalness=None):
+@timed("recommendations")
+def get_spotify_recommendations(sp: spotipy.Spotify, parameters, vocal_preference='b', min_instrumentalness=None, seeds_resolved=False, spare=0, exclude=None):
+    """
+    Recommended tracks for the chapter parameters, best match first.
+
+    Up to `spare` further candidates are returned after the first `limit` tracks, for callers
+    that may drop some (for example duplicates from other chapters). Tracks whose track_key is
+    in `exclude`, the tracks the book already uses, are not returned.
+    """
     try:
         # Resolve track and artist names to IDs
-        if 'seed_tracks' in parameters:
-            seed_track_ids = [search_track(sp, track) for track in parameters['seed_tracks']]
-            parameters['seed_tracks'] = [id for id in seed_track_ids if id is not None]
+        if not seeds_resolved:
+            if 'seed_tracks' in parameters:
+                seed_track_ids = [search_track(sp, track) for track in parameters['seed_tracks']]
+                parameters['seed_tracks'] = [id for id in seed_track_ids if id is not None]
 
-        if 'seed_artists' in parameters:
-            seed_artist_ids = [search_artist(sp, artist) for artist in parameters['seed_artists']]
-            parameters['seed_artists'] = [id for id in seed_artist_ids if id is not None]
+            if 'seed_artists' in parameters:
+                seed_artist_ids = [search_artist(sp, artist) for artist in parameters['seed_artists']]
+                parameters['seed_artists'] = [id for id in seed_artist_ids if id is not None]
 
         # Validate target values
         for feature in ['valence', 'energy']:
@@ -139,18 +465,33 @@ def get_spotify_recommendations(sp: spotipy.Spotify, parameters, vocal_preferenc
             parameters['min_instrumentalness'] = min_instrumentalness
 
         print_parameters(parameters)
+        if TRACK_INDEX:
+            tracks = get_track_index().query(
+                parameters['target_valence'], parameters['target_energy'], parameters['target_tempo'],
+                parameters['limit'], parameters.get('min_instrumentalness'), spare=spare,
+                seed_genres=parameters.get('seed_genres'),
+                seed_artists=parameters.get('seed_artists'),
+                seed_tracks=parameters.get('seed_tracks'),
+                max_distance=TRACK_INDEX_MAX_DISTANCE,
+                exclude=exclude
+            )
+            if tracks is not None:
+                increment("recommendations_total", source="local")
+                logging.info("Serving recommendations from the local track index.")
+                return tracks
+
         logging.info("Getting Spotify recommendations...")
-        recommendations = sp.recommendations(
-            seed_genres=parameters.get('seed_genres', None),
-            seed_tracks=parameters.get('seed_tracks', None),
-            seed_artists=parameters.get('seed_artists', None),
-            target_valence=parameters['target_valence'],
-            target_energy=parameters['target_energy'],
-            target_tempo=parameters['target_tempo'],
-            min_instrumentalness=parameters.get('min_instrumentalness'),
-            limit=parameters['limit']
-        )
-        return recommendations['tracks']
+        # Over-fetch just enough that about `limit` tracks survive the local instrumentalness filter
+        fetch_limit = filter_pass_rate.fetch_limit(parameters['limit'] + spare, parameters.get('min_instrumentalness'))
+        candidates = fetch_recommendations(sp, parameters, fetch_limit, exclude)
+        try:
+            audio_features = get_audio_features(sp, [track['id'] for track in candidates])
+        except spotipy.exceptions.SpotifyException as e:
+            logging.warning(f"Could not fetch audio features, using unfiltered recommendations: {e}")
+            return candidates[:parameters['limit'] + spare]
+        if TRACK_INDEX:
+            get_track_index().add(candidates, audio_features, parameters.get('seed_genres') or [])
+        return rank_recommendations(candidates, audio_features, parameters, parameters['limit'], spare)
     except spotipy.exceptions.SpotifyException as e:
         print(f"Spotify error when getting recommendations: {e}")
         raise  # Re-raise to trigger retry
@@ -158,17 +499,102 @@ def get_spotify_recommendations(sp: spotipy.Spotify, parameters, vocal_preferenc
         print(f"Error getting Spotify recommendations: {e}")
         return []  # Non-retryable errors
 
+def get_audio_features(sp: spotipy.Spotify, track_ids):
+    """
+    Audio features for track IDs as a dict of track ID to features.
+
+    Cached features are reused; the rest are fetched AUDIO_FEATURES_BATCH_SIZE per request.
+    """
+    track_ids = list(dict.fromkeys(track_ids))
+    cache = get_audio_features_cache()
+    cached = cache.get_many(track_ids)
+    missing = [track_id for track_id in track_ids if track_id not in cached]
+    for start in range(0, len(missing), AUDIO_FEATURES_BATCH_SIZE):
+        batch = missing[start:start + AUDIO_FEATURES_BATCH_SIZE]
+        items = spotify_call('audio_features', sp.audio_features, batch) or []
+        fetched = {track_id: None for track_id in batch}
+        fetched.update({item['id']: item for item in items if item})
+        cache.set_many(fetched)
+        cached.update(fetched)
+    return {track_id: features for track_id, features in cached.items() if features}
+
+def rank_recommendations(tracks, audio_features, parameters, limit, spare=0):
+    """
+    Drop tracks below `min_instrumentalness` and order the rest by distance to the chapter's targets.
+
+    Tracks without audio features cannot be checked: they are dropped when there is an
+    instrumentalness minimum and otherwise placed after the ranked tracks. Returns at most
+    `limit` + `spare` tracks.
+    """
+    min_instrumentalness = parameters.get('min_instrumentalness')
+    known = [track for track in tracks if track['id'] in audio_features]
+    unknown = [track for track in tracks if track['id'] not in audio_features]
+    if known:
+        matrix = np.array([[audio_features[track['id']][name] for name in FEATURES] for track in known], dtype=np.float32)
+        keep = np.ones(len(known), dtype=bool) if min_instrumentalness is None else matrix[:, 3] >= min_instrumentalness
+        distances = feature_distances(matrix, parameters['target_valence'], parameters['target_energy'], parameters['target_tempo'])
+        rows = np.flatnonzero(keep)
+        ranked = [known[row] for row in rows[np.argsort(distances[rows], kind='stable')]]
+    else:
+        ranked = []
+    if min_instrumentalness is None:
+        ranked.extend(unknown)
+    else:
+        filter_pass_rate.update(min_instrumentalness, len(ranked), len(tracks))
+    if len(ranked) < limit:
+        logging.warning(f"Only {len(ranked)} of {len(tracks)} recommended tracks passed the audio-feature filter.")
+    return ranked[:limit + spare]
+
+# Largest batch accepted by playlist_add_items, and the longest description Spotify stores
+PLAYLIST_ADD_BATCH_SIZE = 100
+MAX_DESCRIPTION_LENGTH = 300
+
+_user_ids = weakref.WeakKeyDictionary()
+_user_ids_lock = threading.Lock()
+
+def get_user_id(sp: spotipy.Spotify):
+    """ID of the signed-in user, fetched once per client."""
+    # Held during the request so concurrent first callers share a single call
+    with _user_ids_lock:
+        if sp not in _user_ids:
+            _user_ids[sp] = spotify_call('me', sp.me)['id']
+        return _user_ids[sp]
+
+def format_playlist_description(parameters):
+    description = "; ".join(f"{key}: {value}" for key, value in parameters.items())
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        description = description[:MAX_DESCRIPTION_LENGTH - 3] + "..."
+    return description
+
+# Retried one request at a time, so a failure never repeats the playlist creation or earlier batches
+@spotify_retry_decorator()
+def add_playlist_items(sp: spotipy.Spotify, playlist_id, track_uris):
+    spotify_call('playlist_add_items', sp.playlist_add_items, playlist_id, track_uris)
+
+@spotify_retry_decorator()
+def replace_playlist_items(sp: spotipy.Spotify, playlist_id, track_uris):
+    spotify_call('playlist_replace_items', sp.playlist_replace_items, playlist_id, track_uris)
+
+@spotify_retry_decorator()
+def change_playlist_details(sp: spotipy.Spotify, playlist_id, **details):
+    spotify_call('playlist_change_details', sp.playlist_change_details, playlist_id, **details)
+
+def add_playlist_tracks(sp: spotipy.Spotify, playlist_id, track_uris):
+    """Append tracks to a playlist, PLAYLIST_ADD_BATCH_SIZE per request."""
+    for start in range(0, len(track_uris), PLAYLIST_ADD_BATCH_SIZE):
+        add_playlist_items(sp, playlist_id, track_uris[start:start + PLAYLIST_ADD_BATCH_SIZE])
+
 # @spotify_retry_decorator()
-def create_spotify_playlist(sp: spotipy.Spotify, book_title, chapter_number, tracks):
+def create_spotify_playlist(sp: spotipy.Spotify, book_title, chapter_number, tracks, description=None):
     if not tracks:
         print(f"No tracks found for Chapter {chapter_number}. Skipping playlist creation.")
-        return None
+        return None, None
 
     try:
         playlist_name = f"{book_title} - Chapter {chapter_number}"
-        playlist = sp.user_playlist_create(sp.me()['id'], playlist_name, public=False)
-        track_uris = [track['uri'] for track in tracks]
-        sp.playlist_add_items(playlist['id'], track_uris)
+        playlist = spotify_call('user_playlist_create', sp.user_playlist_create, get_user_id(sp), playlist_name,
+                                public=False, description=description or "")
+        add_playlist_tracks(sp, playlist['id'], [track['uri'] for track in tracks])
         return playlist['id'], playlist['external_urls']['spotify']
     except spotipy.exceptions.SpotifyException as e:
         print(f"Spotify error when creating playlist: {e}")
@@ -177,23 +603,94 @@ def create_spotify_playlist(sp: spotipy.Spotify, book_title, chapter_number, tra
         print(f"Error creating Spotify playlist: {e}")
         return None, None  # Non-retryable errors
 
-@spotify_retry_decorator(3)
-def update_playlist_description(sp: spotipy.Spotify, playlist_id, parameters):
-    try:
-        description = ""
-        for key, value in parameters.items():
-            description += f"{key}: {value}; "
+@timed("playlist_creation")
+def create_playlist_with_description(sp: spotipy.Spotify, book_title, chapter_number, tracks, parameters):
+    """Create a chapter playlist with its parameters as the description: one create call plus one add call per 100 tracks."""
+    playlist_id, playlist_url = create_spotify_playlist(sp, book_title, chapter_number, tracks,
+                                                        format_playlist_description(parameters))
+    return playlist_url
 
-        sp.playlist_change_details(playlist_id, description=description, public=False)
-        print(f"Updated description for playlist {playlist_id}")
-    except spotipy.exceptions.SpotifyException as e:
-        print(f"Spotify error when updating playlist description: {e}")
-        raise  # Re-raise to trigger retry
-    except Exception as e:
-        print(f"Error updating playlist description: {e}")
+@timed("playlist_update")
+def update_playlist_with_description(sp: spotipy.Spotify, playlist_url, book_title, chapter_number, tracks, parameters):
+    """
+    Replace the tracks, name and description of an existing chapter playlist, keeping its URL.
 
-def create_playlist_with_description(sp: spotipy.Spotify, book_title, chapter_number, tracks, parameters):
-    playlist_id, playlist_url = create_spotify_playlist(sp, book_title, chapter_number, tracks)
-    if playlist_id:
-        update_playlist_description(sp, playlist_id, parameters)
+    One replace call plus one add call per further 100 tracks, and one details call. Returns
+    the playlist URL, or None when there are no tracks (the playlist is then left as it was).
+    """
+    if not tracks:
+        print(f"No tracks found for Chapter {chapter_number}. Leaving its playlist unchanged.")
+        return None
+    playlist_id = playlist_url.rstrip("/").rsplit("/", 1)[-1]
+    track_uris = [track['uri'] for track in tracks]
+    replace_playlist_items(sp, playlist_id, track_uris[:PLAYLIST_ADD_BATCH_SIZE])
+    add_playlist_tracks(sp, playlist_id, track_uris[PLAYLIST_ADD_BATCH_SIZE:])
+    change_playlist_details(sp, playlist_id, name=f"{book_title} - Chapter {chapter_number}",
+                            description=format_playlist_description(parameters))
     return playlist_url
+
+
+class BookPlaylist:
+    """
+    A single playlist for a whole book, with each chapter's tracks appended in order as a section.
+
+    The playlist is created with the first chapter. Once all chapters are added, finish()
+    writes the section boundaries into the description. Pass `playlist_url` and `sections`
+    (a list of (chapter number, track count)) to continue a playlist from an earlier run.
+    """
+
+    def __init__(self, sp: spotipy.Spotify, book_title, playlist_url=None, sections=None):
+        self.sp = sp
+        self.book_title = book_title
+        self.playlist_url = playlist_url
+        self.playlist_id = playlist_url.rstrip("/").rsplit("/", 1)[-1] if playlist_url else None
+        self.sections = list(sections or [])
+
+    @timed("playlist_creation")
+    def add_chapter(self, chapter_number, tracks):
+        """Append a chapter's tracks, creating the playlist first if needed; returns the playlist URL."""
+        if not tracks:
+            print(f"No tracks found for Chapter {chapter_number}. Skipping it in the book playlist.")
+            return None
+        if self.playlist_id is None:
+            playlist = spotify_call('user_playlist_create', self.sp.user_playlist_create, get_user_id(self.sp),
+                                    self.book_title, public=False,
+                                    description=f"Chapter playlists for {self.book_title}")
+            self.playlist_id = playlist['id']
+            self.playlist_url = playlist['external_urls']['spotify']
+        add_playlist_tracks(self.sp, self.playlist_id, [track['uri'] for track in tracks])
+        self.sections.append((chapter_number, len(tracks)))
+        return self.playlist_url
+
+    def description(self):
+        """
+        The track range of each chapter, e.g. "Tracks: Ch 1: 1-10, Ch 2: 11-22".
+
+        When they do not all fit in MAX_DESCRIPTION_LENGTH, the chapters that do not fit are
+        collapsed into one range covering them all, e.g. "Ch 19-40: 361-800".
+        """
+        ranges, start = [], 1
+        for chapter_number, count in self.sections:
+            ranges.append((chapter_number, start, start + count - 1))
+            start += count
+        parts = [f"Ch {chapter_number}: {first}-{last}" for chapter_number, first, last in ranges]
+        description = "Tracks: " + ", ".join(parts)
+        if len(description) <= MAX_DESCRIPTION_LENGTH:
+            return description
+        for kept in range(len(ranges) - 1, -1, -1):
+            rest = ranges[kept:]
+            tail = f"Ch {rest[0][0]}-{rest[-1][0]}: {rest[0][1]}-{rest[-1][2]}"
+            description = "Tracks: " + ", ".join(parts[:kept] + [tail])
+            if len(description) <= MAX_DESCRIPTION_LENGTH:
+                return description
+        return format_playlist_description({"Tracks": tail})
+
+    def finish(self):
+        """Write the chapter sections into the playlist description."""
+        if self.playlist_id is None:
+            return
+        try:
+            spotify_call('playlist_change_details', self.sp.playlist_change_details, self.playlist_id,
+                         description=self.description(), public=False)
+        except spotipy.exceptions.SpotifyException as e:
+            logging.warning(f"Could not update the book playlist description: {e}")
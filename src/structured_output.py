@@ -0,0 +1,275 @@
+import json
+
+from config import STRUCTURED_OUTPUT
+
+# JSON schemas of the LLM responses, sent as the response format in "json_schema" mode.
+# Strict schemas must list every property as required and cannot express ranges, so ranges are
+# enforced locally by clamp_parameters and parameter_problems.
+_CHAPTER = {
+    "type": "object",
+    "properties": {"number": {"type": "integer"}, "summary": {"type": "string"}},
+    "required": ["number", "summary"],
+    "additionalProperties": False,
+}
+
+CHAPTER_INFO_SCHEMA = {
+    "type": "object",
+    "properties": {"num_chapters": {"type": "integer"}, "chapters": {"type": "array", "items": _CHAPTER}},
+    "required": ["num_chapters", "chapters"],
+    "additionalProperties": False,
+}
+
+CHAPTER_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {"chapters": {"type": "array", "items": _CHAPTER}},
+    "required": ["chapters"],
+    "additionalProperties": False,
+}
+
+PARAMETER_PROPERTIES = {
+    "seed_genres": {"type": "array", "items": {"type": "string"}},
+    "seed_tracks": {"type": "array", "items": {"type": "string"}},
+    "seed_artists": {"type": "array", "items": {"type": "string"}},
+    "target_valence": {"type": "number"},
+    "target_energy": {"type": "number"},
+    "target_tempo": {"type": "number"},
+    "limit": {"type": "integer"},
+}
+
+SEED_FIELDS = ["seed_genres", "seed_tracks", "seed_artists"]
+
+
+def object_schema(properties):
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+SPOTIFY_PARAMETERS_SCHEMA = object_schema(PARAMETER_PROPERTIES)
+
+PARAMETER_BATCH_SCHEMA = object_schema({
+    "parameters": {"type": "array", "items": object_schema(dict({"chapter": {"type": "integer"}}, **PARAMETER_PROPERTIES))},
+})
+
+
+def parameter_fields_schema(fields):
+    """Schema of a response that carries only the given parameter fields."""
+    return object_schema({field: PARAMETER_PROPERTIES[field] for field in fields})
+
+
+def response_format(name, schema, mode=None):
+    """The OpenAI response_format for a schema under STRUCTURED_OUTPUT ("json_schema", "json_object" or "off")."""
+    mode = mode or STRUCTURED_OUTPUT
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+class OutputValidationError(ValueError):
+    """An LLM response that could not be parsed or repaired; resending the same prompt will not fix it."""
+
+
+def strip_code_fences(text):
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def _remove_trailing_commas(text):
+    """Drop commas directly before a closing bracket, outside strings."""
+    result = []
+    in_string = escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == ',':
+            rest = text[position + 1:].lstrip()
+            if rest[:1] in ('}', ']'):
+                continue
+        result.append(char)
+    return "".join(result)
+
+
+def _close_truncated(text):
+    """
+    Cut a truncated document back to its last complete value and close the open brackets.
+
+    Returns None if no value was completed before the text ends.
+    """
+    stack = []
+    safe = None
+    in_string = escaped = False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+        elif char in '}]':
+            if not stack:
+                return None
+            stack.pop()
+            if not stack:
+                return text[:position + 1]
+            safe = (position + 1, tuple(stack))
+        elif char == ',' and stack:
+            # Everything before a comma is complete
+            safe = (position, tuple(stack))
+    if safe is None:
+        return None
+    end, open_brackets = safe
+    closers = "".join('}' if bracket == '{' else ']' for bracket in reversed(open_brackets))
+    return text[:end].rstrip().rstrip(',') + closers
+
+
+def repair_json(text):
+    """
+    Parse JSON from an LLM response, repairing common defects. Returns (value, repairs).
+
+    Code fences, text around the JSON value and trailing commas are removed, and a truncated
+    document is cut back to its last complete value (for example the last whole chapter of a
+    list) with its brackets closed. `repairs` names the fixes applied. Raises
+    OutputValidationError when nothing usable can be recovered.
+    """
+    cleaned = strip_code_fences(text or "")
+    starts = [position for position in (cleaned.find('{'), cleaned.find('[')) if position >= 0]
+    if not starts:
+        raise OutputValidationError("Response contains no JSON value.")
+    cleaned = cleaned[min(starts):]
+    repairs = []
+    decoder = json.JSONDecoder()
+    try:
+        value, end = decoder.raw_decode(cleaned)
+        if cleaned[end:].strip():
+            repairs.append("extra_text")
+        return value, repairs
+    except json.JSONDecodeError:
+        pass
+
+    without_commas = _remove_trailing_commas(cleaned)
+    if without_commas != cleaned:
+        repairs.append("trailing_comma")
+        try:
+            return decoder.raw_decode(without_commas)[0], repairs
+        except json.JSONDecodeError:
+            pass
+
+    closed = _close_truncated(without_commas)
+    if closed is not None:
+        try:
+            value = decoder.raw_decode(_remove_trailing_commas(closed))[0]
+            return value, repairs + ["truncated"]
+        except json.JSONDecodeError:
+            pass
+    raise OutputValidationError("Response is not valid JSON and could not be repaired.")
+
+
+def valid_chapters(items):
+    """Chapter objects with an integer number and a non-empty summary, in ascending order without repeats."""
+    chapters = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict) or not isinstance(item.get('summary'), str) or not item['summary'].strip():
+            continue
+        try:
+            number = int(item.get('number'))
+        except (TypeError, ValueError):
+            continue
+        chapters.setdefault(number, dict(item, number=number))
+    return [chapters[number] for number in sorted(chapters)]
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def clamp_parameters(parameters):
+    """
+    Fix parameter values that are usable but out of range or of the wrong type, in place.
+
+    Targets given as strings become numbers, valence and energy are clamped to [0, 1], tempo to
+    at least 0, limit to an integer in [1, 50], and a seed given as a string becomes a list.
+    Returns the names of the fields changed.
+    """
+    if not isinstance(parameters, dict):
+        return []
+    changed = []
+    for field, low, high in (("target_valence", 0, 1), ("target_energy", 0, 1), ("target_tempo", 0, None)):
+        value = _number(parameters.get(field))
+        if value is None:
+            continue
+        fixed = max(low, value if high is None else min(high, value))
+        if fixed != parameters[field]:
+            parameters[field] = fixed
+            changed.append(field)
+    limit = _number(parameters.get('limit'))
+    if limit is not None:
+        fixed = int(max(1, min(50, round(limit))))
+        if fixed != parameters['limit'] or not isinstance(parameters['limit'], int):
+            parameters['limit'] = fixed
+            changed.append('limit')
+    for field in SEED_FIELDS:
+        if isinstance(parameters.get(field), str):
+            parameters[field] = [parameters[field]]
+            changed.append(field)
+        elif field in parameters and not parameters[field]:
+            del parameters[field]
+    return changed
+
+
+def parameter_problems(parameters):
+    """Problems with generated parameters under the recommendation API's rules, as a dict of field to message."""
+    if not isinstance(parameters, dict):
+        return {"parameters": "Must be a JSON object."}
+    problems = {}
+    for seed_type in SEED_FIELDS:
+        if seed_type in parameters and (not isinstance(parameters[seed_type], list)
+                                        or not 1 <= len(parameters[seed_type]) <= 5):
+            problems[seed_type] = "Must contain between 1 and 5 items."
+    if not problems:
+        total_seeds = sum(len(parameters.get(seed_type, [])) for seed_type in SEED_FIELDS)
+        if total_seeds == 0 or total_seeds > 5:
+            problems["seeds"] = f"Invalid total number of seeds: {total_seeds}. Must be between 1 and 5."
+
+    for feature in ['valence', 'energy']:
+        value = parameters.get(f'target_{feature}')
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            problems[f'target_{feature}'] = "Must be between 0 and 1."
+
+    tempo = parameters.get('target_tempo')
+    if isinstance(tempo, bool) or not isinstance(tempo, (int, float)) or tempo < 0:
+        problems['target_tempo'] = "Must be a non-negative number."
+
+    limit = parameters.get('limit')
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 0 < limit <= 50:
+        problems['limit'] = "Must be an integer between 1 and 50."
+    return problems
+
+
+def fields_to_fix(problems):
+    """Parameter fields to ask for again for a set of problems from parameter_problems."""
+    if "parameters" in problems:
+        return list(PARAMETER_PROPERTIES)
+    fields = []
+    for field in problems:
+        for name in (SEED_FIELDS if field == "seeds" else [field]):
+            if name not in fields:
+                fields.append(name)
+    return fields
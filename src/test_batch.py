@@ -0,0 +1,47 @@
+import json
+
+import batch
+import fake_apis
+
+
+def _write(directory, name, config):
+    path = directory / f"{name}.json"
+    path.write_text(config if isinstance(config, str) else json.dumps(config))
+    return path
+
+
+def _config(title):
+    return {"book_title": title, "user_input": "all chapters", "music_preferences": "Ambient",
+            "vocal_preference": "b", "min_instrumentalness": ""}
+
+
+def test_batch_runs_every_configuration_and_reports_each_job(spotify, fake_llm, tmp_path):
+    _write(tmp_path, "first", _config("Batch Book One"))
+    _write(tmp_path, "second", _config("Batch Book Two"))
+    _write(tmp_path, "invalid", {"book_title": "No Preferences"})
+    _write(tmp_path, "broken", "{")
+    report = batch.run_batch(spotify, [str(tmp_path)], fake_apis.GENRES, workers=2)
+
+    assert (report["total"], report["succeeded"], report["failed"]) == (4, 2, 2)
+    assert report["playlists_created"] == 10 == spotify.stats.summary()["calls"]["user_playlist_create"]
+    jobs = {job["config"].rsplit("/", 1)[-1]: job for job in report["jobs"]}
+    assert jobs["first.json"]["chapters"] == 5 and jobs["first.json"]["run_id"]
+    assert jobs["invalid.json"]["errors"][0] == "Missing key: user_input"
+    assert jobs["broken.json"]["status"] == "failed" and jobs["broken.json"]["errors"]
+    assert report["llm_usage"]["requests"] > 0
+
+
+def test_resumed_job_reuses_a_finished_run(spotify, fake_llm, tmp_path):
+    path = _write(tmp_path, "book", _config("Batch Resumed Book"))
+    first = batch.run_job(spotify, str(path), fake_apis.GENRES)
+    fake_llm.reset()
+    again = batch.run_job(spotify, str(path), fake_apis.GENRES, resume=True)
+    assert again["status"] == "succeeded" and again["playlist_urls"] == first["playlist_urls"]
+    assert sum(fake_llm.summary()["calls"].values()) == 0
+    assert spotify.stats.summary()["calls"]["user_playlist_create"] == 5
+
+
+def test_job_status():
+    assert batch.job_status([]) == "failed"
+    assert batch.job_status(["a", None]) == "partial"
+    assert batch.job_status(["a", "b"]) == "succeeded"
@@ -0,0 +1,17 @@
+import benchmark
+
+
+def test_offline_run_creates_a_playlist_per_chapter_within_call_bounds(spotify, fake_llm):
+    result = benchmark.run_book(30, spotify)
+    assert result["playlists_created"] == 30
+    assert benchmark.check_result(result) == []
+    calls = result["spotify"]["calls"]
+    assert calls["user_playlist_create"] == 30 and calls["recommendations"] <= 60
+    assert sum(result["openai"]["calls"].values()) <= 30
+
+
+def test_check_result_reports_missing_playlists_and_excess_calls():
+    result = {"chapters": 10, "playlists_created": 9,
+              "spotify": {"rate_limited": {}, "calls": {"recommendations": 25, "user_playlist_create": 9}}}
+    problems = benchmark.check_result(result)
+    assert len(problems) == 2 and "1 of 10 chapters" in problems[0] and "25 recommendations" in problems[1]
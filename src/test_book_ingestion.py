@@ -0,0 +1,100 @@
+import zipfile
+
+import pytest
+
+import book_ingestion
+from book_ingestion import EPUB_SECTION_MARK, chunk_ranges, find_sections, ingest_book, open_book, word_count
+
+
+def _chapter(number, words=200, word="word"):
+    return f"CHAPTER {number}\n\n" + " ".join([f"{word}{number}"] * words) + "\n\n"
+
+
+def test_find_sections_splits_at_headings_inside_the_gutenberg_body():
+    text = ("Licence header\n*** START OF THE PROJECT GUTENBERG EBOOK DUNE ***\nContents\n"
+            + _chapter(1, 5) + "Chapter II. The Desert\nsand sand\n"
+            + "*** END OF THE PROJECT GUTENBERG EBOOK DUNE ***\nChapter 99\nlicence footer\n").encode()
+    sections = find_sections(text)
+    assert [title for title, _, _ in sections] == ["CHAPTER 1", "Chapter II. The Desert"]
+    assert text[sections[0][1]:sections[0][2]].split() == [b"word1"] * 5
+    assert text[sections[1][1]:sections[1][2]] == b"sand sand\n"
+
+
+def test_find_sections_cuts_a_book_without_headings_into_parts(monkeypatch):
+    monkeypatch.setattr(book_ingestion, "FALLBACK_SECTION_BYTES", 100)
+    text = ("\n\n".join(["a paragraph of text"] * 20)).encode()
+    sections = find_sections(text)
+    assert [title for title, _, _ in sections][:2] == ["Part 1", "Part 2"]
+    assert sections[0][1] == 0 and sections[-1][2] == len(text)
+
+
+def test_chunk_ranges_cover_the_text_and_prefer_paragraph_breaks():
+    text = ("\n\n".join(["x" * 30] * 10)).encode()
+    ranges = list(chunk_ranges(text, 0, len(text), 70))
+    assert ranges[0] == (0, 62) and ranges[-1][1] == len(text)
+    assert all(end - start <= 70 for start, end in ranges)
+    assert all(previous[1] == following[0] for previous, following in zip(ranges, ranges[1:]))
+
+
+def test_chunk_ranges_do_not_cut_inside_a_character():
+    text = "é".encode() * 50
+    for start, end in chunk_ranges(text, 0, len(text), 7):
+        text[start:end].decode("utf-8")
+
+
+def test_word_count_can_stop_early():
+    text = b"one two\nthree four five\nsix\n"
+    assert word_count(text, 0, len(text)) == 6
+    assert word_count(text, 0, len(text), at_least=2) == 2
+
+
+def _epub(path, documents):
+    with zipfile.ZipFile(path, "w") as book:
+        book.writestr("META-INF/container.xml",
+                      '<container><rootfiles><rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+        manifest = "".join(f'<item id="d{i}" href="text/{name}"/>' for i, (name, _) in enumerate(documents))
+        # Spine in reverse manifest order, to check that reading order comes from the spine
+        spine = "".join(f'<itemref idref="d{i}"/>' for i in reversed(range(len(documents))))
+        book.writestr("OEBPS/content.opf", f"<package><manifest>{manifest}</manifest><spine>{spine}</spine></package>")
+        for name, html in documents:
+            book.writestr(f"OEBPS/text/{name}", html)
+
+
+def test_epub_sections_follow_the_spine_and_take_their_headings(tmp_path):
+    path = tmp_path / "book.epub"
+    _epub(path, [("two.xhtml", "<html><body><h1>The  Desert</h1><p>sand <b>and</b> wind</p></body></html>"),
+                 ("one.xhtml", "<html><head><style>p {}</style></head><body><p>no heading</p></body></html>")])
+    with open_book(str(path)) as (mm, heading_pattern):
+        sections = find_sections(mm, heading_pattern)
+        assert [title for title, _, _ in sections] == ["one", "The Desert"]
+        assert mm[sections[1][1]:sections[1][2]].split() == [b"The", b"Desert", b"sand", b"and", b"wind"]
+        assert EPUB_SECTION_MARK.encode() not in mm[sections[0][1]:sections[0][2]]
+
+
+def test_empty_text_file_is_rejected(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        with open_book(str(path)):
+            pass
+
+
+def test_ingest_book_summarizes_each_long_enough_chapter(tmp_path, fake_llm, monkeypatch):
+    monkeypatch.setattr(book_ingestion, "INGEST_MIN_CHAPTER_WORDS", 50)
+    path = tmp_path / "book.txt"
+    path.write_text(_chapter(1, words=100) + _chapter(2, words=10) + _chapter(3, words=600))
+    result = ingest_book(str(path), "Dune", max_workers=4, chunk_tokens=200)
+    assert result["num_chapters"] == 2 and [chapter["number"] for chapter in result["chapters"]] == [1, 2]
+    assert result["chapters"][0]["summary"].startswith("A passage of 100 words")
+    # Chapter 3 is longer than one chunk, so its chunk summaries are merged
+    assert fake_llm.summary()["calls"]["chat_completion"] > 3
+
+
+def test_ingested_chapters_hash_their_own_text(tmp_path, fake_llm, monkeypatch):
+    monkeypatch.setattr(book_ingestion, "INGEST_MIN_CHAPTER_WORDS", 50)
+    path = tmp_path / "book.txt"
+    path.write_text(_chapter(1) + _chapter(2))
+    before = [chapter["source_hash"] for chapter in ingest_book(str(path), "Dune")["chapters"]]
+    path.write_text(_chapter(1) + _chapter(2, word="edited"))
+    after = [chapter["source_hash"] for chapter in ingest_book(str(path), "Dune")["chapters"]]
+    assert before[0] == after[0] and before[1] != after[1]
@@ -0,0 +1,84 @@
+import pytest
+
+import cache_utils
+from cache_utils import SQLiteCache, normalize_query
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_utils.time, "time", clock)
+    return clock
+
+
+def test_get_set_and_miss(tmp_path):
+    cache = SQLiteCache("items", path=str(tmp_path / "cache.sqlite3"))
+    assert cache.get("a") == (False, None)
+    cache.set("a", {"id": 1})
+    assert cache.get("a") == (True, {"id": 1})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = SQLiteCache("items", path=str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set("a", "value")
+    clock.now += 59
+    assert cache.get("a") == (True, "value")
+    clock.now += 2
+    assert cache.get("a") == (False, None)
+    assert len(cache) == 0
+
+
+def test_negative_results_use_their_own_ttl(tmp_path, clock):
+    cache = SQLiteCache("items", path=str(tmp_path / "cache.sqlite3"), ttl=3600, negative_ttl=10)
+    cache.set("missing", None)
+    cache.set("found", "id")
+    assert cache.get("missing") == (True, None)
+    clock.now += 11
+    assert cache.get("missing") == (False, None)
+    assert cache.get("found") == (True, "id")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = SQLiteCache("items", path=str(tmp_path / "cache.sqlite3"), max_entries=3)
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        cache.set(key, key)
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.set("d", "d")
+    assert len(cache) == 3
+    assert cache.get("b") == (False, None)
+    assert all(cache.get(key)[0] for key in ("a", "c", "d"))
+
+
+def test_get_many_returns_hits_only_and_drops_expired(tmp_path, clock):
+    cache = SQLiteCache("items", path=str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set_many({"a": 1, "b": None})
+    clock.now += 30
+    cache.set("c", 3)
+    clock.now += 31
+    assert cache.get_many(["a", "b", "c", "d"]) == {"c": 3}
+    assert len(cache) == 1
+
+
+def test_tables_in_one_file_are_independent(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first, second = SQLiteCache("first", path=path), SQLiteCache("second", path=path)
+    first.set("key", 1)
+    assert second.get("key") == (False, None)
+    first.clear()
+    assert len(first) == 0
+
+
+def test_normalize_query():
+    assert normalize_query("  Max   RICHTER ") == "max richter"
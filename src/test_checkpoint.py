@@ -0,0 +1,122 @@
+import checkpoint
+import model_routing
+from checkpoint import RunJournal, chapter_input_hash, find_previous_run
+
+
+def _config(**overrides):
+    config = {"book_title": "Dune", "user_input": "all chapters", "music_preferences": "ambient",
+              "vocal_preference": "i", "min_instrumentalness": ""}
+    config.update(overrides)
+    return config
+
+
+def _finished_run(directory, config, chapters=({"number": 1, "summary": "Arrival"}, {"number": 2, "summary": "Desert"})):
+    journal = RunJournal.start(config, str(directory))
+    for chapter in chapters:
+        journal.record_chapter(dict(chapter))
+    journal.record_chapters_complete()
+    for chapter in chapters:
+        journal.record_playlist(chapter["number"], f"https://open.spotify.com/playlist/{chapter['number']}",
+                                [f"track-{chapter['number']}"], f"hash-{chapter['number']}")
+    journal.record_finished()
+    return journal
+
+
+def test_previous_run_is_any_earlier_run_of_the_same_book(tmp_path):
+    _finished_run(tmp_path, _config())
+    assert find_previous_run(_config(book_title=" dune "), str(tmp_path)) is not None
+    assert find_previous_run(_config(user_input="chapters 1-2"), str(tmp_path)) is not None
+    assert find_previous_run(_config(music_preferences="jazz"), str(tmp_path)) is not None
+    assert find_previous_run(_config(vocal_preference="v"), str(tmp_path)) is not None
+    assert find_previous_run(_config(book_title="Emma"), str(tmp_path)) is None
+    assert find_previous_run(_config(book_file=str(tmp_path / "dune.txt")), str(tmp_path)) is None
+
+
+def test_edited_preferences_take_over_the_playlists_of_the_latest_run(tmp_path):
+    _finished_run(tmp_path, _config())
+    journal = RunJournal.start(_config(music_preferences="jazz"), str(tmp_path))
+    assert journal.chapters_complete and set(journal.baseline) == {1, 2}
+    assert journal.baseline[1]["playlist_url"].endswith("/1")
+
+
+def test_unchanged_book_reuses_the_previous_chapters(tmp_path):
+    _finished_run(tmp_path, _config())
+    journal = RunJournal.start(_config(), str(tmp_path))
+    assert journal.chapters_complete and [chapter["summary"] for chapter in journal.chapter_list()] == ["Arrival", "Desert"]
+    assert journal.playlists == {} and set(journal.baseline) == {1, 2}
+
+
+def test_changed_user_input_extracts_chapters_again(tmp_path):
+    _finished_run(tmp_path, _config())
+    journal = RunJournal.start(_config(user_input="chapters 1-2"), str(tmp_path))
+    assert not journal.chapters_complete and journal.chapters == {} and set(journal.baseline) == {1, 2}
+
+
+def test_book_file_contents_decide_whether_chapters_are_reused(tmp_path):
+    book = tmp_path / "book.txt"
+    book.write_text("Chapter 1\nArrival\n")
+    directory = tmp_path / "checkpoints"
+    _finished_run(directory, _config(book_file=str(book)))
+    assert RunJournal.start(_config(book_file=str(book)), str(directory)).chapters_complete
+    book.write_text("Chapter 1\nArrival, revised\n")
+    assert not RunJournal.start(_config(book_file=str(book)), str(directory)).chapters_complete
+    assert checkpoint.source_digest(_config(book_file=str(tmp_path / "missing.txt"))) is None
+
+
+def test_chapter_input_hash_prefers_the_source_text_hash():
+    first = {"number": 1, "summary": "A summary", "source_hash": "abc"}
+    resummarized = dict(first, summary="Another summary of the same text")
+    assert chapter_input_hash(first, "ambient", "i", None) == chapter_input_hash(resummarized, "ambient", "i", None)
+    assert chapter_input_hash(first, "ambient", "i", None) != chapter_input_hash(dict(first, source_hash="def"), "ambient", "i", None)
+    assert chapter_input_hash({"summary": "a"}, "ambient", "i", None) != chapter_input_hash({"summary": "b"}, "ambient", "i", None)
+
+
+def test_chapter_input_hash_changes_with_the_parameter_model_routing(monkeypatch):
+    chapter = {"number": 1, "summary": "A summary"}
+    before = chapter_input_hash(chapter, "ambient", "i", None)
+    assert before == chapter_input_hash(chapter, "ambient", "i", None, checkpoint.parameter_routing())
+    monkeypatch.setitem(model_routing.TIER_MODELS, "fast", "another-fast-model")
+    assert chapter_input_hash(chapter, "ambient", "i", None) != before
+
+
+def test_reopened_journal_has_everything_recorded(tmp_path):
+    config = _config()
+    journal = RunJournal.start(config, str(tmp_path))
+    chapters = list(journal.track_chapters(iter([{"number": 1, "summary": "A"}, {"number": 2, "summary": "B"}])))
+    journal.record_parameters(1, {"seed_genres": ["ambient"]})
+    journal.record_seeds(1, {"seed_genres": ["ambient"], "seed_tracks": ["id"]})
+    journal.record_parameters(2, {"seed_genres": ["piano"]})
+    journal.record_playlist(1, "https://open.spotify.com/playlist/p1", ["k1", "k2"], "h1")
+
+    reopened = RunJournal.open(config, str(tmp_path))
+    assert reopened.config == config and reopened.chapter_list() == chapters and reopened.chapters_complete
+    assert reopened.parameters == {1: {"seed_genres": ["ambient"], "seed_tracks": ["id"]}, 2: {"seed_genres": ["piano"]}}
+    assert reopened.resolved == {1}
+    assert reopened.playlist_urls() == ["https://open.spotify.com/playlist/p1", None]
+    assert reopened.track_keys() == ["k1", "k2"] and reopened.input_hashes == {1: "h1"}
+    assert not reopened.finished
+    assert RunJournal.open(_config(book_title="Emma"), str(tmp_path)) is None
+
+
+def test_half_written_last_record_is_ignored(tmp_path):
+    journal = RunJournal.start(_config(), str(tmp_path))
+    journal.record_chapter({"number": 1, "summary": "A"})
+    with open(journal.path, "a") as f:
+        f.write('{"type": "chapter", "chapter": {"numb')
+    assert RunJournal(journal.path).chapter_list() == [{"number": 1, "summary": "A"}]
+
+
+def test_find_journal_prefers_the_latest_unfinished_run(tmp_path):
+    finished = _finished_run(tmp_path, _config())
+    unfinished = RunJournal.start(_config(book_title="Emma"), str(tmp_path))
+    assert checkpoint.find_journal(directory=str(tmp_path)).path == unfinished.path
+    assert checkpoint.find_journal(finished.run_id, str(tmp_path)).path == finished.path
+    assert checkpoint.find_journal(finished.path, str(tmp_path)).path == finished.path
+    assert checkpoint.find_journal("missing", str(tmp_path)) is None
+
+
+def test_restarting_a_run_replaces_its_journal(tmp_path):
+    journal = RunJournal.start(_config(), str(tmp_path), incremental=False)
+    journal.record_chapter({"number": 1, "summary": "A"})
+    restarted = RunJournal.start(_config(), str(tmp_path), incremental=False)
+    assert restarted.path == journal.path and RunJournal(restarted.path).chapters == {}
@@ -0,0 +1,34 @@
+from genre_index import filter_seed_genres, normalize_genre, relevant_genres, score_genres
+
+GENRES = ["acoustic", "ambient", "classical", "hip-hop", "jazz", "piano", "rainy-day", "rock", "sad", "soundtracks"]
+
+
+def test_keywords_and_preferences_score_genres():
+    scores = score_genres("A detective waits in a smoky club while storms roll in.", GENRES, "jazz please")
+    assert scores.most_common(1)[0][0] == "jazz"
+    assert scores["rainy-day"] == 1 and "classical" not in scores
+
+
+def test_genre_names_match_as_phrases():
+    assert score_genres("They listened to hip hop all night.", GENRES)["hip-hop"] >= 3
+
+
+def test_relevant_genres_puts_matches_first_and_fills_from_fallbacks():
+    chosen = relevant_genres("Grief and tears at the funeral.", GENRES, top_k=4)
+    assert chosen[0] == "sad" and len(chosen) == 4
+    assert chosen[1:] == ["soundtracks", "ambient", "classical"]
+
+
+def test_relevant_genres_returns_everything_when_not_limited():
+    assert relevant_genres("anything", GENRES, top_k=0) == GENRES
+    assert relevant_genres("anything", GENRES, top_k=len(GENRES)) == GENRES
+
+
+def test_filter_seed_genres_fixes_spelling_and_drops_unknown_genres():
+    parameters = {"seed_genres": ["Hip Hop", "hip_hop", "polka", "Jazz"]}
+    assert filter_seed_genres(parameters, GENRES) == ["polka"]
+    assert parameters == {"seed_genres": ["hip-hop", "jazz"]}
+
+    parameters = {"seed_genres": ["polka"], "seed_artists": ["x"]}
+    assert filter_seed_genres(parameters, GENRES) == ["polka"] and parameters == {"seed_artists": ["x"]}
+    assert normalize_genre("R N B") == "r-n-b"
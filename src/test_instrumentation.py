@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from instrumentation import Metrics, percentile
+
+
+@pytest.fixture
+def run_metrics(monkeypatch):
+    import instrumentation
+    fresh = Metrics()
+    monkeypatch.setattr(instrumentation, "metrics", fresh)
+    return fresh
+
+
+def test_percentile_uses_the_nearest_rank():
+    samples = list(range(1, 101))
+    assert percentile(samples, 0.5) == 50 and percentile(samples, 0.9) == 90 and percentile(samples, 0.99) == 99
+    assert percentile(samples, 0.07) == 7 and percentile([2, 1], 0.5) == 1 and percentile([3], 0.99) == 3
+
+
+def test_timed_functions_and_spans_are_recorded(run_metrics):
+    from instrumentation import span, timed
+
+    @timed("stage")
+    def work():
+        return "done"
+
+    assert work() == "done" and work() == "done"
+    with pytest.raises(ValueError):
+        with span("failing"):
+            raise ValueError()
+    report = run_metrics.report()
+    assert report["spans"]["stage"]["count"] == 2 and report["spans"]["failing"]["count"] == 1
+
+
+def test_counters_are_kept_per_label_set(run_metrics):
+    from instrumentation import increment, record_llm_usage
+    increment("api_calls_total", api="spotify", operation="search")
+    increment("api_calls_total", api="spotify", operation="search")
+    increment("api_calls_total", operation="me", api="spotify")
+    record_llm_usage("extract", 100, 20, cost=0.5)
+    counters = run_metrics.report()["counters"]
+    assert counters["api_calls_total"] == [{"labels": {"api": "spotify", "operation": "me"}, "value": 1},
+                                           {"labels": {"api": "spotify", "operation": "search"}, "value": 2}]
+    assert counters["llm_cost_usd_total"] == [{"labels": {"operation": "extract"}, "value": 0.5}]
+
+
+def test_reports_are_exported_as_json_and_prometheus_text(run_metrics, tmp_path):
+    from instrumentation import export_reports
+    run_metrics.record_span("recommendations", 0.25)
+    run_metrics.increment("cache_hits_total", cache="seeds")
+    export_reports(str(tmp_path / "report.json"), str(tmp_path / "metrics.prom"))
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["spans"]["recommendations"]["p50"] == 0.25
+    text = (tmp_path / "metrics.prom").read_text()
+    assert 'book_playlist_span_seconds{span="recommendations",quantile="0.9"} 0.25' in text
+    assert 'book_playlist_span_seconds_count{span="recommendations"} 1' in text
+    assert 'book_playlist_cache_hits_total{cache="seeds"} 1' in text
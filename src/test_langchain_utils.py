@@ -0,0 +1,117 @@
+import fake_apis
+import langchain_utils
+
+
+def _llm_calls(stats):
+    return sum(stats.summary()["calls"].values())
+
+
+def test_llm_cache_key_covers_model_template_inputs_and_temperature():
+    key = langchain_utils.llm_cache_key("model", "template {x}", {"x": 1}, 0.7)
+    assert key == langchain_utils.llm_cache_key("model", "template {x}", {"x": 1}, 0.7)
+    for changed in (("other", "template {x}", {"x": 1}, 0.7), ("model", "other {x}", {"x": 1}, 0.7),
+                    ("model", "template {x}", {"x": 2}, 0.7), ("model", "template {x}", {"x": 1}, 0.2)):
+        assert langchain_utils.llm_cache_key(*changed) != key
+
+
+def test_cached_parameters_are_reused(fake_llm):
+    arguments = ("Dune", "Paul arrives on Arrakis.", "Ambient", fake_apis.GENRES)
+    first = langchain_utils.generate_spotify_parameters(*arguments, cache_mode="use")
+    calls = _llm_calls(fake_llm)
+    assert first and calls == 1
+    assert langchain_utils.generate_spotify_parameters(*arguments, cache_mode="use") == first
+    assert _llm_calls(fake_llm) == calls
+
+
+def test_refresh_mode_bypasses_the_cache(fake_llm):
+    arguments = ("Dune", "Paul arrives on Arrakis.", "Ambient", fake_apis.GENRES)
+    langchain_utils.generate_spotify_parameters(*arguments, cache_mode="use")
+    langchain_utils.generate_spotify_parameters(*arguments, cache_mode="refresh")
+    assert _llm_calls(fake_llm) == 2
+
+
+def test_off_mode_stores_nothing(fake_llm):
+    arguments = ("Dune", "Paul arrives on Arrakis.", "Ambient", fake_apis.GENRES)
+    langchain_utils.generate_spotify_parameters(*arguments, cache_mode="off")
+    assert len(langchain_utils.get_llm_cache()) == 0
+
+
+def _chapters(count):
+    return [{"number": number, "summary": fake_apis._chapter_summary(number)} for number in range(1, count + 1)]
+
+
+def test_parse_parameter_batch_maps_by_number_or_position():
+    chapters = _chapters(3)
+    parsed = {"parameters": [{"chapter": 3, "limit": 3}, {"limit": 2}, "not an object"]}
+    assert langchain_utils._parse_parameter_batch(parsed, chapters) == [None, {"limit": 2}, {"limit": 3}]
+
+
+def test_parse_parameter_batch_coerces_chapter_numbers():
+    chapters = _chapters(3)
+    parsed = [{"chapter": "3", "limit": 3}, {"chapter": "two", "limit": 2}, {"chapter": 1.0, "limit": 1}]
+    assert langchain_utils._parse_parameter_batch(parsed, chapters) == [{"limit": 1}, {"limit": 2}, {"limit": 3}]
+
+
+def test_parameter_batch_size_respects_context_window():
+    chapters = _chapters(4)
+    assert langchain_utils.parameter_batch_size(chapters, "prompt", max_batch_size=10) == 10
+    assert langchain_utils.parameter_batch_size(chapters, "prompt", max_batch_size=10, context_window=16384 + 60,
+                                                max_output_tokens=16384) == 2
+    assert langchain_utils.parameter_batch_size(chapters, "prompt", max_batch_size=10, max_output_tokens=400) == 2
+
+
+def test_batch_generates_parameters_for_every_chapter_in_one_request(fake_llm):
+    chapters = _chapters(4)
+    parameters = langchain_utils.generate_spotify_parameters_batch("Dune", chapters, "Ambient", fake_apis.GENRES,
+                                                                   cache_mode="off")
+    assert _llm_calls(fake_llm) == 1
+    assert len(parameters) == 4 and all(parameters)
+    for item in parameters:
+        assert 0 <= item["target_valence"] <= 1 and set(item["seed_genres"]) <= set(fake_apis.GENRES)
+        seeds = sum(len(item.get(seed_type, [])) for seed_type in ("seed_genres", "seed_tracks", "seed_artists"))
+        assert 1 <= seeds <= 5
+
+
+def _feed_in_pieces(parser, text, size):
+    chapters = []
+    for start in range(0, len(text), size):
+        chapters.extend(parser.feed(text[start:start + size]))
+    return chapters
+
+
+def test_stream_parser_yields_chapters_as_their_objects_close():
+    text = ('{"num_chapters": 3, "chapters": [{"number": 1, "summary": "A {brace} and a \\"quote\\""}, '
+            '{"number": 2, "summary": "Two"}, {"number": 3, "summary": "Three"}]}')
+    parser = langchain_utils.ChapterStreamParser()
+    chapters = _feed_in_pieces(parser, text, 7)
+    assert [chapter["number"] for chapter in chapters] == [1, 2, 3]
+    assert chapters[0]["summary"] == 'A {brace} and a "quote"'
+    assert parser.complete and parser.num_chapters == 3
+
+
+def test_stream_parser_keeps_complete_chapters_of_a_truncated_response():
+    text = '{"num_chapters": 3, "chapters": [{"number": 1, "summary": "One"}, {"number": 2, "summ'
+    parser = langchain_utils.ChapterStreamParser()
+    assert [chapter["number"] for chapter in _feed_in_pieces(parser, text, 5)] == [1]
+    assert not parser.complete and parser.num_chapters == 3
+
+
+def test_stream_parser_waits_for_the_chapters_array():
+    parser = langchain_utils.ChapterStreamParser()
+    assert parser.feed('{"num_chapters": 2, "chap') == []
+    assert parser.feed('ters": [{"number": 1, "summary": "One"}') == [{"number": 1, "summary": "One"}]
+
+
+def test_stream_chapter_info_continues_a_truncated_list(fake_llm, monkeypatch):
+    monkeypatch.setitem(fake_apis.llm_settings, "num_chapters", 30)
+    chapters = list(langchain_utils.stream_chapter_info("Dune", "All chapters.", max_tokens=300, cache_mode="off"))
+    assert [chapter["number"] for chapter in chapters] == list(range(1, 31))
+    assert fake_llm.summary()["calls"]["chat_completion_stream"] > 1
+
+
+def test_extract_chapter_info_continues_a_truncated_list(fake_llm, monkeypatch):
+    monkeypatch.setitem(fake_apis.llm_settings, "num_chapters", 30)
+    chapter_info = langchain_utils.extract_chapter_info("Dune", "All chapters.", initial_tokens=400, cache_mode="off")
+    assert chapter_info["num_chapters"] == 30
+    assert [chapter["number"] for chapter in chapter_info["chapters"]] == list(range(1, 31))
+    assert fake_llm.summary()["calls"]["chat_completion"] > 1
@@ -0,0 +1,51 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import main
+import playlist_config
+
+HEAVY_MODULES = ["langchain_core", "langchain_openai", "openai", "spotipy", "tenacity", "numpy"]
+
+
+def test_importing_main_loads_no_heavy_modules():
+    code = f"import sys, main; print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(main.__file__),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(playlist_config, "CONFIG_DIR", str(tmp_path / "no-legacy-configs"))
+    store = playlist_config.ConfigStore(str(tmp_path / "configs.sqlite3"))
+    monkeypatch.setattr(playlist_config, "_config_store", store)
+    return store
+
+
+def _config(title):
+    return {"book_title": title, "user_input": "", "music_preferences": "ambient", "vocal_preference": "b",
+            "min_instrumentalness": ""}
+
+
+def test_list_pages_through_saved_configurations(store, capsys):
+    store.save_many({f"book-{number}": _config(f"Title {number}") for number in range(3)})
+    main.main(["list", "book", "--limit", "2"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["book-0 - Title 0", "book-1 - Title 1", "Showing 1-2 of 3; use --offset to see more."]
+
+
+def test_validate_reports_each_configuration_and_fails_on_problems(store, tmp_path, capsys):
+    store.save("dune", _config("Dune"))
+    (tmp_path / "bad.json").write_text(json.dumps({"book_title": "Bad", "vocal_preference": "x"}))
+    main.main(["validate", "dune"])
+    assert capsys.readouterr().out == "dune: ok\n"
+    with pytest.raises(SystemExit) as exit_info:
+        main.main(["validate", "dune", str(tmp_path / "bad.json"), "missing"])
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    assert f"{tmp_path / 'bad.json'}: invalid" in out and "  - Missing key: user_input" in out
+    assert "missing: invalid" in out
@@ -0,0 +1,40 @@
+import pytest
+
+import model_routing
+from model_routing import BudgetExceeded, check_budgets, escalate, llm_budget, record_usage, route
+
+
+def test_route_starts_operations_on_their_tier(monkeypatch):
+    monkeypatch.setattr(model_routing, "MODEL_ROUTING_LARGE_PROMPT_TOKENS", 1000)
+    assert route("generate_spotify_parameters") == "fast"
+    assert route("extract_chapter_info") == "standard"
+    assert route("unknown_operation") == "standard"
+    assert route("generate_spotify_parameters", prompt_tokens=1001) == "standard"
+    monkeypatch.setattr(model_routing, "MODEL_ROUTING_LARGE_PROMPT_TOKENS", 0)
+    assert route("generate_spotify_parameters", prompt_tokens=10 ** 6) == "fast"
+
+
+def test_escalate_skips_tiers_with_the_same_model(monkeypatch):
+    monkeypatch.setattr(model_routing, "TIER_MODELS", {"fast": "mini", "standard": "mini", "strong": "large"})
+    assert escalate("fast") == "strong" and escalate("strong") is None
+    monkeypatch.setattr(model_routing, "TIER_MODELS", {"fast": "mini", "standard": "large", "strong": "large"})
+    assert escalate("fast") == "standard" and escalate("standard") is None
+
+
+def test_token_budget_refuses_requests_once_used_up():
+    with llm_budget("run", max_tokens=100) as budget:
+        check_budgets(prompt_tokens=60)
+        record_usage("generate_spotify_parameters", "mini", 60, 30)
+        assert budget.summary()["tokens"] == 90 and budget.summary()["requests"] == 1
+        with pytest.raises(BudgetExceeded):
+            check_budgets(prompt_tokens=20)
+    check_budgets(prompt_tokens=10 ** 6)
+
+
+def test_cost_budget_and_nested_budgets():
+    with llm_budget("batch", max_cost=0.01) as outer:
+        with llm_budget("run") as inner:
+            record_usage("extract_chapter_info", "large", 10, 10, cost=0.02)
+            with pytest.raises(BudgetExceeded, match="batch"):
+                check_budgets()
+        assert inner.summary()["cost"] == outer.summary()["cost"] == 0.02
@@ -0,0 +1,156 @@
+import logging
+import random
+import threading
+import time
+
+import spotipy
+
+import fake_apis
+import pipeline
+import spotify_utils
+from checkpoint import RunJournal
+from track_index import track_key
+
+
+def _chapter_step(number):
+    time.sleep(random.random() * 0.02)
+    print(f"chapter {number} output")
+    logging.warning(f"chapter {number} log")
+    return number * 10
+
+
+def test_run_ordered_returns_results_in_argument_order():
+    results = pipeline.run_ordered(_chapter_step, [(number,) for number in range(1, 21)], max_workers=8)
+    assert results == [number * 10 for number in range(1, 21)]
+
+
+def test_run_ordered_replays_output_in_chapter_order(capsys):
+    pipeline.run_ordered(_chapter_step, [(number,) for number in range(1, 11)], max_workers=8)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [f"chapter {number} output" for number in range(1, 11)]
+
+
+def test_run_ordered_limits_concurrency():
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def step(number):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        return number
+
+    pipeline.run_ordered(step, [(number,) for number in range(12)], max_workers=3)
+    assert peak[0] <= 3
+
+
+def test_run_ordered_turns_worker_errors_into_none():
+    def step(number):
+        if number == 2:
+            raise RuntimeError("boom")
+        return number
+
+    assert pipeline.run_ordered(step, [(1,), (2,), (3,)], max_workers=2) == [1, None, 3]
+
+
+def _parameters(**overrides):
+    parameters = {"seed_genres": ["ambient"], "target_valence": 0.3, "target_energy": 0.4, "target_tempo": 100,
+                  "limit": 10, "vocal_preference": "b"}
+    parameters.update(overrides)
+    return parameters
+
+
+def test_curate_tracks_replaces_duplicates_from_spare_candidates(spotify):
+    tracks = spotify_utils.get_spotify_recommendations(spotify, _parameters(), seeds_resolved=True, spare=5)
+    seen = {track_key(track) for track in tracks[:3]}
+    chosen = pipeline.curate_tracks(spotify, {"number": 2}, _parameters(), tracks, seen)
+    assert len(chosen) == 10 and not seen - {track_key(track) for track in tracks[:3] + chosen}
+    assert spotify.stats.summary()["calls"]["recommendations"] == 1
+
+
+def test_curate_tracks_fetches_more_when_duplicates_leave_too_few(spotify):
+    tracks = spotify_utils.get_spotify_recommendations(spotify, _parameters(), seeds_resolved=True)
+    seen = {track_key(track) for track in tracks}
+    used = set(seen)
+    chosen = pipeline.curate_tracks(spotify, {"number": 2}, _parameters(), tracks, seen)
+    assert len(chosen) == 10
+    assert not used & {track_key(track) for track in chosen}
+    assert seen == used | {track_key(track) for track in chosen}
+
+
+def test_curate_tracks_reports_a_chapter_left_without_tracks(spotify, monkeypatch, caplog):
+    monkeypatch.setattr(pipeline, "get_spotify_recommendations", lambda *args, **kwargs: [])
+    tracks = spotify_utils.get_spotify_recommendations(spotify, _parameters(), seeds_resolved=True)
+    seen = {track_key(track) for track in tracks}
+    assert pipeline.curate_tracks(spotify, {"number": 7}, _parameters(), tracks, seen) == []
+    assert any(record.levelname == "ERROR" and "Chapter 7" in record.getMessage() for record in caplog.records)
+
+
+def test_failed_track_add_is_retried_without_creating_another_playlist(spotify, monkeypatch):
+    add_items = spotify.playlist_add_items
+    failures = []
+
+    def flaky_add_items(playlist_id, items, position=None):
+        if not failures:
+            failures.append(playlist_id)
+            raise spotipy.exceptions.SpotifyException(502, -1, "playlist_add_items: bad gateway")
+        return add_items(playlist_id, items, position)
+
+    monkeypatch.setattr(spotify, "playlist_add_items", flaky_add_items)
+    tracks = [fake_apis.fake_track(number) for number in range(10)]
+    url = pipeline.create_chapter_playlist(spotify, "Dune", {"number": 1}, _parameters(), tracks)
+    assert url.endswith(failures[0])
+    assert spotify.stats.summary()["calls"]["user_playlist_create"] == 1
+    assert spotify._playlists[failures[0]]["items"] == [track["uri"] for track in tracks]
+
+
+def test_rerunning_a_book_updates_its_playlists_in_place(spotify, fake_llm, tmp_path):
+    config = {"book_title": "Dune", "user_input": "all chapters", "music_preferences": "Ambient",
+              "vocal_preference": "b", "min_instrumentalness": ""}
+    first = pipeline.generate_book_playlists(spotify, config, fake_apis.GENRES, RunJournal.start(config, str(tmp_path)))
+    assert len(first) == 5 and all(first)
+
+    fake_llm.reset()
+    again = pipeline.generate_book_playlists(spotify, config, fake_apis.GENRES, RunJournal.start(config, str(tmp_path)))
+    assert again == first and sum(fake_llm.summary()["calls"].values()) == 0
+    assert spotify.stats.summary()["calls"]["user_playlist_create"] == 5
+
+    jazz = dict(config, music_preferences="Jazz")
+    edited = pipeline.generate_book_playlists(spotify, jazz, fake_apis.GENRES, RunJournal.start(jazz, str(tmp_path)))
+    assert edited == first
+    calls = spotify.stats.summary()["calls"]
+    assert calls["user_playlist_create"] == 5 and calls["playlist_replace_items"] == 5
+
+
+def test_editing_one_chapter_of_user_input_updates_only_its_playlist(spotify, fake_llm, tmp_path, monkeypatch):
+    config = {"book_title": "Dune", "user_input": "all chapters", "music_preferences": "Ambient",
+              "vocal_preference": "b", "min_instrumentalness": ""}
+    first = pipeline.generate_book_playlists(spotify, config, fake_apis.GENRES, RunJournal.start(config, str(tmp_path)))
+
+    # The new user_input is extracted again; only chapter 3 comes back with a different summary
+    summary = fake_apis._chapter_summary
+    monkeypatch.setattr(fake_apis, "_chapter_summary",
+                        lambda number: summary(number) + (" The storm breaks." if number == 3 else ""))
+    edited = dict(config, user_input="all chapters; in chapter 3 the storm breaks")
+    again = pipeline.generate_book_playlists(spotify, edited, fake_apis.GENRES, RunJournal.start(edited, str(tmp_path)))
+    assert again == first
+    calls = spotify.stats.summary()["calls"]
+    assert calls["user_playlist_create"] == 5 and calls["playlist_replace_items"] == 1
+
+
+def test_resumed_run_only_processes_chapters_without_a_playlist(spotify, fake_llm, tmp_path):
+    config = {"book_title": "Dune", "user_input": "all chapters", "music_preferences": "Ambient",
+              "vocal_preference": "b", "min_instrumentalness": ""}
+    journal = RunJournal.start(config, str(tmp_path))
+    chapters = [{"number": number, "summary": f"Chapter {number} happens."} for number in range(1, 6)]
+    list(journal.track_chapters(iter(chapters)))
+    for number in (1, 2):
+        journal.record_playlist(number, f"https://open.spotify.com/playlist/p{number}", [f"key-{number}"])
+
+    urls = pipeline.generate_book_playlists(spotify, config, fake_apis.GENRES, RunJournal.open(config, str(tmp_path)))
+    assert urls[:2] == ["https://open.spotify.com/playlist/p1", "https://open.spotify.com/playlist/p2"] and all(urls)
+    assert spotify.stats.summary()["calls"]["user_playlist_create"] == 3
+    assert "chat_completion_stream" not in fake_llm.summary()["calls"]
+    assert RunJournal.open(config, str(tmp_path)).finished
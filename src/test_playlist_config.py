@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import playlist_config
+from playlist_config import ConfigStore, validate_config
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(playlist_config, "CONFIG_DIR", str(tmp_path / "no-legacy-configs"))
+    return ConfigStore(str(tmp_path / "configs.sqlite3"))
+
+
+def _config(title="Dune", **overrides):
+    config = {"book_title": title, "user_input": "", "music_preferences": "ambient", "vocal_preference": "i",
+              "min_instrumentalness": ""}
+    config.update(overrides)
+    return config
+
+
+def test_saved_configurations_are_found_by_name_or_title(store):
+    store.save("dune", _config())
+    store.save("emma-jazz", _config("Emma"))
+    assert store.get("dune") == _config() and store.get("DUNE") is None
+    assert store.find("DUNE") == ("dune", _config())
+    assert store.find("emma") == ("emma-jazz", _config("Emma"))
+    assert store.find("nothing") is None
+
+
+def test_search_pages_through_prefix_matches(store):
+    store.save_many({f"book-{number:02}": _config(f"Title {number}") for number in range(25)})
+    store.save("other", _config("Book of Other Things"))
+    assert store.count() == 26 and store.count("BOOK") == 26 and store.count("book-1") == 10
+    page = store.search("book", limit=10, offset=20)
+    assert [summary["name"] for summary in page] == ["book-20", "book-21", "book-22", "book-23", "book-24", "other"]
+
+
+def test_saving_again_keeps_the_run_history(store):
+    store.save("dune", _config())
+    store.record_run("dune", 22, "finished")
+    store.save("dune", _config(music_preferences="jazz"))
+    summary = store.search("dune")[0]
+    assert summary["chapter_count"] == 22 and summary["last_status"] == "finished"
+    assert store.get("dune")["music_preferences"] == "jazz"
+    assert store.delete("dune") and not store.delete("dune")
+
+
+def test_json_files_are_imported_and_exported(store, tmp_path):
+    directory = tmp_path / "json"
+    directory.mkdir()
+    (directory / "dune.json").write_text(json.dumps(_config()))
+    (directory / "broken.json").write_text("{")
+    assert store.import_json([str(directory)]) == 1 and store.names() == ["dune"]
+    assert store.export_json(str(tmp_path / "out")) == 1
+    assert json.loads((tmp_path / "out" / "dune.json").read_text()) == _config()
+
+
+def test_validate_config_reports_each_problem(tmp_path):
+    assert validate_config(_config()) == []
+    assert validate_config([]) == ["Configuration must be a JSON object."]
+    problems = validate_config({"book_title": "Dune", "vocal_preference": "x", "min_instrumentalness": "lots",
+                                "book_file": str(tmp_path / "missing.txt")})
+    assert len(problems) == 5 and "vocal_preference must be 'v', 'i' or 'b'." in problems
+    assert validate_config(_config(min_instrumentalness="1.5")) == ["min_instrumentalness must be between 0 and 1."]
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+import spotipy
+
+import spotify_utils
+from rate_limiter import TokenBucket
+
+
+def test_burst_is_served_without_waiting():
+    bucket = TokenBucket(rate=1, capacity=5)
+    assert sum(bucket.acquire("search") for _ in range(5)) == 0
+
+
+def test_calls_past_the_burst_wait_for_refill():
+    bucket = TokenBucket(rate=50, capacity=1)
+    bucket.acquire()
+    started = time.monotonic()
+    waited = bucket.acquire()
+    assert waited > 0 and time.monotonic() - started >= 0.015
+
+
+def test_zero_rate_means_no_limit():
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert sum(bucket.acquire() for _ in range(100)) == 0
+    bucket.backoff(0.05, "search")
+    assert bucket.rate == 0
+    assert bucket.acquire() > 0
+    assert bucket.stats()["search"]["rate_limited"] == 1
+
+
+def test_backoff_halves_the_rate_and_success_restores_it():
+    bucket = TokenBucket(rate=8, capacity=8, min_rate=1)
+    bucket.backoff(0, "recommendations")
+    assert bucket.rate == 4
+    for _ in range(20):
+        bucket.record_success()
+    assert bucket.rate == 8
+
+
+def test_backoff_pauses_every_caller():
+    bucket = TokenBucket(rate=1000, capacity=1000)
+    bucket.backoff(0.05)
+    assert bucket.acquire() >= 0.04
+
+
+def test_stats_count_calls_per_endpoint():
+    bucket = TokenBucket(rate=0, capacity=1)
+    bucket.acquire("search")
+    bucket.acquire("search")
+    bucket.acquire("me")
+    stats = bucket.stats()
+    assert stats["search"]["calls"] == 2 and stats["me"]["calls"] == 1
+
+
+def test_spotify_call_retries_after_a_429(monkeypatch):
+    bucket = TokenBucket(rate=0, capacity=1)
+    monkeypatch.setattr(spotify_utils, "spotify_rate_limiter", bucket)
+    responses = [spotipy.exceptions.SpotifyException(429, -1, "slow down", headers={"Retry-After": "0"}), {"ok": True}]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert spotify_utils.spotify_call("search", call) == {"ok": True}
+    assert bucket.stats()["search"] == {"calls": 2, "rate_limited": 1, "wait_seconds": 0.0}
+
+
+def test_spotify_call_does_not_retry_other_errors(monkeypatch):
+    monkeypatch.setattr(spotify_utils, "spotify_rate_limiter", TokenBucket(rate=0, capacity=1))
+
+    def call():
+        raise spotipy.exceptions.SpotifyException(404, -1, "not found")
+
+    with pytest.raises(spotipy.exceptions.SpotifyException):
+        spotify_utils.spotify_call("search", call)
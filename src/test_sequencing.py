@@ -0,0 +1,42 @@
+from fake_apis import fake_audio_features, fake_track
+from sequencing import deduplicate_tracks, order_smoothly
+from track_index import TEMPO_SCALE, track_key
+
+
+def test_deduplicate_tracks_backfills_dropped_duplicates():
+    tracks = [fake_track(number) for number in range(8)]
+    seen = {track_key(tracks[1]), track_key(tracks[3])}
+    chosen = deduplicate_tracks(tracks, seen, 4)
+    assert [track["id"] for track in chosen] == [tracks[number]["id"] for number in (0, 2, 4, 5)]
+    assert {track_key(track) for track in chosen} <= seen
+
+
+def test_deduplicate_tracks_matches_re_releases_by_name_and_artist():
+    original = fake_track(0)
+    re_release = dict(original, id="other-id", name=original["name"].upper() + " ")
+    assert deduplicate_tracks([original, re_release], set(), 2) == [original]
+
+
+def test_order_smoothly_starts_calm_and_takes_small_steps():
+    tracks = [fake_track(number) for number in range(30)]
+    features = {track["id"]: fake_audio_features(track["id"]) for track in tracks}
+    ordered = order_smoothly(tracks, features)
+    assert sorted(track["id"] for track in ordered) == sorted(track["id"] for track in tracks)
+
+    def point(track):
+        return features[track["id"]]["energy"], features[track["id"]]["tempo"] / TEMPO_SCALE
+
+    def length(sequence):
+        return sum(((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+                   for a, b in zip(map(point, sequence), map(point, sequence[1:])))
+
+    assert ordered[0] == min(tracks, key=lambda track: sum(point(track)))
+    assert length(ordered) < length(tracks)
+
+
+def test_order_smoothly_puts_tracks_without_features_last():
+    tracks = [fake_track(number) for number in range(6)]
+    features = {track["id"]: fake_audio_features(track["id"]) for track in tracks[2:]}
+    ordered = order_smoothly(tracks, features)
+    assert ordered[-2:] == tracks[:2]
+    assert order_smoothly(tracks[:4], {tracks[3]["id"]: features[tracks[3]["id"]]}) == [tracks[3]] + tracks[:3]
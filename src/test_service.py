@@ -0,0 +1,102 @@
+import http.client
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import service
+
+
+def _config(title):
+    return {"book_title": title, "user_input": "all chapters", "music_preferences": "Ambient",
+            "vocal_preference": "b", "min_instrumentalness": ""}
+
+
+@pytest.fixture
+def server(spotify, fake_llm):
+    server = service.create_server(spotify, "127.0.0.1", 0, workers=2, max_queued=4)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.manager.shutdown()
+    server.server_close()
+
+
+def _request(server, method, path, body=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            payload = response.read()
+            return response.status, json.loads(payload) if response.headers["Content-Type"] == "application/json" else payload
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_submitted_job_runs_to_completion(server):
+    status, job = _request(server, "POST", "/jobs", {"config": _config("Service Book")})
+    assert status == 202 and job["status"] == service.QUEUED
+
+    deadline = time.time() + 30
+    while job["status"] in (service.QUEUED, service.RUNNING) and time.time() < deadline:
+        time.sleep(0.05)
+        status, job = _request(server, "GET", f"/jobs/{job['id']}")
+    assert job["status"] == "succeeded" and len(job["result"]["playlist_urls"]) == 5
+    assert _request(server, "GET", "/health")[1]["jobs"] == {"succeeded": 1}
+    assert [listed["id"] for listed in _request(server, "GET", "/jobs")[1]["jobs"]] == [job["id"]]
+    assert b"book_playlist_" in _request(server, "GET", "/metrics")[1]
+
+
+def test_bad_requests_are_rejected(server):
+    assert _request(server, "POST", "/jobs", {"nothing": 1})[0] == 400
+    assert _request(server, "POST", "/jobs", {"config": "no such saved configuration"})[0] == 400
+    assert _request(server, "POST", "/jobs", {"config": dict(_config("Dune"), book_file="/etc/passwd")})[0] == 400
+    assert _request(server, "POST", "/jobs", {"config": {"book_title": "Dune"}})[0] == 400
+    assert _request(server, "GET", "/jobs/unknown")[0] == 404
+    assert _request(server, "POST", "/elsewhere", {})[0] == 404
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_invalid_content_length_is_rejected(server, length):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+    try:
+        connection.putrequest("POST", "/jobs")
+        connection.putheader("Content-Length", length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400 and "Content-Length" in json.loads(response.read())["error"]
+    finally:
+        connection.close()
+
+
+def test_job_manager_refuses_duplicate_runs_and_a_full_queue(spotify, monkeypatch):
+    release = threading.Event()
+
+    def run_config_job(*args, **kwargs):
+        release.wait(10)
+        return {"status": "succeeded", "playlist_urls": [], "errors": []}
+
+    monkeypatch.setattr(service, "run_config_job", run_config_job)
+    manager = service.JobManager(spotify, workers=1, max_queued=1)
+    try:
+        manager.submit(_config("Running"))
+        with pytest.raises(service.JobConflict):
+            manager.submit(_config("Running"))
+        deadline = time.time() + 5
+        while manager.counts().get(service.RUNNING) != 1 and time.time() < deadline:
+            time.sleep(0.01)
+        manager.submit(_config("Queued"))
+        with pytest.raises(service.ServiceBusy):
+            manager.submit(_config("Refused"))
+        release.set()
+        deadline = time.time() + 5
+        while manager.counts() != {"succeeded": 2} and time.time() < deadline:
+            time.sleep(0.01)
+        assert manager.counts() == {"succeeded": 2}
+    finally:
+        release.set()
+        manager.shutdown()
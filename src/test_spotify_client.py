@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from spotipy.exceptions import SpotifyException
+
+import spotify_client
+from spotify_client import AsyncSpotify
+
+
+class FakeAuthManager:
+    """Token source with spotipy's cache_handler / refresh_access_token interface; each refresh issues a new token."""
+
+    def __init__(self):
+        self.refreshes = 0
+        self.token_info = {"access_token": "token-0", "refresh_token": "refresh", "expires_at": time.time() + 3600}
+        self.cache_handler = self
+
+    def get_cached_token(self):
+        return self.token_info
+
+    def refresh_access_token(self, refresh_token):
+        self.refreshes += 1
+        self.token_info = dict(self.token_info, access_token=f"token-{self.refreshes}", expires_at=time.time() + 3600)
+        return self.token_info
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(spotify_client.asyncio, "sleep", sleep)
+    return delays
+
+
+def _call(responses, retries=2, method="me"):
+    """Run one client call against a transport answering with `responses` in turn; returns (result, requests, auth)."""
+    requests, auth = [], FakeAuthManager()
+
+    def handler(request):
+        requests.append(request)
+        response = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def run():
+        client = AsyncSpotify(auth, retries=retries, transport=httpx.MockTransport(handler))
+        try:
+            return await getattr(client, method)()
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), requests, auth
+
+
+def test_request_returns_the_json_body():
+    result, requests, _ = _call([httpx.Response(200, json={"id": "user"})])
+    assert result == {"id": "user"}
+    assert requests[0].headers["Authorization"] == "Bearer token-0"
+
+
+def test_unauthorized_request_is_retried_once_with_a_refreshed_token_even_without_retries():
+    result, requests, auth = _call([httpx.Response(401), httpx.Response(200, json={"id": "user"})], retries=0)
+    assert result == {"id": "user"} and auth.refreshes == 1
+    assert requests[-1].headers["Authorization"] == "Bearer token-1"
+
+
+def test_repeated_unauthorized_response_is_raised():
+    with pytest.raises(SpotifyException) as error:
+        _call([httpx.Response(401, json={"error": {"message": "revoked"}})], retries=0)
+    assert error.value.http_status == 401 and "revoked" in error.value.msg
+
+
+def test_rate_limited_response_is_raised_with_its_headers():
+    with pytest.raises(SpotifyException) as error:
+        _call([httpx.Response(429, headers={"Retry-After": "7"})])
+    assert error.value.http_status == 429 and error.value.headers["retry-after"] == "7"
+
+
+def test_server_errors_are_retried_with_backoff(no_backoff):
+    result, requests, _ = _call([httpx.Response(503), httpx.Response(502), httpx.Response(200, json={"id": "user"})])
+    assert result == {"id": "user"} and len(requests) == 3 and no_backoff == [1, 2]
+    with pytest.raises(SpotifyException):
+        _call([httpx.Response(500)], retries=1)
+
+
+def test_transport_errors_become_connection_errors():
+    result, requests, _ = _call([httpx.ConnectError("down"), httpx.Response(200, json={})], retries=1)
+    assert result == {} and len(requests) == 2
+    with pytest.raises(ConnectionError):
+        _call([httpx.ConnectError("down")], retries=1)
+
+
+def test_empty_body_returns_none():
+    result, _, _ = _call([httpx.Response(201)], method="me")
+    assert result is None
+
+
+def test_ids_are_taken_from_uris_and_urls_of_the_expected_kind():
+    assert spotify_client._get_id("track", "abc") == "abc"
+    assert spotify_client._get_id("track", "spotify:track:abc") == "abc"
+    assert spotify_client._get_id("playlist", "https://open.spotify.com/playlist/abc?si=x") == "abc"
+    assert spotify_client._get_uri("track", "abc") == "spotify:track:abc"
+    with pytest.raises(SpotifyException):
+        spotify_client._get_id("track", "spotify:artist:abc")
+    with pytest.raises(SpotifyException):
+        spotify_client._get_id("playlist", "https://open.spotify.com/album/abc")
@@ -0,0 +1,186 @@
+import pytest
+
+import fake_apis
+import spotify_utils
+from track_index import track_key
+
+
+def test_search_track_caches_ids(spotify):
+    track_id = spotify_utils.search_track(spotify, "Nuvole Bianche")
+    assert track_id
+    assert spotify_utils.search_track(spotify, "  nuvole   BIANCHE ") == track_id
+    assert spotify.stats.summary()["calls"] == {"search": 1}
+
+
+def test_search_caches_misses(spotify):
+    spotify.miss_probability = 1.0
+    assert spotify_utils.search_artist(spotify, "Nobody At All") is None
+    assert spotify_utils.search_artist(spotify, "Nobody At All") is None
+    assert spotify.stats.summary()["calls"] == {"search": 1}
+
+
+def test_resolve_seeds_searches_each_unique_name_once(spotify):
+    parameters_list = [
+        {"seed_tracks": ["Saman - Olafur Arnalds"], "seed_artists": ["Max Richter", "Nils Frahm"]},
+        None,
+        {"seed_tracks": ["saman - olafur arnalds"], "seed_artists": ["MAX RICHTER"]},
+    ]
+    spotify_utils.resolve_seeds(spotify, parameters_list, max_workers=4)
+    assert spotify.stats.summary()["calls"] == {"search": 3}
+    first, _, second = parameters_list
+    assert second["seed_tracks"] == first["seed_tracks"] and len(first["seed_tracks"]) == 1
+    assert second["seed_artists"] == first["seed_artists"][:1]
+
+
+def test_resolve_seeds_drops_unresolved_names(spotify):
+    spotify.miss_probability = 1.0
+    parameters_list = [{"seed_tracks": ["Unknown Song"], "seed_genres": ["ambient"]}]
+    spotify_utils.resolve_seeds(spotify, parameters_list)
+    assert parameters_list[0] == {"seed_tracks": [], "seed_genres": ["ambient"]}
+
+
+def _parameters(**overrides):
+    parameters = {"seed_genres": ["ambient"], "target_valence": 0.3, "target_energy": 0.4, "target_tempo": 100, "limit": 10}
+    parameters.update(overrides)
+    return parameters
+
+
+@pytest.fixture
+def track_index(spotify, monkeypatch):
+    monkeypatch.setattr(spotify_utils, "TRACK_INDEX", True)
+    monkeypatch.setattr(spotify_utils, "TRACK_INDEX_MAX_DISTANCE", 0.5)
+    monkeypatch.setattr(spotify_utils, "RECOMMENDATION_CACHE", False)
+    return spotify_utils.get_track_index()
+
+
+def test_track_index_serves_only_unused_tracks(spotify, track_index):
+    first = spotify_utils.get_spotify_recommendations(spotify, _parameters(limit=40), seeds_resolved=True)
+    assert spotify.stats.summary()["calls"]["recommendations"] == 1 and len(track_index) >= 40
+
+    used = {track_key(track) for track in first[:5]}
+    second = spotify_utils.get_spotify_recommendations(spotify, _parameters(limit=5), seeds_resolved=True, exclude=used)
+    assert spotify.stats.summary()["calls"]["recommendations"] == 1
+    assert len(second) == 5 and not used & {track_key(track) for track in second}
+
+
+def test_track_index_falls_through_when_too_few_unused_tracks_qualify(spotify, track_index):
+    first = spotify_utils.get_spotify_recommendations(spotify, _parameters(limit=10), seeds_resolved=True)
+    used = {track_key(track) for track in first}
+    second = spotify_utils.get_spotify_recommendations(spotify, _parameters(limit=10), seeds_resolved=True, exclude=used)
+    # Remote results overlapping the used tracks are fetched again at a larger limit
+    assert spotify.stats.summary()["calls"]["recommendations"] > 1
+    assert len(second) == 10 and not used & {track_key(track) for track in second}
+
+
+def test_recommendation_cache_key_buckets_close_targets():
+    key = spotify_utils.recommendation_cache_key
+    assert key(_parameters()) == key(_parameters(target_valence=0.31, target_energy=0.41, target_tempo=102))
+    assert key(_parameters()) == key(_parameters(target_valence=0.29, target_energy=0.39, target_tempo=98))
+    assert key(_parameters()) != key(_parameters(target_valence=0.4))
+    assert key(_parameters()) != key(_parameters(target_tempo=110))
+    assert key(_parameters()) != key(_parameters(seed_genres=["piano"]))
+    assert key(_parameters(min_instrumentalness=0.5)) != key(_parameters())
+    assert key(_parameters(seed_genres=["a", "b"])) == key(_parameters(seed_genres=["b", "a"]))
+    assert key(_parameters(), feature_step=0) != key(_parameters(target_valence=0.31), feature_step=0)
+
+
+@pytest.fixture
+def recommendation_cache(spotify, monkeypatch):
+    monkeypatch.setattr(spotify_utils, "TRACK_INDEX", False)
+    monkeypatch.setattr(spotify_utils, "RECOMMENDATION_CACHE", True)
+    return spotify_utils.get_recommendation_cache()
+
+
+def test_recommendation_cache_serves_while_enough_unused_tracks_remain(spotify, recommendation_cache):
+    first = spotify_utils.get_spotify_recommendations(spotify, _parameters(), seeds_resolved=True, spare=10)
+    used = {track_key(track) for track in first[:5]}
+    second = spotify_utils.get_spotify_recommendations(spotify, _parameters(target_valence=0.31), seeds_resolved=True,
+                                                       exclude=used)
+    assert spotify.stats.summary()["calls"]["recommendations"] == 1
+    assert len(second) == 10 and not used & {track_key(track) for track in second}
+
+
+def test_bucket_equal_chapters_of_one_book_each_get_unused_tracks(spotify, recommendation_cache):
+    used = set()
+    for valence, energy in ((0.30, 0.40), (0.31, 0.41), (0.29, 0.39)):
+        tracks = spotify_utils.get_spotify_recommendations(
+            spotify, _parameters(target_valence=valence, target_energy=energy), seeds_resolved=True, spare=10, exclude=used)
+        keys = {track_key(track) for track in tracks}
+        assert len(tracks) == 20 and not used & keys
+        used |= keys
+    assert spotify.stats.summary()["calls"]["recommendations"] <= 4
+
+
+def test_book_playlist_appends_chapters_and_lists_their_sections(spotify):
+    book = spotify_utils.BookPlaylist(spotify, "Dune")
+    tracks = [fake_apis.fake_track(number) for number in range(25)]
+    assert book.add_chapter(1, tracks[:10]) == book.add_chapter(2, tracks[10:25]) == book.playlist_url
+    assert book.add_chapter(3, []) is None
+    book.finish()
+    playlist = spotify._playlists[book.playlist_id]
+    assert playlist["items"] == [track["uri"] for track in tracks]
+    assert playlist["description"] == "Tracks: Ch 1: 1-10, Ch 2: 11-25"
+    assert spotify.stats.summary()["calls"]["user_playlist_create"] == 1
+
+
+def test_book_playlist_description_collapses_the_chapters_that_do_not_fit(spotify):
+    book = spotify_utils.BookPlaylist(spotify, "Dune", "https://open.spotify.com/playlist/abc",
+                                      [(number, 20) for number in range(1, 41)])
+    description = book.description()
+    assert len(description) <= spotify_utils.MAX_DESCRIPTION_LENGTH
+    assert description.startswith("Tracks: Ch 1: 1-20, Ch 2: 21-40,")
+    last = description.rsplit(", ", 1)[-1]
+    first_collapsed = int(last[len("Ch "):last.index("-")])
+    assert last == f"Ch {first_collapsed}-40: {(first_collapsed - 1) * 20 + 1}-800"
+    assert f"Ch {first_collapsed - 1}: " in description
+
+
+def _features(track_id, valence, energy, tempo, instrumentalness):
+    return {"id": track_id, "valence": valence, "energy": energy, "tempo": tempo, "instrumentalness": instrumentalness}
+
+
+def test_rank_recommendations_filters_and_orders_by_distance(monkeypatch):
+    monkeypatch.setattr(spotify_utils, "filter_pass_rate", spotify_utils.FilterPassRate())
+    tracks = [{"id": track_id} for track_id in ("far", "near", "vocal", "unknown", "mid")]
+    features = {"far": _features("far", 0.9, 0.9, 180, 0.9), "near": _features("near", 0.3, 0.4, 100, 0.9),
+                "vocal": _features("vocal", 0.3, 0.4, 100, 0.1), "mid": _features("mid", 0.4, 0.5, 110, 0.9)}
+    ranked = spotify_utils.rank_recommendations(tracks, features, _parameters(min_instrumentalness=0.5), 2, spare=1)
+    assert [track["id"] for track in ranked] == ["near", "mid", "far"]
+    assert spotify_utils.filter_pass_rate.rates == {0.5: 0.5 * 0.7 + 0.3 * 3 / 5}
+
+    ranked = spotify_utils.rank_recommendations(tracks, features, _parameters(), 10)
+    assert [track["id"] for track in ranked] == ["near", "vocal", "mid", "far", "unknown"]
+
+
+def test_filter_pass_rate_sizes_requests_from_observed_pass_rates():
+    rate = spotify_utils.FilterPassRate(initial=0.5, weight=1.0)
+    assert rate.fetch_limit(20) == 20
+    assert rate.fetch_limit(20, 0.5, margin=1.0) == 40
+    rate.update(0.5, 1, 4)
+    assert rate.fetch_limit(20, 0.52, margin=1.0) == 80
+    assert rate.fetch_limit(20, 0.5, margin=2.0) == spotify_utils.MAX_RECOMMENDATIONS
+    rate.update(0.5, 0, 10)
+    assert rate.fetch_limit(2, 0.5, margin=1.0) == 40
+    rate.update(0.5, 10, 10)
+    assert rate.fetch_limit(20, 0.5, margin=1.0) == 20
+
+
+def test_audio_features_are_fetched_in_batches_and_cached(spotify):
+    track_ids = [fake_apis.fake_track(number)["id"] for number in range(250)]
+    features = spotify_utils.get_audio_features(spotify, track_ids + track_ids[:10])
+    assert len(features) == 250 and spotify.stats.summary()["calls"]["audio_features"] == 3
+    assert spotify_utils.get_audio_features(spotify, track_ids[:50]) == {track_id: features[track_id] for track_id in track_ids[:50]}
+    assert spotify.stats.summary()["calls"]["audio_features"] == 3
+
+
+def test_tracks_without_audio_features_are_remembered(spotify, monkeypatch):
+    calls = []
+
+    def audio_features(tracks):
+        calls.append(list(tracks))
+        return [None for _ in tracks]
+
+    monkeypatch.setattr(spotify, "audio_features", audio_features)
+    assert spotify_utils.get_audio_features(spotify, ["missing"]) == {}
+    assert spotify_utils.get_audio_features(spotify, ["missing"]) == {}
+    assert calls == [["missing"]]
@@ -0,0 +1,82 @@
+import pytest
+
+from structured_output import (OutputValidationError, _close_truncated, clamp_parameters, fields_to_fix,
+                               parameter_problems, repair_json, response_format, valid_chapters)
+
+
+def test_valid_json_needs_no_repairs():
+    assert repair_json('{"a": [1, 2]}') == ({"a": [1, 2]}, [])
+
+
+def test_code_fences_and_surrounding_text_are_removed():
+    assert repair_json('Here you go:\n```json\n{"a": 1}\n```') == ({"a": 1}, [])
+    assert repair_json('{"a": 1} hope this helps') == ({"a": 1}, ["extra_text"])
+
+
+def test_trailing_commas_are_dropped_outside_strings():
+    value, repairs = repair_json('{"a": [1, 2,], "b": "x,]",}')
+    assert value == {"a": [1, 2], "b": "x,]"} and repairs == ["trailing_comma"]
+
+
+def test_truncated_list_is_cut_back_to_its_last_complete_item():
+    text = '{"chapters": [{"number": 1, "summary": "A"}, {"number": 2, "summary": "B, then'
+    value, repairs = repair_json(text)
+    # The unfinished chapter keeps its complete fields, and valid_chapters then drops it for lack of a summary
+    assert value == {"chapters": [{"number": 1, "summary": "A"}, {"number": 2}]} and repairs == ["truncated"]
+    assert valid_chapters(value["chapters"]) == [{"number": 1, "summary": "A"}]
+
+
+def test_close_truncated_keeps_brackets_inside_strings():
+    assert _close_truncated('{"a": "{[", "b": [1, 2') == '{"a": "{[", "b": [1]}'
+    assert _close_truncated('[{"a": "x\\"}", "b": 1}, {"c') == '[{"a": "x\\"}", "b": 1}]'
+    assert _close_truncated('{"a": 1}') == '{"a": 1}'
+
+
+def test_close_truncated_gives_up_without_a_complete_value():
+    assert _close_truncated('{"a": "unfinished') is None
+    assert _close_truncated('}') is None
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '{"a": "unfinished'])
+def test_unrepairable_responses_raise(text):
+    with pytest.raises(OutputValidationError):
+        repair_json(text)
+
+
+def test_valid_chapters_drops_bad_items_and_sorts():
+    items = [{"number": "2", "summary": "B"}, {"number": 1, "summary": "A"}, {"number": 2, "summary": "dup"},
+             {"number": 3, "summary": " "}, {"summary": "no number"}, "text"]
+    assert valid_chapters(items) == [{"number": 1, "summary": "A"}, {"number": 2, "summary": "B"}]
+    assert valid_chapters({"number": 1}) == []
+
+
+def test_clamp_parameters_fixes_usable_values():
+    parameters = {"seed_genres": "ambient", "seed_tracks": [], "target_valence": "1.4", "target_energy": -0.2,
+                  "target_tempo": -5, "limit": 80.4}
+    changed = clamp_parameters(parameters)
+    assert parameters == {"seed_genres": ["ambient"], "target_valence": 1, "target_energy": 0, "target_tempo": 0,
+                          "limit": 50}
+    assert set(changed) == {"seed_genres", "target_valence", "target_energy", "target_tempo", "limit"}
+    assert parameter_problems(parameters) == {}
+
+
+def test_clamp_parameters_leaves_valid_values_alone():
+    parameters = {"seed_genres": ["ambient"], "target_valence": 0.5, "target_energy": 0.5, "target_tempo": 120, "limit": 10}
+    assert clamp_parameters(dict(parameters)) == []
+    assert clamp_parameters({"target_valence": True}) == []
+
+
+def test_parameter_problems_and_fields_to_fix():
+    problems = parameter_problems({"seed_genres": ["a", "b", "c"], "seed_artists": ["d", "e", "f"],
+                                   "target_valence": "high", "target_energy": 0.5, "target_tempo": 100, "limit": True})
+    assert set(problems) == {"seeds", "target_valence", "limit"}
+    assert fields_to_fix(problems) == ["seed_genres", "seed_tracks", "seed_artists", "target_valence", "limit"]
+    assert parameter_problems([]) == {"parameters": "Must be a JSON object."}
+    assert len(fields_to_fix({"parameters": "Must be a JSON object."})) == 7
+
+
+def test_response_format_follows_the_mode():
+    schema = {"type": "object"}
+    assert response_format("x", schema, "json_schema")["json_schema"] == {"name": "x", "strict": True, "schema": schema}
+    assert response_format("x", schema, "json_object") == {"type": "json_object"}
+    assert response_format("x", schema, "off") is None
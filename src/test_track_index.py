@@ -0,0 +1,73 @@
+import numpy as np
+
+from fake_apis import fake_audio_features, fake_track
+from track_index import TrackIndex, feature_distances, track_key
+
+
+def _index(tmp_path, count=200, genres=("ambient",)):
+    index = TrackIndex(str(tmp_path / "index"))
+    tracks = [fake_track(number) for number in range(count)]
+    index.add(tracks, {track["id"]: fake_audio_features(track["id"]) for track in tracks}, genres)
+    return index, tracks
+
+
+def test_query_returns_the_closest_tracks_first(tmp_path):
+    index, tracks = _index(tmp_path)
+    result = index.query(0.5, 0.5, 120, limit=5, seed_genres=["ambient"], max_distance=1.0)
+    features = np.array([[fake_audio_features(track["id"])[name] for name in ("valence", "energy", "tempo", "instrumentalness")]
+                         for track in tracks])
+    expected = np.argsort(feature_distances(features, 0.5, 0.5, 120), kind="stable")[:5]
+    assert [track["id"] for track in result] == [tracks[row]["id"] for row in expected]
+
+
+def test_query_needs_limit_qualifying_tracks(tmp_path):
+    index, _ = _index(tmp_path, count=20)
+    assert index.query(0.5, 0.5, 120, limit=5, seed_genres=["jazz"], max_distance=1.0) is None
+    assert index.query(0.5, 0.5, 120, limit=5, seed_genres=["ambient"], max_distance=0.0) is None
+    assert index.query(0.5, 0.5, 120, limit=5, min_instrumentalness=1.01, max_distance=1.0) is None
+
+
+def test_query_leaves_out_excluded_tracks(tmp_path):
+    index, _ = _index(tmp_path)
+    first = index.query(0.5, 0.5, 120, limit=5, seed_genres=["ambient"], max_distance=1.0)
+    used = {track_key(track) for track in first}
+    second = index.query(0.5, 0.5, 120, limit=5, seed_genres=["ambient"], max_distance=1.0, exclude=used)
+    assert len(second) == 5 and not used & {track_key(track) for track in second}
+
+
+def test_query_declines_when_excluded_tracks_leave_too_few(tmp_path):
+    index, tracks = _index(tmp_path, count=8)
+    used = {track_key(track) for track in tracks[:4]}
+    assert index.query(0.5, 0.5, 120, limit=5, max_distance=10.0) is not None
+    assert index.query(0.5, 0.5, 120, limit=5, max_distance=10.0, exclude=used) is None
+
+
+def test_query_returns_spare_tracks(tmp_path):
+    index, _ = _index(tmp_path)
+    assert len(index.query(0.5, 0.5, 120, limit=5, max_distance=1.0, spare=3)) == 8
+
+
+def test_seed_artists_and_tracks_qualify_without_a_genre(tmp_path):
+    index, tracks = _index(tmp_path, count=40)
+    artist = tracks[0]["artists"][0]["id"]
+    result = index.query(0.5, 0.5, 120, limit=1, seed_genres=["jazz"], seed_artists=[artist], max_distance=10.0)
+    assert result[0]["artists"][0]["id"] == artist
+    result = index.query(0.5, 0.5, 120, limit=1, seed_tracks=[tracks[3]["id"]], max_distance=10.0)
+    assert result[0]["id"] == tracks[3]["id"]
+
+
+def test_index_is_saved_and_loaded(tmp_path):
+    index, tracks = _index(tmp_path, count=30)
+    index.save()
+    loaded = TrackIndex(str(tmp_path / "index"))
+    assert len(loaded) == 30 and loaded.genres == ["ambient"]
+    assert loaded.query(0.5, 0.5, 120, limit=3, seed_genres=["ambient"], max_distance=1.0) == \
+        index.query(0.5, 0.5, 120, limit=3, seed_genres=["ambient"], max_distance=1.0)
+
+
+def test_adding_known_tracks_only_tags_genres(tmp_path):
+    index, tracks = _index(tmp_path, count=10)
+    assert index.add(tracks[:5], {track["id"]: fake_audio_features(track["id"]) for track in tracks[:5]}, ["piano"]) == 0
+    assert len(index) == 10
+    assert len(index.query(0.5, 0.5, 120, limit=5, seed_genres=["piano"], max_distance=10.0)) == 5
+    assert index.query(0.5, 0.5, 120, limit=6, seed_genres=["piano"], max_distance=10.0) is None
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from cache_utils import normalize_query
+from config import CACHE_DIR
+
+TRACK_INDEX_DIR = os.path.join(CACHE_DIR, "track_index")
+
+# Columns of the feature matrix
+FEATURES = ("valence", "energy", "tempo", "instrumentalness")
+# Tempo differences are divided by this so a few BPM weigh about as much as a few hundredths of valence/energy
+TEMPO_SCALE = 200.0
+
+
+def feature_distances(features, target_valence, target_energy, target_tempo):
+    """Distances of feature rows (in FEATURES column order) to the targets in (valence, energy, tempo / TEMPO_SCALE) space."""
+    target = np.array([target_valence, target_energy, target_tempo / TEMPO_SCALE], dtype=np.float32)
+    scaled = np.asarray(features, dtype=np.float32)[:, :3] / np.array([1.0, 1.0, TEMPO_SCALE], dtype=np.float32)
+    return np.sqrt(((scaled - target) ** 2).sum(axis=1))
+
+
+def compact_track(track):
+    """The fields of a Spotify track object that playlists and deduplication use."""
+    return {
+        "id": track["id"],
+        "name": track["name"],
+        "uri": track["uri"],
+        "artists": [{"id": artist["id"], "name": artist["name"]} for artist in track.get("artists", [])],
+    }
+
+
+def track_key(track):
+    """Deduplication key of a track: its normalized name and first artist, so re-releases under new IDs also match."""
+    artists = track.get('artists') or [{}]
+    return f"{normalize_query(track.get('name', ''))}|{artists[0].get('id') or artists[0].get('name', '')}"
+
+
+class TrackIndex:
+    """
+    Local catalog of tracks seen in earlier recommendations, queryable by audio features.
+
+    Audio features are kept in a float32 matrix, genres in a boolean track x genre matrix and the
+    primary artist of each track as an index into an artist vocabulary. The arrays are saved as
+    .npy files and memory-mapped on load; track payloads and vocabularies live in a JSON file.
+    Instances are safe to share between threads.
+    """
+
+    def __init__(self, directory=TRACK_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.tracks = []
+        self.rows = {}
+        self.genres = []
+        self.genre_columns = {}
+        self.artists = []
+        self.artist_numbers = {}
+        self.features = np.zeros((0, len(FEATURES)), dtype=np.float32)
+        self.genre_matrix = np.zeros((0, 0), dtype=bool)
+        self.artist_rows = np.zeros(0, dtype=np.int32)
+        self.dirty = False
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        if not os.path.exists(self._path("tracks.json")):
+            return
+        try:
+            with open(self._path("tracks.json"), "r") as f:
+                meta = json.load(f)
+            features = np.load(self._path("features.npy"), mmap_mode="r")
+            genre_matrix = np.load(self._path("genres.npy"), mmap_mode="r")
+            artist_rows = np.load(self._path("artists.npy"), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable track index in {self.directory}: {e}")
+            return
+        if not len(meta["tracks"]) == len(features) == len(genre_matrix) == len(artist_rows):
+            logging.warning(f"Ignoring inconsistent track index in {self.directory}")
+            return
+        self.tracks = meta["tracks"]
+        self.rows = {track["id"]: row for row, track in enumerate(self.tracks)}
+        self.genres = meta["genres"]
+        self.genre_columns = {genre: column for column, genre in enumerate(self.genres)}
+        self.artists = meta["artists"]
+        self.artist_numbers = {artist: number for number, artist in enumerate(self.artists)}
+        self.features = features
+        self.genre_matrix = genre_matrix
+        self.artist_rows = artist_rows
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _genre_column(self, genre):
+        if genre not in self.genre_columns:
+            self.genre_columns[genre] = len(self.genres)
+            self.genres.append(genre)
+        return self.genre_columns[genre]
+
+    def _artist_number(self, artist_id):
+        if artist_id not in self.artist_numbers:
+            self.artist_numbers[artist_id] = len(self.artists)
+            self.artists.append(artist_id)
+        return self.artist_numbers[artist_id]
+
+    def add(self, tracks, audio_features, genres=()):
+        """
+        Add tracks with their audio features (a dict of track ID to features dict).
+
+        Tracks are tagged with `genres`, the seed genres of the request that returned them. Tracks
+        without features are skipped; tracks already in the index only gain the new genre tags.
+        """
+        with self._lock:
+            columns = [self._genre_column(genre) for genre in genres]
+            genre_matrix = np.zeros((len(self.tracks), len(self.genres)), dtype=bool)
+            genre_matrix[:, :self.genre_matrix.shape[1]] = self.genre_matrix
+
+            new_features, new_artists = [], []
+            for track in tracks:
+                features = audio_features.get(track["id"])
+                row = self.rows.get(track["id"])
+                if row is not None:
+                    # Rows added earlier in this call are tagged below
+                    if row < len(genre_matrix):
+                        genre_matrix[row, columns] = True
+                    continue
+                if not features:
+                    continue
+                self.rows[track["id"]] = len(self.tracks)
+                self.tracks.append(compact_track(track))
+                new_features.append([features[name] for name in FEATURES])
+                artists = track.get("artists") or [{"id": ""}]
+                new_artists.append(self._artist_number(artists[0]["id"]))
+
+            added = np.zeros((len(new_features), len(self.genres)), dtype=bool)
+            added[:, columns] = True
+            self.genre_matrix = np.concatenate([genre_matrix, added])
+            if new_features:
+                self.features = np.concatenate([self.features, np.asarray(new_features, dtype=np.float32)])
+                self.artist_rows = np.concatenate([self.artist_rows, np.asarray(new_artists, dtype=np.int32)])
+            self.dirty = True
+            return len(new_features)
+
+    def query(self, target_valence, target_energy, target_tempo, limit, min_instrumentalness=None,
+              seed_genres=None, seed_artists=None, seed_tracks=None, max_distance=0.15, spare=0, exclude=None):
+        """
+        Return the `limit` indexed tracks closest to the targets, or None if fewer than `limit` qualify.
+        Up to `spare` further qualifying tracks are appended, closest first.
+
+        Candidates must share a seed genre or artist, or be a seed track (any track when there
+        are no seeds), meet `min_instrumentalness` and lie within `max_distance` of the targets in
+        (valence, energy, tempo / TEMPO_SCALE) space. Tracks whose track_key is in `exclude` (those
+        the book already uses) never qualify.
+        """
+        with self._lock:
+            # add() replaces the arrays rather than growing them, so this snapshot stays consistent
+            tracks, features, genre_matrix, artist_rows = self.tracks, self.features, self.genre_matrix, self.artist_rows
+            size = len(features)
+            columns = [self.genre_columns[genre] for genre in seed_genres or [] if genre in self.genre_columns]
+            artist_numbers = [self.artist_numbers[artist] for artist in seed_artists or [] if artist in self.artist_numbers]
+            seed_rows = [self.rows[track] for track in seed_tracks or [] if track in self.rows]
+        if size < limit:
+            return None
+
+        if seed_genres or seed_artists or seed_tracks:
+            mask = np.zeros(size, dtype=bool)
+            if columns:
+                mask |= genre_matrix[:, columns].any(axis=1)
+            if artist_numbers:
+                mask |= np.isin(artist_rows, artist_numbers)
+            mask[seed_rows] = True
+        else:
+            mask = np.ones(size, dtype=bool)
+        if min_instrumentalness is not None:
+            mask &= features[:, 3] >= min_instrumentalness
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) < limit:
+            return None
+        distances = feature_distances(features[candidates], target_valence, target_energy, target_tempo)
+        close = distances <= max_distance
+        candidates, distances = candidates[close], distances[close]
+        if exclude:
+            unused = np.array([track_key(tracks[row]) not in exclude for row in candidates], dtype=bool)
+            candidates, distances = candidates[unused], distances[unused]
+        if len(candidates) < limit:
+            return None
+
+        count = min(limit + spare, len(candidates))
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [tracks[row] for row in candidates[nearest]]
+
+    def save(self):
+        """Write the index to disk if it changed, replacing each file atomically."""
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            for name, array in (("features.npy", self.features), ("genres.npy", self.genre_matrix),
+                                ("artists.npy", self.artist_rows)):
+                with open(self._path(name + ".tmp"), "wb") as f:
+                    np.save(f, np.ascontiguousarray(array))
+                os.replace(self._path(name + ".tmp"), self._path(name))
+            # Written last: a crash before this point leaves lengths that _load rejects
+            with open(self._path("tracks.json.tmp"), "w") as f:
+                json.dump({"tracks": self.tracks, "genres": self.genres, "artists": self.artists}, f)
+            os.replace(self._path("tracks.json.tmp"), self._path("tracks.json"))
+            self.dirty = False
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.dirty = True
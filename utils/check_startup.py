@@ -0,0 +1,94 @@
+"""
+Start-up time check for the command-line entry point.
+
+Imports src/main.py in a fresh interpreter, fails if that pulls in one of the heavy modules that
+should only load when a run starts, and times the `import`, `list` and `validate` commands against a budget.
+Exits with status 1 on a regression.
+
+Usage:
+    python utils/check_startup.py [--budget 1.0] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Modules that must not be loaded by `import main`
+HEAVY_MODULES = ["langchain", "langchain_core", "langchain_community", "langchain_openai", "openai",
+                 "spotipy", "tenacity", "numpy", "requests"]
+
+SAMPLE_CONFIG = {"book_title": "Startup Check", "user_input": "", "music_preferences": "",
+                 "vocal_preference": "b", "min_instrumentalness": ""}
+
+def run_python(arguments, env=None):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + arguments, cwd=SRC_DIR, capture_output=True, text=True,
+                            env=dict(os.environ, **(env or {})))
+    return time.perf_counter() - start, result
+
+def check_imports():
+    code = ("import sys, main; "
+            f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    _, result = run_python(["-c", code])
+    if result.returncode != 0:
+        print(f"Error: importing main failed:\n{result.stderr}")
+        return False
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    if loaded:
+        print(f"Error: importing main loads heavy modules: {', '.join(loaded)}")
+        return False
+    print("import main: no heavy modules loaded")
+    return True
+
+def check_command(arguments, budget, repeat, env=None):
+    timings = []
+    for _ in range(repeat):
+        elapsed, result = run_python(["main.py"] + arguments, env)
+        if result.returncode != 0:
+            print(f"Error: main.py {' '.join(arguments)} failed:\n{result.stdout}{result.stderr}")
+            return False
+        timings.append(elapsed)
+    best = min(timings)
+    status = "ok" if best <= budget else "too slow"
+    print(f"main.py {' '.join(arguments)}: best of {repeat} {best:.3f}s (budget {budget:.3f}s) {status}")
+    return best <= budget
+
+def slowest_imports(count=10):
+    _, result = run_python(["-X", "importtime", "-c", "import main"])
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[1].isdigit():
+            rows.append((int(parts[1]), parts[2]))
+    print("Slowest imports under `import main` (cumulative microseconds):")
+    for cumulative, name in sorted(rows, reverse=True)[:count]:
+        print(f"{cumulative:>10}  {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the start-up time of src/main.py.")
+    parser.add_argument("--budget", type=float, default=1.0, help="Seconds allowed for the list and validate commands")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per command; the fastest counts")
+    args = parser.parse_args()
+
+    ok = check_imports()
+    with tempfile.TemporaryDirectory() as directory:
+        # A throwaway configuration store, so the check neither reads nor creates the real one
+        env = {"CONFIG_DB_PATH": os.path.join(directory, "configs.sqlite3")}
+        config_path = os.path.join(directory, "startup_check.json")
+        with open(config_path, "w") as f:
+            json.dump(SAMPLE_CONFIG, f)
+        ok = check_command(["import", config_path], args.budget, 1, env) and ok
+        ok = check_command(["list"], args.budget, args.repeat, env) and ok
+        ok = check_command(["validate", "startup_check"], args.budget, args.repeat, env) and ok
+    slowest_imports()
+    if not ok:
+        sys.exit(1)
+    print("Start-up checks passed.")
+
+if __name__ == "__main__":
+    main()